@@ -2,20 +2,52 @@
 
 import os
 import logging
+import multiprocessing
 from datetime import datetime
-from flask import Flask, render_template, request, redirect, url_for, send_file, flash, session
-from werkzeug.utils import secure_filename
-
-from xml_parser import parse_single_invoice, ParseError
-from csv_generator import generate_summary_csv, generate_detail_csv, CSVGenerationError
-from utils.validators import validate_file, validate_files_count, ValidationError
+from flask import Flask, Response, render_template, request, redirect, url_for, send_file, flash, session, jsonify
+
+from csv_generator import (
+    iter_csv_zip,
+    ZIP_COMPRESSION_LEVEL,
+    PREVIEW_ROWS,
+    OUTPUT_FORMATS,
+    DEFAULT_OUTPUT_FORMAT,
+    PARQUET_AVAILABLE
+)
+from parse_cache import get_parse_cache
+from jobs import (
+    JobQueue,
+    JobStore,
+    run_upload_job,
+    run_append_job,
+    JOBS_DB_PATH,
+    JOB_WORKERS,
+    JOB_QUEUED,
+    JOB_RUNNING,
+    JOB_DONE,
+    JOB_FILES_PAGE
+)
+from upload_stream import receive_multipart
+from pipeline import (
+    iter_batch_files,
+    iter_process_xml_files,
+    summarize_results,
+    DEFAULT_PROCESSING_MODE,
+    DEFAULT_PROCESSING_WORKERS,
+    UPLOAD_SPILL_BYTES
+)
+from utils.validators import validate_files_count, ValidationError, MAX_FILES, MAX_FILE_SIZE
 from utils.file_manager import (
     ensure_directories,
-    cleanup_old_files,
-    create_zip_archive,
     sanitize_filename,
-    extract_xml_from_zip
+    new_batch_id,
+    create_batch_dir,
+    batch_path,
+    remove_batch_dir,
+    unique_path,
+    FileSweeper
 )
+from utils.metrics import inc, stage_timer, render_metrics, METRICS_ENABLED, METRICS_DIR
 
 # Configure logging
 logging.basicConfig(
@@ -37,218 +69,463 @@ OUTPUT_FOLDER = 'outputs'
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 app.config['OUTPUT_FOLDER'] = OUTPUT_FOLDER
 
-# Max content length from environment (for production) or default 10MB
-MAX_CONTENT_MB = int(os.environ.get('MAX_CONTENT_LENGTH', 10 * 1024 * 1024))
+# Max request size from environment (for production) or default 4GB; uploads
+# are spooled to disk and processed with bounded memory
+MAX_CONTENT_MB = int(os.environ.get('MAX_CONTENT_LENGTH', 4 * 1024 * 1024 * 1024))
 app.config['MAX_CONTENT_LENGTH'] = MAX_CONTENT_MB
 
-# Ensure directories exist
+# Every file is a form part; leave room for the other fields
+app.config['MAX_FORM_PARTS'] = MAX_FILES + 10
+
+# Parallel processing: 'process' (default), 'thread' or 'serial'
+app.config['PROCESSING_MODE'] = DEFAULT_PROCESSING_MODE
+app.config['PROCESSING_WORKERS'] = DEFAULT_PROCESSING_WORKERS
+
+# Deflate level of the generated ZIP (0-9, 0 = no compression)
+app.config['ZIP_COMPRESSION_LEVEL'] = ZIP_COMPRESSION_LEVEL
+
+# XML files streamed with ?output=zip are kept in memory up to this size
+app.config['UPLOAD_SPILL_BYTES'] = UPLOAD_SPILL_BYTES
+
+# Rows of each CSV shown in the results page preview
+app.config['PREVIEW_ROWS'] = PREVIEW_ROWS
+
+# Background jobs: database and number of worker threads
+app.config['JOBS_DB_PATH'] = JOBS_DB_PATH
+app.config['JOB_WORKERS'] = JOB_WORKERS
+
+# Ensure directories exist; metrics are only saved when their directory exists
 ensure_directories(UPLOAD_FOLDER, OUTPUT_FOLDER)
+if METRICS_ENABLED:
+    ensure_directories(METRICS_DIR)
+
+
+def _batch_in_use(path):
+    """Tell the sweeper whether an entry belongs to a queued or running job."""
+    return os.path.basename(path) in job_queue.store.active_batch_ids()
+
+
+def _purge_jobs(cutoff):
+    """Delete the records of the jobs that finished before the sweeper's cutoff."""
+    job_queue.store.purge_finished(cutoff)
+
+
+# Expired uploads and outputs are deleted by a background thread, started
+# with start_background_services; the directories of pending jobs are kept.
+# The same pass deletes the records of the jobs that expired.
+file_sweeper = FileSweeper([UPLOAD_FOLDER, OUTPUT_FOLDER], in_use=_batch_in_use, on_sweep=_purge_jobs)
+
+
+def _run_job(store, job):
+    """Run an upload job with the application's processing settings.
+
+    The job id is also the batch id: the uploads are read from
+    ``uploads/<id>/``, which is deleted once the job ends, and the results
+    are written to ``outputs/<id>/``, which the sweeper deletes as a unit.
+    An append job writes to the directory of the batch it appends to.
+    """
+    runner = run_append_job if job['options'].get('append_to') else run_upload_job
+    try:
+        result = runner(
+            store, job, app.config['OUTPUT_FOLDER'],
+            mode=app.config['PROCESSING_MODE'],
+            max_workers=app.config['PROCESSING_WORKERS'],
+            compresslevel=app.config['ZIP_COMPRESSION_LEVEL'],
+            preview_rows=app.config['PREVIEW_ROWS']
+        )
+    finally:
+        remove_batch_dir(batch_path(app.config['UPLOAD_FOLDER'], job['id']))
+    if result.get('zip_file'):
+        file_sweeper.track(batch_path(app.config['OUTPUT_FOLDER'], result.get('batch_id') or job['id']))
+    return result
+
+
+# Uploads are processed by worker threads, started with the other
+# background services so jobs left queued by a previous run resume
+job_queue = JobQueue(JobStore(app.config['JOBS_DB_PATH']), _run_job, workers=app.config['JOB_WORKERS'])
 
 
-@app.before_request
-def before_request():
-    """Clean up old files before each request."""
-    cleanup_old_files(app.config['UPLOAD_FOLDER'])
-    cleanup_old_files(app.config['OUTPUT_FOLDER'])
+def start_background_services():
+    """Start the background threads of the server process.
+
+    Called by the entry points (run_server.py, wsgi.py, ``python app.py``)
+    rather than on import: the worker processes of the parallel parsing
+    pool import the server modules again and must not start their own.
+    """
+    if multiprocessing.parent_process() is not None:
+        return
+    file_sweeper.start()
+    job_queue.start()
 
 
 @app.route('/')
 def index():
     """Render the main upload form page."""
-    return render_template('index.html')
+    return render_template(
+        'index.html',
+        max_files=MAX_FILES,
+        max_file_size=MAX_FILE_SIZE,
+        max_upload_size=app.config['MAX_CONTENT_LENGTH'],
+        parquet_available=PARQUET_AVAILABLE
+    )
+
+
+def _output_format(value):
+    """Validate the output format requested for a batch.
+
+    Args:
+        value: Requested format, or None/empty for the default
+
+    Returns:
+        One of OUTPUT_FORMATS
+
+    Raises:
+        ValidationError: If the format is unknown or pyarrow is missing
+    """
+    output_format = (value or DEFAULT_OUTPUT_FORMAT).lower()
+    if output_format not in OUTPUT_FORMATS:
+        raise ValidationError(f"Formato de salida no válido: {value}. Opciones: {', '.join(OUTPUT_FORMATS)}.")
+    if output_format == 'parquet' and not PARQUET_AVAILABLE:
+        raise ValidationError('La salida Parquet requiere el paquete pyarrow (pip install pyarrow).')
+    return output_format
 
 
 @app.route('/upload', methods=['POST'])
 def upload_files():
-    """Handle file upload and processing."""
+    """Save the uploaded files and queue them for processing.
+
+    Returns right away: the browser is sent to the results page, which
+    polls the job. Clients that accept JSON get the job id and its status
+    URL instead (202). With ``output=zip`` the batch is processed in the
+    request and the ZIP is streamed back as the response body; given in
+    the query string, the files are processed while they are uploaded.
+    ``output_format`` (``csv`` or ``parquet``) selects the files in the ZIP.
+    """
+    if request.args.get('output') == 'zip':
+        return _receive_and_stream()
+
+    wants_json = request.accept_mimetypes.best == 'application/json'
+
+    def fail(message, status=400):
+        if wants_json:
+            return jsonify({'error': message}), status
+        flash(message, 'error')
+        return redirect(url_for('index'))
+
     try:
         # Check if files were uploaded
         if 'files' not in request.files:
-            flash('No se seleccionaron archivos.', 'error')
-            return redirect(url_for('index'))
+            return fail('No se seleccionaron archivos.')
 
         files = request.files.getlist('files')
 
-        # Validate file count
+        # Validate file count and output format
         try:
             validate_files_count(len(files))
+            output_format = _output_format(request.form.get('output_format'))
         except ValidationError as e:
-            flash(str(e), 'error')
-            return redirect(url_for('index'))
+            return fail(str(e))
 
-        # Process files
-        uploaded_files = []
-        validation_errors = []
-        parsing_errors = []
-        parsed_invoices = []
-        xml_files_to_process = []
+        batch_id, upload_dir, uploads = _save_uploads(files)
+        total_count = len(uploads)
 
+        # API clients can ask for the ZIP itself as the response body
+        if request.form.get('output') == 'zip':
+            try:
+                return _process_and_stream(uploads, output_format)
+            finally:
+                remove_batch_dir(upload_dir)
+
+        job_id = job_queue.submit(uploads, total_count, options={'output_format': output_format}, job_id=batch_id)
+        session['job_id'] = job_id
+
+        if wants_json:
+            return jsonify({
+                'job_id': job_id,
+                'status_url': url_for('job_status', job_id=job_id),
+                'results_url': url_for('results', job=job_id)
+            }), 202
+        return redirect(url_for('results', job=job_id))
+
+    except Exception as e:
+        logger.error(f"Unexpected error in upload: {e}")
+        return fail(f'Error inesperado: {e}', 500)
+
+
+@app.route('/batches/<batch_id>/append', methods=['POST'])
+def append_files(batch_id):
+    """Queue uploaded files to be added to the results of an earlier batch.
+
+    Invoices already in the batch (same CUFE) are skipped and the others
+    are appended to its ZIP as a new pair of CSVs (see
+    ``run_append_job``). Responds like ``/upload``: the results page of
+    the append job, or its id and status URL for JSON clients.
+    """
+    wants_json = request.accept_mimetypes.best == 'application/json'
+
+    def fail(message, status=400):
+        if wants_json:
+            return jsonify({'error': message}), status
+        flash(message, 'error')
+        return redirect(url_for('results', job=batch_id))
+
+    batch = job_queue.store.get_job(batch_id, files=False)
+    result = (batch or {}).get('result') or {}
+    # Appending to an append job adds to the batch it appended to
+    target_id = result.get('batch_id') or batch_id
+    zip_path = None
+    if batch is not None and batch['status'] == JOB_DONE and result.get('zip_file'):
+        zip_path = batch_path(app.config['OUTPUT_FOLDER'], target_id, result['zip_file'])
+    if zip_path is None or not os.path.isfile(zip_path):
+        return fail('Lote no encontrado o expirado.', 404)
+
+    files = request.files.getlist('files')
+    if not any(file.filename for file in files):
+        return fail('No se seleccionaron archivos.')
+    try:
+        validate_files_count(len(files))
+        output_format = _output_format(request.form.get('output_format'))
+    except ValidationError as e:
+        return fail(str(e))
+
+    try:
+        job_id, _, uploads = _save_uploads(files)
+        options = {'append_to': target_id, 'output_format': output_format}
+        job_id = job_queue.submit(uploads, len(uploads), options=options, job_id=job_id)
+    except Exception as e:
+        logger.error(f"Unexpected error in append: {e}")
+        return fail(f'Error inesperado: {e}', 500)
+    session['job_id'] = job_id
+
+    if wants_json:
+        return jsonify({
+            'job_id': job_id,
+            'batch_id': target_id,
+            'status_url': url_for('job_status', job_id=job_id),
+            'results_url': url_for('results', job=job_id)
+        }), 202
+    return redirect(url_for('results', job=job_id))
+
+
+def _save_uploads(files):
+    """Save uploaded files in a new batch directory.
+
+    ZIP archives are kept whole; their XML members are read when the batch
+    is processed. Empty file inputs are left out.
+
+    Args:
+        files: Uploaded files (werkzeug FileStorage objects)
+
+    Returns:
+        Tuple of (batch id, batch directory, uploads as dictionaries with
+        ``path``, ``filename`` and ``kind``)
+    """
+    uploads = []
+    batch_id = new_batch_id()
+    upload_dir = create_batch_dir(app.config['UPLOAD_FOLDER'], batch_id)
+    file_sweeper.track(upload_dir)
+
+    with stage_timer('save'):
         for file in files:
             if file.filename == '':
                 continue
 
-            # Sanitize filename
+            # Sanitize filename; repeated names get a numbered suffix
             filename = sanitize_filename(file.filename)
-            timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-            unique_filename = f"{timestamp}_{filename}"
-            file_path = os.path.join(app.config['UPLOAD_FOLDER'], unique_filename)
+            file_path = unique_path(upload_dir, filename)
 
             # Save file
             file.save(file_path)
-            uploaded_files.append({'original': filename, 'path': file_path})
-
-            # Check if it's a ZIP file
-            if filename.lower().endswith('.zip'):
-                try:
-                    # Extract XML files from ZIP
-                    extracted_files = extract_xml_from_zip(file_path, app.config['UPLOAD_FOLDER'])
-                    logger.info(f"Extracted {len(extracted_files)} XML files from {filename}")
-
-                    # Add extracted files to processing list
-                    for extracted_file in extracted_files:
-                        xml_files_to_process.append({
-                            'path': extracted_file,
-                            'filename': os.path.basename(extracted_file),
-                            'from_zip': filename
-                        })
-
-                except IOError as e:
-                    validation_errors.append({'file': filename, 'error': str(e)})
-                    logger.error(f"ZIP extraction error for {filename}: {e}")
-                    continue
-            else:
-                # Regular XML file
-                xml_files_to_process.append({
-                    'path': file_path,
-                    'filename': filename,
-                    'from_zip': None
-                })
-
-        # Process all XML files (both direct uploads and extracted from ZIPs)
-        for xml_file_info in xml_files_to_process:
-            file_path = xml_file_info['path']
-            filename = xml_file_info['filename']
-
-            # Validate file (skip extension check for extracted files)
-            if xml_file_info['from_zip']:
-                # For extracted files, only validate size, well-formedness, and namespace
-                from utils.validators import validate_file_size, validate_xml_wellformed, validate_ubl_namespace
-                try:
-                    validate_file_size(file_path)
-                    validate_xml_wellformed(file_path)
-                    validate_ubl_namespace(file_path)
-                    is_valid = True
-                    error_msg = ""
-                except ValidationError as e:
-                    is_valid = False
-                    error_msg = str(e)
-            else:
-                # For direct uploads, run full validation
-                is_valid, error_msg = validate_file(file_path, filename)
-
-            if not is_valid:
-                source = f"{filename} (from {xml_file_info['from_zip']})" if xml_file_info['from_zip'] else filename
-                validation_errors.append({'file': source, 'error': error_msg})
-                continue
+            uploads.append({
+                'path': file_path,
+                'filename': filename,
+                'kind': 'zip' if filename.lower().endswith('.zip') else 'xml'
+            })
+    if METRICS_ENABLED:
+        inc('fac2csv_bytes_processed_total', sum(os.path.getsize(u['path']) for u in uploads), stage='save')
+
+    return batch_id, upload_dir, uploads
+
+
+def _process_and_stream(uploads, output_format=DEFAULT_OUTPUT_FORMAT):
+    """Process a batch in the request and stream the results ZIP."""
+    # ZIP members are read as the pool takes them; only parsed invoices pile up
+    results = iter_process_xml_files(
+        iter_batch_files(uploads),
+        mode=app.config['PROCESSING_MODE'],
+        max_workers=app.config['PROCESSING_WORKERS']
+    )
+    return _batch_response(list(results), output_format)
 
-            # Parse invoice
-            try:
-                invoice_data = parse_single_invoice(file_path)
-                parsed_invoices.append(invoice_data)
-                source = f"{filename} (from {xml_file_info['from_zip']})" if xml_file_info['from_zip'] else filename
-                logger.info(f"Successfully parsed: {source}")
-            except ParseError as e:
-                source = f"{filename} (from {xml_file_info['from_zip']})" if xml_file_info['from_zip'] else filename
-                parsing_errors.append({'file': source, 'error': str(e)})
-                logger.error(f"Parse error for {source}: {e}")
-
-        # Check if we have any valid invoices
-        if not parsed_invoices:
-            flash('No se pudo procesar ninguna factura. Revise los errores.', 'error')
-            session['validation_errors'] = validation_errors
-            session['parsing_errors'] = parsing_errors
-            return redirect(url_for('results'))
-
-        # Generate CSVs
-        try:
-            timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-            summary_filename = f"facturas_resumen_{timestamp}.csv"
-            detail_filename = f"facturas_detalle_{timestamp}.csv"
-
-            summary_path = os.path.join(app.config['OUTPUT_FOLDER'], summary_filename)
-            detail_path = os.path.join(app.config['OUTPUT_FOLDER'], detail_filename)
-
-            generate_summary_csv(parsed_invoices, summary_path)
-            generate_detail_csv(parsed_invoices, detail_path)
-
-            # Create ZIP archive
-            zip_filename = f"facturas_{timestamp}.zip"
-            zip_path = os.path.join(app.config['OUTPUT_FOLDER'], zip_filename)
-            create_zip_archive([summary_path, detail_path], zip_path)
-
-            # Store results in session
-            session['zip_file'] = zip_filename
-            session['summary_file'] = summary_filename
-            session['detail_file'] = detail_filename
-            session['processed_count'] = len(parsed_invoices)
-            session['total_count'] = len([f for f in files if f.filename != ''])
-            session['validation_errors'] = validation_errors
-            session['parsing_errors'] = parsing_errors
-
-            flash(f'¡Procesamiento exitoso! {len(parsed_invoices)} factura(s) convertida(s).', 'success')
-            return redirect(url_for('results'))
-
-        except CSVGenerationError as e:
-            flash(f'Error generando archivos CSV: {e}', 'error')
-            logger.error(f"CSV generation error: {e}")
-            return redirect(url_for('index'))
 
-    except Exception as e:
-        logger.error(f"Unexpected error in upload: {e}")
-        flash(f'Error inesperado: {e}', 'error')
-        return redirect(url_for('index'))
+def _receive_and_stream():
+    """Process the files of an upload while its body arrives and stream the results ZIP.
+
+    The body is read straight from the request stream (see
+    ``upload_stream``) instead of being saved to disk before processing.
+    """
+    boundary = request.mimetype_params.get('boundary')
+    if request.mimetype != 'multipart/form-data' or not boundary:
+        return jsonify({'error': 'Se esperaba un formulario multipart/form-data.'}), 400
+
+    # The form fields are not read before the files: the format is given in the URL
+    try:
+        output_format = _output_format(request.args.get('output_format'))
+    except ValidationError as e:
+        return jsonify({'error': str(e)}), 400
+
+    upload_dir = create_batch_dir(app.config['UPLOAD_FOLDER'], new_batch_id())
+    file_sweeper.track(upload_dir)
+    try:
+        upload = receive_multipart(
+            request.stream, boundary.encode('latin-1'), upload_dir,
+            spill_threshold=app.config['UPLOAD_SPILL_BYTES'],
+            mode=app.config['PROCESSING_MODE'],
+            max_workers=app.config['PROCESSING_WORKERS']
+        )
+    except ValidationError as e:
+        return jsonify({'error': str(e)}), 400
+    finally:
+        remove_batch_dir(upload_dir)
+
+    return _batch_response(upload.results, output_format)
+
+
+def _batch_response(results, output_format=DEFAULT_OUTPUT_FORMAT):
+    """Stream the results ZIP of a processed batch, or report why there is none."""
+    batch = summarize_results(results)
+    errors = batch.validation_errors + batch.parsing_errors
+
+    if not batch.invoices:
+        return jsonify({'error': 'No se pudo procesar ninguna factura.', 'errors': errors}), 422
+
+    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    return _zip_response(
+        batch.invoices, f"facturas_{timestamp}.zip",
+        f"facturas_resumen_{timestamp}.{output_format}", f"facturas_detalle_{timestamp}.{output_format}",
+        error_count=len(errors), output_format=output_format
+    )
+
+
+def _zip_response(invoices, zip_filename, summary_filename, detail_filename, error_count=0,
+                  output_format=DEFAULT_OUTPUT_FORMAT):
+    """Build a response that streams the ZIP archive while it is generated.
+
+    Args:
+        invoices: Parsed invoices
+        zip_filename: Download name of the archive
+        summary_filename: Entry name of the summary CSV
+        detail_filename: Entry name of the detail CSV
+        error_count: Number of files that could not be processed
+        output_format: Format of the entries (one of OUTPUT_FORMATS)
+
+    Returns:
+        Streaming Flask response
+    """
+    body = iter_csv_zip(
+        invoices, summary_filename, detail_filename,
+        compresslevel=app.config['ZIP_COMPRESSION_LEVEL'],
+        output_format=output_format
+    )
+    response = Response(body, mimetype='application/zip')
+    response.headers['Content-Disposition'] = f'attachment; filename={zip_filename}'
+    response.headers['X-Processed-Count'] = str(len(invoices))
+    response.headers['X-Error-Count'] = str(error_count)
+    return response
+
+
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    """Report the progress of an upload job as JSON.
+
+    Only the files finished from ``?since=<seq>`` on are listed, at most
+    JOB_FILES_PAGE of them; the poller passes back ``next_file`` to get the
+    following ones, so each poll costs the same whatever the batch size.
+    """
+    job = job_queue.store.get_job(job_id, files=False)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+
+    since = request.args.get('since', 0, type=int)
+    progress = job_queue.store.get_file_progress(job_id, since, JOB_FILES_PAGE)
+    result = job['result']
+    return jsonify({
+        'id': job['id'],
+        'status': job['status'],
+        'total_files': progress['total'],
+        'processed_files': progress['processed'],
+        'files': progress['files'],
+        'next_file': progress['next'],
+        'has_more': len(progress['files']) >= JOB_FILES_PAGE,
+        'error': job['error'],
+        'result': result,
+        'download_url': (
+            url_for('download_file', batch_id=result.get('batch_id') or job['id'], filename=result['zip_file'])
+            if result and result['zip_file'] else None
+        ),
+        'results_url': url_for('results', job=job['id'])
+    })
+
+
+@app.route('/metrics')
+def metrics():
+    """Expose processing metrics in the Prometheus text format."""
+    if not METRICS_ENABLED:
+        return Response('Metrics are disabled (METRICS_ENABLED=0)\n', status=404, mimetype='text/plain')
+
+    gauges = []
+    cache = get_parse_cache()
+    if cache is not None:
+        stats = cache.stats()
+        gauges += [
+            ('fac2csv_parse_cache_entries', 'Invoices in the parse cache', stats['entries']),
+            ('fac2csv_parse_cache_bytes', 'Size of the parse cache payloads', stats['bytes']),
+        ]
+    jobs = job_queue.store.count_by_status()
+    for status in (JOB_QUEUED, JOB_RUNNING):
+        gauges.append((f'fac2csv_jobs_{status}', f'Background jobs currently {status}', jobs.get(status, 0)))
+
+    return Response(render_metrics(gauges), content_type='text/plain; version=0.0.4; charset=utf-8')
 
 
 @app.route('/results')
 def results():
-    """Display processing results and download options."""
-    # Get data from session
-    zip_file = session.get('zip_file')
-    summary_file = session.get('summary_file')
-    detail_file = session.get('detail_file')
-    processed_count = session.get('processed_count', 0)
-    total_count = session.get('total_count', 0)
-    validation_errors = session.get('validation_errors', [])
-    parsing_errors = session.get('parsing_errors', [])
-
-    # Load CSV previews (first 10 rows)
-    summary_preview = []
-    detail_preview = []
-
-    if summary_file:
-        summary_path = os.path.join(app.config['OUTPUT_FOLDER'], summary_file)
-        if os.path.exists(summary_path):
-            try:
-                import pandas as pd
-                df = pd.read_csv(summary_path, nrows=10)
-                summary_preview = df.to_dict('records')
-            except Exception as e:
-                logger.error(f"Error loading summary preview: {e}")
-
-    if detail_file:
-        detail_path = os.path.join(app.config['OUTPUT_FOLDER'], detail_file)
-        if os.path.exists(detail_path):
-            try:
-                import pandas as pd
-                df = pd.read_csv(detail_path, nrows=10)
-                detail_preview = df.to_dict('records')
-            except Exception as e:
-                logger.error(f"Error loading detail preview: {e}")
+    """Display the progress or the results of an upload job."""
+    job_id = request.args.get('job') or session.get('job_id')
+    # The per-file progress is fetched by the page while the job runs
+    job = job_queue.store.get_job(job_id, files=False) if job_id else None
+
+    # Still processing: the page polls the job until it finishes
+    if job is not None and job['status'] in (JOB_QUEUED, JOB_RUNNING):
+        return render_template('results.html', job=job, pending=True)
+
+    result = (job or {}).get('result') or {}
+    zip_file = result.get('zip_file')
+    processed_count = result.get('processed_count', 0)
+    cache_hits = result.get('cache_hits', 0)
+    total_count = result.get('total_count', 0)
+    validation_errors = result.get('validation_errors', [])
+    parsing_errors = result.get('parsing_errors', [])
+    # Append jobs add to the output of another batch
+    batch_id = result.get('batch_id') or (job or {}).get('id')
+    duplicates = result.get('duplicates')
+    output_format = result.get('output_format', DEFAULT_OUTPUT_FORMAT)
+
+    # First rows of each CSV, captured while the ZIP was generated
+    preview = result.get('preview') or {}
+    summary_preview = preview.get('summary')
+    detail_preview = preview.get('detail')
 
     return render_template(
         'results.html',
+        job=job,
+        pending=False,
+        batch_id=batch_id,
         zip_file=zip_file,
+        duplicates=duplicates,
+        output_format=output_format,
         processed_count=processed_count,
+        cache_hits=cache_hits,
         total_count=total_count,
         validation_errors=validation_errors,
         parsing_errors=parsing_errors,
@@ -257,13 +534,16 @@ def results():
     )
 
 
-@app.route('/download/<filename>')
-def download_file(filename):
-    """Download a generated file."""
+@app.route('/download/<batch_id>/<filename>')
+def download_file(batch_id, filename):
+    """Download a generated file of a batch."""
     try:
-        file_path = os.path.join(app.config['OUTPUT_FOLDER'], secure_filename(filename))
+        try:
+            file_path = batch_path(app.config['OUTPUT_FOLDER'], batch_id, filename)
+        except ValueError:
+            file_path = None
 
-        if not os.path.exists(file_path):
+        if file_path is None or not os.path.isfile(file_path):
             flash('Archivo no encontrado.', 'error')
             return redirect(url_for('index'))
 
@@ -291,4 +571,7 @@ if __name__ == '__main__':
     port = int(os.environ.get('PORT', 5000))
     # Only enable debug in development
     debug = os.environ.get('FLASK_ENV', 'development') == 'development'
+    # With the reloader, the app runs in a child process
+    if not debug or os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        start_background_services()
     app.run(debug=debug, host='0.0.0.0', port=port)
@@ -0,0 +1 @@
+"""Benchmarks and synthetic test data for fac2csv."""
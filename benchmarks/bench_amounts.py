@@ -0,0 +1,88 @@
+"""Micro-benchmark: amount normalization in the CSV generator.
+
+Compares ``csv_generator.normalize_amount`` against the previous
+float-based ``format_decimal`` on every amount found in the sample
+invoices in facturas/.
+
+Usage:
+    python benchmarks/bench_amounts.py [--repeat N]
+"""
+
+import argparse
+import glob
+import logging
+import os
+import sys
+import timeit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from xml_parser import parse_single_invoice  # noqa: E402
+from csv_generator import (  # noqa: E402
+    normalize_amount,
+    SUMMARY_DECIMAL_FIELDS,
+    LINE_DECIMAL_FIELDS
+)
+
+
+def legacy_format_decimal(value):
+    """The float-based formatter used before normalize_amount."""
+    try:
+        if value == '' or value is None:
+            return '0.00'
+        num_value = float(str(value).replace(',', ''))
+        return f"{num_value:.2f}"
+    except (ValueError, TypeError):
+        return '0.00'
+
+
+def collect_amounts():
+    """Return every decimal field value of the sample invoices."""
+    amounts = []
+    for xml_path in sorted(glob.glob(os.path.join(ROOT, 'facturas', '*.xml'))):
+        invoice = parse_single_invoice(xml_path)
+        amounts.extend(invoice.get(field, '') for field in SUMMARY_DECIMAL_FIELDS)
+        for line in invoice.get('lineas', []):
+            amounts.extend(line.get(field, '') for field in LINE_DECIMAL_FIELDS)
+    return amounts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=5, help='timing repetitions (best is reported)')
+    parser.add_argument('--number', type=int, default=2000, help='passes over the amounts per repetition')
+    args = parser.parse_args()
+
+    logging.disable(logging.CRITICAL)
+    amounts = collect_amounts()
+    if not amounts:
+        print("No sample invoices found in facturas/")
+        return 1
+
+    def run(formatter):
+        for value in amounts:
+            formatter(value)
+
+    calls = len(amounts) * args.number
+    legacy = min(timeit.repeat(lambda: run(legacy_format_decimal), number=args.number, repeat=args.repeat))
+    current = min(timeit.repeat(lambda: run(normalize_amount), number=args.number, repeat=args.repeat))
+
+    differences = [
+        (value, legacy_format_decimal(value), normalize_amount(value))
+        for value in amounts
+        if legacy_format_decimal(value) != normalize_amount(value)
+    ]
+
+    print(f"Amounts per pass: {len(amounts)} ({calls} calls per run)")
+    print(f"legacy format_decimal: {legacy / calls * 1e9:8.1f} ns/call")
+    print(f"normalize_amount:      {current / calls * 1e9:8.1f} ns/call")
+    print(f"speedup:               {legacy / current:8.2f}x")
+    for value, old, new in differences:
+        print(f"  differs for {value!r}: {old} -> {new}")
+
+    return 0 if current < legacy else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
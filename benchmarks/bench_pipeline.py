@@ -0,0 +1,259 @@
+"""Benchmark: per-stage throughput of the conversion pipeline.
+
+Generates synthetic documents for each profile in benchmarks/synthetic.py
+and times every stage separately: validation, extraction of the embedded
+invoice, each parse_invoice_* function, CSV generation and ZIP creation.
+The best of several repetitions is reported for each stage.
+
+Results are written as JSON. Passing the JSON of a previous run with
+--compare prints the change per stage and exits with status 1 when a stage
+got slower than the threshold, so two versions can be compared directly.
+
+Usage:
+    python benchmarks/bench_pipeline.py [--count N] [--repeat N] [--output results.json]
+    python benchmarks/bench_pipeline.py --compare baseline.json
+"""
+
+import argparse
+import json
+import logging
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from lxml import etree  # noqa: E402
+
+from benchmarks.synthetic import PROFILES, Profile, generate_documents, get_profile  # noqa: E402
+from xml_parser import (  # noqa: E402
+    PARSER_VERSION,
+    extract_embedded_invoice,
+    unwrap_invoice,
+    parse_invoice_general,
+    parse_invoice_customer,
+    parse_invoice_supplier,
+    parse_invoice_amounts,
+    parse_invoice_cufe,
+    parse_invoice_lines,
+    parse_invoice_element
+)
+from csv_generator import (  # noqa: E402
+    generate_summary_csv,
+    generate_detail_csv,
+    generate_csv_outputs,
+    generate_csv_zip,
+    generate_parquet_outputs,
+    PARQUET_AVAILABLE
+)
+from utils.validators import validate_xml_bytes  # noqa: E402
+
+# Functions applied to every extracted invoice root
+PARSE_STAGES = (
+    ('parse_invoice_general', parse_invoice_general),
+    ('parse_invoice_customer', parse_invoice_customer),
+    ('parse_invoice_supplier', parse_invoice_supplier),
+    ('parse_invoice_amounts', parse_invoice_amounts),
+    ('parse_invoice_cufe', parse_invoice_cufe),
+    ('parse_invoice_lines', parse_invoice_lines),
+    ('parse_invoice_element', parse_invoice_element),
+)
+
+
+def best_time(func: Callable[[], Any], repeat: int) -> float:
+    """Return the fastest of ``repeat`` runs of ``func``, in seconds."""
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def stage_result(seconds: float, documents: int, size: Optional[int] = None, lines: Optional[int] = None) -> Dict[str, float]:
+    """Express a stage timing as throughput figures."""
+    result = {
+        'seconds': round(seconds, 6),
+        'documents_per_second': round(documents / seconds, 2) if seconds else 0.0
+    }
+    if size is not None:
+        result['mb_per_second'] = round(size / (1024 * 1024) / seconds, 2) if seconds else 0.0
+    if lines is not None:
+        result['lines_per_second'] = round(lines / seconds, 2) if seconds else 0.0
+    return result
+
+
+def bench_profile(profile: Profile, count: int, repeat: int, seed: int, workdir: str) -> Dict[str, Any]:
+    """Time every pipeline stage on ``count`` documents of a profile."""
+    documents = list(generate_documents(profile, count, seed))
+    size = sum(len(data) for _, data in documents)
+
+    paths = []
+    for filename, data in documents:
+        path = os.path.join(workdir, filename)
+        with open(path, 'wb') as xml_file:
+            xml_file.write(data)
+        paths.append(path)
+
+    stages = {}
+
+    seconds = best_time(lambda: [validate_xml_bytes(data, filename) for filename, data in documents], repeat)
+    stages['validate'] = stage_result(seconds, count, size=size)
+
+    # Read + parse of the container + parse of the embedded invoice
+    seconds = best_time(lambda: [extract_embedded_invoice(path) for path in paths], repeat)
+    stages['extract_embedded_invoice'] = stage_result(seconds, count, size=size)
+
+    # Unwrapping alone, from documents already parsed by the validation
+    roots = [(validate_xml_bytes(data, filename), data) for filename, data in documents]
+    seconds = best_time(lambda: [unwrap_invoice(root, 'benchmark', data) for root, data in roots], repeat)
+    stages['unwrap_invoice'] = stage_result(seconds, count, size=size)
+
+    invoice_roots = [unwrap_invoice(root, 'benchmark', data)[0] for root, data in roots]
+    del roots
+    lines = count * profile.lines
+    for name, func in PARSE_STAGES:
+        seconds = best_time(lambda: [func(invoice_root) for invoice_root in invoice_roots], repeat)
+        stages[name] = stage_result(seconds, count, lines=lines if name in ('parse_invoice_lines', 'parse_invoice_element') else None)
+
+    invoices = [parse_invoice_element(invoice_root) for invoice_root in invoice_roots]
+    del invoice_roots
+
+    summary_path = os.path.join(workdir, 'facturas_resumen.csv')
+    detail_path = os.path.join(workdir, 'facturas_detalle.csv')
+    zip_path = os.path.join(workdir, 'facturas.zip')
+
+    seconds = best_time(lambda: generate_summary_csv(invoices, summary_path), repeat)
+    stages['generate_summary_csv'] = stage_result(seconds, count)
+    seconds = best_time(lambda: generate_detail_csv(invoices, detail_path), repeat)
+    stages['generate_detail_csv'] = stage_result(seconds, count, lines=lines)
+    seconds = best_time(lambda: generate_csv_outputs(invoices, summary_path, detail_path), repeat)
+    stages['generate_csv_outputs'] = stage_result(seconds, count, lines=lines)
+    seconds = best_time(
+        lambda: generate_csv_zip(invoices, zip_path, 'facturas_resumen.csv', 'facturas_detalle.csv'),
+        repeat
+    )
+    stages['generate_csv_zip'] = stage_result(seconds, count, lines=lines)
+
+    # Optional output, timed only when pyarrow is installed
+    summary_parquet = os.path.join(workdir, 'facturas_resumen.parquet')
+    detail_parquet = os.path.join(workdir, 'facturas_detalle.parquet')
+    if PARQUET_AVAILABLE:
+        seconds = best_time(lambda: generate_parquet_outputs(invoices, summary_parquet, detail_parquet), repeat)
+        stages['generate_parquet_outputs'] = stage_result(seconds, count, lines=lines)
+
+    for path in paths + [summary_path, detail_path, zip_path, summary_parquet, detail_parquet]:
+        if os.path.exists(path):
+            os.remove(path)
+
+    return {
+        'profile': profile._asdict(),
+        'documents': count,
+        'bytes': size,
+        'lines': lines,
+        'stages': stages
+    }
+
+
+def git_revision() -> str:
+    """Return the current commit of the repository, if available."""
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+            capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ''
+
+
+def compare(results: Dict[str, Any], baseline: Dict[str, Any], threshold: float) -> List[str]:
+    """Print the throughput change per stage against a previous run.
+
+    Returns:
+        Names ('profile/stage') of the stages that got slower than the threshold
+    """
+    regressions = []
+    print(f"{'profile/stage':<48} {'baseline':>12} {'current':>12} {'change':>8}")
+    for name, profile in results['profiles'].items():
+        old_profile = baseline.get('profiles', {}).get(name)
+        if old_profile is None:
+            continue
+        for stage, current in profile['stages'].items():
+            old = old_profile['stages'].get(stage)
+            if not old or not old['documents_per_second']:
+                continue
+            change = current['documents_per_second'] / old['documents_per_second'] - 1
+            flag = ''
+            if change < -threshold:
+                regressions.append(f"{name}/{stage}")
+                flag = '  <-- slower'
+            print(
+                f"{name + '/' + stage:<48} {old['documents_per_second']:>12.1f} "
+                f"{current['documents_per_second']:>12.1f} {change:>+8.1%}{flag}"
+            )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--count', type=int, default=50, help='documents per profile')
+    parser.add_argument('--repeat', type=int, default=3, help='timing repetitions (best is reported)')
+    parser.add_argument('--profile', action='append', help='profile to run (repeatable; default: all)')
+    parser.add_argument('--seed', type=int, default=0, help='random seed of the synthetic documents')
+    parser.add_argument('--output', help='write the JSON results to this file instead of stdout')
+    parser.add_argument('--compare', help='JSON results of a previous run to compare against')
+    parser.add_argument('--threshold', type=float, default=0.10,
+                        help='slowdown reported as a regression with --compare (default: 0.10)')
+    args = parser.parse_args()
+
+    try:
+        profiles = [get_profile(name) for name in args.profile] if args.profile else list(PROFILES)
+    except KeyError as e:
+        parser.error(e.args[0])
+
+    logging.disable(logging.CRITICAL)
+
+    results = {
+        'meta': {
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'revision': git_revision(),
+            'parser_version': PARSER_VERSION,
+            'python': platform.python_version(),
+            'lxml': '.'.join(map(str, etree.LXML_VERSION)),
+            'platform': platform.platform(),
+            'count': args.count,
+            'repeat': args.repeat,
+            'seed': args.seed
+        },
+        'profiles': {}
+    }
+
+    with tempfile.TemporaryDirectory(prefix='fac2csv_bench_') as workdir:
+        for profile in profiles:
+            print(f"Running {profile.name}...", file=sys.stderr)
+            results['profiles'][profile.name] = bench_profile(profile, args.count, args.repeat, args.seed, workdir)
+
+    output = json.dumps(results, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as results_file:
+            results_file.write(output + '\n')
+    elif not args.compare:
+        print(output)
+
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as baseline_file:
+            baseline = json.load(baseline_file)
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"\n{len(regressions)} stage(s) slower than {args.threshold:.0%}: {', '.join(regressions)}")
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
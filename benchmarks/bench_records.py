@@ -0,0 +1,78 @@
+"""Memory benchmark: Invoice/InvoiceLine records vs. plain dictionaries.
+
+Parses the sample invoices in facturas/ repeatedly, keeps every result
+alive and reports the memory retained per invoice header and per line
+item, once as the slotted records returned by the parser and once
+converted to the dictionaries it used to return.
+
+Usage:
+    python benchmarks/bench_records.py [--copies N]
+"""
+
+import argparse
+import gc
+import glob
+import logging
+import os
+import sys
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from xml_parser import extract_embedded_invoice, parse_invoice_header, parse_invoice_lines  # noqa: E402
+
+
+def retained_bytes(build):
+    """Return (bytes still allocated after build(), result of build())."""
+    gc.collect()
+    tracemalloc.start()
+    try:
+        result = build()
+        gc.collect()
+        current, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return current, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--copies', type=int, default=2000, help='times each sample invoice is parsed')
+    args = parser.parse_args()
+
+    logging.disable(logging.CRITICAL)
+    roots = [extract_embedded_invoice(path) for path in sorted(glob.glob(os.path.join(ROOT, 'facturas', '*.xml')))]
+    if not roots:
+        print("No sample invoices found in facturas/")
+        return 1
+
+    def headers(convert):
+        return [convert(parse_invoice_header(root)) for _ in range(args.copies) for root in roots]
+
+    def lines(convert):
+        return [convert(line) for _ in range(args.copies) for root in roots for line in parse_invoice_lines(root)]
+
+    def as_record(record):
+        return record
+
+    def as_dict(record):
+        return record.to_dict()
+
+    print(f"{'':10} {'records':>10} {'dicts':>10} {'saving':>8}")
+    for label, build in (('header', headers), ('line', lines)):
+        record_bytes, items = retained_bytes(lambda: build(as_record))
+        count = len(items)
+        del items
+        dict_bytes, items = retained_bytes(lambda: build(as_dict))
+        del items
+        print(
+            f"{label + ' (B)':10} {record_bytes / count:10.0f} {dict_bytes / count:10.0f} "
+            f"{1 - record_bytes / dict_bytes:8.0%}"
+        )
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,379 @@
+"""Synthetic DIAN invoices for benchmarks.
+
+Builds UBL 2.1 Invoice documents following the DIAN layout (extensions,
+XAdES-style signature, parties, tax totals, line items) and wraps them in
+AttachedDocument containers the way the DIAN delivers them, with the
+invoice in a CDATA section. The document shape is set by a ``Profile``:
+number of lines, signature size, wrapped or bare, and whether the invoice
+itself contains CDATA (which the wrapper must then split into several
+CDATA sections).
+
+Documents are deterministic for a given seed, so benchmark runs on
+different versions parse exactly the same input.
+
+Usage:
+    python benchmarks/synthetic.py --output /tmp/facturas --count 1000 [--profile typical]
+"""
+
+import argparse
+import base64
+import hashlib
+import os
+import random
+import sys
+from decimal import Decimal, ROUND_HALF_UP
+from typing import Iterator, List, NamedTuple, Tuple
+from xml.sax.saxutils import escape
+
+NS_DECLARATIONS = (
+    'xmlns:cac="urn:oasis:names:specification:ubl:schema:xsd:CommonAggregateComponents-2" '
+    'xmlns:cbc="urn:oasis:names:specification:ubl:schema:xsd:CommonBasicComponents-2" '
+    'xmlns:ext="urn:oasis:names:specification:ubl:schema:xsd:CommonExtensionComponents-2" '
+    'xmlns:ds="http://www.w3.org/2000/09/xmldsig#" '
+    'xmlns:xades="http://uri.etsi.org/01903/v1.3.2#" '
+    'xmlns:sts="dian:gov:co:facturaelectronica:Structures-2-1"'
+)
+INVOICE_NS = 'urn:oasis:names:specification:ubl:schema:xsd:Invoice-2'
+ATTACHED_DOCUMENT_NS = 'urn:oasis:names:specification:ubl:schema:xsd:AttachedDocument-2'
+APPLICATION_RESPONSE_NS = 'urn:oasis:names:specification:ubl:schema:xsd:ApplicationResponse-2'
+
+CITIES = [
+    ('11001', 'Bogotá, D.C.', 'Bogotá', '110111'),
+    ('05001', 'Medellín', 'Antioquia', '050001'),
+    ('76001', 'Cali', 'Valle del Cauca', '760001'),
+    ('08001', 'Barranquilla', 'Atlántico', '080001'),
+]
+PRODUCTS = [
+    'Plan de voz y datos 20GB', 'Servicio de internet fibra 300 Mbps', 'Equipo terminal móvil',
+    'Cargo básico mensual', 'Soporte técnico en sitio', 'Licencia de software anual',
+    'Arrendamiento de equipos', 'Consumo de datos adicional',
+]
+
+CENT = Decimal('0.01')
+
+
+class Profile(NamedTuple):
+    """Shape of the synthetic documents."""
+    name: str
+    lines: int
+    signature_bytes: int = 4096
+    wrapped: bool = True
+    nested_cdata: bool = False
+
+
+# Default profiles, from a bare single-line invoice to large and unusual containers
+PROFILES = (
+    Profile('bare_1_line', lines=1, signature_bytes=2048, wrapped=False),
+    Profile('typical', lines=10, signature_bytes=8192),
+    Profile('large_500_lines', lines=500, signature_bytes=8192),
+    Profile('big_signature', lines=5, signature_bytes=64 * 1024),
+    Profile('nested_cdata', lines=10, signature_bytes=8192, nested_cdata=True),
+)
+
+
+def _money(value: Decimal) -> str:
+    return str(value.quantize(CENT, rounding=ROUND_HALF_UP))
+
+
+def _base64_blob(rng: random.Random, size: int) -> str:
+    """Return base64 text of about ``size`` characters, wrapped like PEM."""
+    raw = base64.b64encode(rng.getrandbits(8 * max(3, size * 3 // 4)).to_bytes(max(3, size * 3 // 4), 'big'))
+    return '\n'.join(raw[i:i + 76].decode('ascii') for i in range(0, len(raw), 76))
+
+
+def build_signature(rng: random.Random, size: int) -> str:
+    """Return a ds:Signature element with about ``size`` bytes of key material."""
+    signature_id = f"xmldsig-{rng.getrandbits(64):016x}"
+    digest = _base64_blob(rng, 44)
+    value = _base64_blob(rng, 344)
+    certificate = _base64_blob(rng, max(0, size - 344))
+    return (
+        f'<ds:Signature Id="{signature_id}"><ds:SignedInfo>'
+        '<ds:CanonicalizationMethod Algorithm="http://www.w3.org/TR/2001/REC-xml-c14n-20010315"/>'
+        '<ds:SignatureMethod Algorithm="http://www.w3.org/2001/04/xmldsig-more#rsa-sha256"/>'
+        f'<ds:Reference Id="{signature_id}-ref0" URI=""><ds:Transforms>'
+        '<ds:Transform Algorithm="http://www.w3.org/2000/09/xmldsig#enveloped-signature"/></ds:Transforms>'
+        '<ds:DigestMethod Algorithm="http://www.w3.org/2001/04/xmlenc#sha256"/>'
+        f'<ds:DigestValue>{digest}</ds:DigestValue></ds:Reference></ds:SignedInfo>'
+        f'<ds:SignatureValue Id="{signature_id}-sigvalue">{value}</ds:SignatureValue>'
+        f'<ds:KeyInfo Id="{signature_id}-keyinfo"><ds:X509Data>'
+        f'<ds:X509Certificate>{certificate}</ds:X509Certificate></ds:X509Data></ds:KeyInfo>'
+        f'<ds:Object><xades:QualifyingProperties Target="#{signature_id}"><xades:SignedProperties>'
+        '<xades:SignedSignatureProperties><xades:SigningTime>2025-01-15T10:00:00-05:00</xades:SigningTime>'
+        '</xades:SignedSignatureProperties></xades:SignedProperties></xades:QualifyingProperties></ds:Object>'
+        '</ds:Signature>'
+    )
+
+
+def _party(rng: random.Random, role: str, name: str, nit: str, prefix: str = '') -> str:
+    city_code, city, department, postal_zone = rng.choice(CITIES)
+    address = f"Calle {rng.randint(1, 200)} # {rng.randint(1, 99)}-{rng.randint(1, 99)}"
+    registration = (
+        f'<cac:CorporateRegistrationScheme><cbc:ID>{prefix}</cbc:ID></cac:CorporateRegistrationScheme>'
+        if prefix else ''
+    )
+    return (
+        f'<cac:{role}><cbc:AdditionalAccountID>1</cbc:AdditionalAccountID><cac:Party>'
+        f'<cac:PartyName><cbc:Name>{escape(name)}</cbc:Name></cac:PartyName>'
+        '<cac:PhysicalLocation><cac:Address>'
+        f'<cbc:ID>{city_code}</cbc:ID><cbc:CityName>{city}</cbc:CityName>'
+        f'<cbc:PostalZone>{postal_zone}</cbc:PostalZone><cbc:CountrySubentity>{department}</cbc:CountrySubentity>'
+        f'<cac:AddressLine><cbc:Line>{address}</cbc:Line></cac:AddressLine>'
+        '<cac:Country><cbc:IdentificationCode>CO</cbc:IdentificationCode></cac:Country>'
+        '</cac:Address></cac:PhysicalLocation>'
+        f'<cac:PartyTaxScheme><cbc:RegistrationName>{escape(name)}</cbc:RegistrationName>'
+        f'<cbc:CompanyID schemeAgencyID="195" schemeID="{rng.randint(0, 9)}" schemeName="31">{nit}</cbc:CompanyID>'
+        '<cbc:TaxLevelCode>O-13</cbc:TaxLevelCode>'
+        '<cac:TaxScheme><cbc:ID>01</cbc:ID><cbc:Name>IVA</cbc:Name></cac:TaxScheme></cac:PartyTaxScheme>'
+        f'<cac:PartyLegalEntity><cbc:RegistrationName>{escape(name)}</cbc:RegistrationName>'
+        f'<cbc:CompanyID schemeAgencyID="195" schemeName="31">{nit}</cbc:CompanyID>{registration}'
+        '</cac:PartyLegalEntity></cac:Party>'
+        f'</cac:{role}>'
+    )
+
+
+def _tax_subtotal(taxable: Decimal, amount: Decimal, percent: str) -> str:
+    return (
+        f'<cac:TaxSubtotal><cbc:TaxableAmount currencyID="COP">{_money(taxable)}</cbc:TaxableAmount>'
+        f'<cbc:TaxAmount currencyID="COP">{_money(amount)}</cbc:TaxAmount>'
+        f'<cac:TaxCategory><cbc:Percent>{percent}</cbc:Percent>'
+        '<cac:TaxScheme><cbc:ID>01</cbc:ID><cbc:Name>IVA</cbc:Name></cac:TaxScheme></cac:TaxCategory>'
+        '</cac:TaxSubtotal>'
+    )
+
+
+def _invoice_line(rng: random.Random, number: int) -> Tuple[str, Decimal, Decimal]:
+    """Return a cac:InvoiceLine with its net amount and discount."""
+    quantity = Decimal(rng.randint(1, 12))
+    price = Decimal(rng.randint(1000, 2000000)) / 100
+    gross = quantity * price
+    discount_percent = Decimal(rng.choice([0, 0, 0, 5, 10, 15]))
+    discount = (gross * discount_percent / 100).quantize(CENT, rounding=ROUND_HALF_UP)
+    net = gross - discount
+
+    allowance = ''
+    if discount:
+        allowance = (
+            '<cac:AllowanceCharge><cbc:ID>1</cbc:ID><cbc:ChargeIndicator>false</cbc:ChargeIndicator>'
+            '<cbc:AllowanceChargeReason>Descuento comercial</cbc:AllowanceChargeReason>'
+            f'<cbc:MultiplierFactorNumeric>{_money(discount_percent)}</cbc:MultiplierFactorNumeric>'
+            f'<cbc:Amount currencyID="COP">{_money(discount)}</cbc:Amount>'
+            f'<cbc:BaseAmount currencyID="COP">{_money(gross)}</cbc:BaseAmount></cac:AllowanceCharge>'
+        )
+    tax = net * Decimal('0.19')
+    line = (
+        f'<cac:InvoiceLine><cbc:ID>{number}</cbc:ID>'
+        f'<cbc:InvoicedQuantity unitCode="94">{_money(quantity)}</cbc:InvoicedQuantity>'
+        f'<cbc:LineExtensionAmount currencyID="COP">{_money(net)}</cbc:LineExtensionAmount>'
+        f'{allowance}'
+        f'<cac:TaxTotal><cbc:TaxAmount currencyID="COP">{_money(tax)}</cbc:TaxAmount>'
+        f'{_tax_subtotal(net, tax, "19.00")}</cac:TaxTotal>'
+        f'<cac:Item><cbc:Description>{escape(rng.choice(PRODUCTS))}</cbc:Description>'
+        f'<cac:StandardItemIdentification><cbc:ID schemeID="999">SKU-{rng.randint(10000, 99999)}</cbc:ID>'
+        '</cac:StandardItemIdentification></cac:Item>'
+        f'<cac:Price><cbc:PriceAmount currencyID="COP">{_money(price)}</cbc:PriceAmount>'
+        '<cbc:BaseQuantity unitCode="94">1.00</cbc:BaseQuantity></cac:Price>'
+        '</cac:InvoiceLine>'
+    )
+    return line, net, discount
+
+
+def build_invoice(rng: random.Random, number: int, profile: Profile) -> Tuple[str, str]:
+    """Build a UBL 2.1 Invoice document.
+
+    Args:
+        rng: Random source (the document is deterministic for its state)
+        number: Invoice number
+        profile: Document shape
+
+    Returns:
+        Tuple of (invoice XML text, CUFE)
+    """
+    invoice_id = f"SETP{990000000 + number}"
+    cufe = hashlib.sha384(f"{invoice_id}:{rng.random()}".encode('ascii')).hexdigest()
+    day = rng.randint(1, 28)
+
+    lines = []
+    subtotal = discounts = Decimal(0)
+    for line_number in range(1, profile.lines + 1):
+        line, net, discount = _invoice_line(rng, line_number)
+        lines.append(line)
+        subtotal += net
+        discounts += discount
+    iva = subtotal * Decimal('0.19')
+    total = subtotal + iva
+
+    note = 'Factura generada para pruebas de rendimiento.'
+    if profile.nested_cdata:
+        # Free text with markup, kept verbatim in its own CDATA section
+        note = '<![CDATA[<p>Gracias por su compra.</p> <b>Total & descuentos</b> aplicados]]>'
+
+    invoice = (
+        '<?xml version="1.0" encoding="UTF-8" standalone="no"?>'
+        f'<Invoice xmlns="{INVOICE_NS}" {NS_DECLARATIONS}>'
+        '<ext:UBLExtensions><ext:UBLExtension><ext:ExtensionContent><sts:DianExtensions>'
+        '<sts:InvoiceControl><sts:InvoiceAuthorization>18760000001</sts:InvoiceAuthorization>'
+        '<sts:AuthorizedInvoices><sts:Prefix>SETP</sts:Prefix><sts:From>990000000</sts:From>'
+        '<sts:To>995000000</sts:To></sts:AuthorizedInvoices></sts:InvoiceControl>'
+        '<sts:SoftwareProvider><sts:ProviderID schemeAgencyID="195" schemeName="31">900123456</sts:ProviderID>'
+        '<sts:SoftwareID schemeAgencyID="195">56f2ae4e-9812-4fad-9255-08fcfcd5ccb0</sts:SoftwareID>'
+        '</sts:SoftwareProvider></sts:DianExtensions></ext:ExtensionContent></ext:UBLExtension>'
+        f'<ext:UBLExtension><ext:ExtensionContent>{build_signature(rng, profile.signature_bytes)}'
+        '</ext:ExtensionContent></ext:UBLExtension></ext:UBLExtensions>'
+        '<cbc:UBLVersionID>UBL 2.1</cbc:UBLVersionID><cbc:CustomizationID>10</cbc:CustomizationID>'
+        '<cbc:ProfileID>DIAN 2.1: Factura Electrónica de Venta</cbc:ProfileID>'
+        '<cbc:ProfileExecutionID>1</cbc:ProfileExecutionID>'
+        f'<cbc:ID>{invoice_id}</cbc:ID>'
+        f'<cbc:UUID schemeID="1" schemeName="CUFE-SHA384">{cufe}</cbc:UUID>'
+        f'<cbc:IssueDate>2025-01-{day:02d}</cbc:IssueDate><cbc:IssueTime>10:{day:02d}:00-05:00</cbc:IssueTime>'
+        f'<cbc:DueDate>2025-02-{day:02d}</cbc:DueDate>'
+        '<cbc:InvoiceTypeCode>01</cbc:InvoiceTypeCode>'
+        f'<cbc:Note>{note}</cbc:Note>'
+        '<cbc:DocumentCurrencyCode>COP</cbc:DocumentCurrencyCode>'
+        f'<cbc:LineCountNumeric>{profile.lines}</cbc:LineCountNumeric>'
+        '<cac:InvoicePeriod><cbc:StartDate>2025-01-01</cbc:StartDate>'
+        '<cbc:EndDate>2025-01-31</cbc:EndDate></cac:InvoicePeriod>'
+        f'{_party(rng, "AccountingSupplierParty", "Zentratek Servicios S.A.S.", "900123456", "SETP")}'
+        f'{_party(rng, "AccountingCustomerParty", f"Cliente {number} S.A.S.", str(800000000 + number))}'
+        '<cac:PaymentMeans><cbc:ID>2</cbc:ID><cbc:PaymentMeansCode>42</cbc:PaymentMeansCode>'
+        f'<cbc:PaymentDueDate>2025-02-{day:02d}</cbc:PaymentDueDate></cac:PaymentMeans>'
+        f'<cac:TaxTotal><cbc:TaxAmount currencyID="COP">{_money(iva)}</cbc:TaxAmount>'
+        f'{_tax_subtotal(subtotal, iva, "19.00")}</cac:TaxTotal>'
+        '<cac:LegalMonetaryTotal>'
+        f'<cbc:LineExtensionAmount currencyID="COP">{_money(subtotal)}</cbc:LineExtensionAmount>'
+        f'<cbc:TaxExclusiveAmount currencyID="COP">{_money(subtotal)}</cbc:TaxExclusiveAmount>'
+        f'<cbc:TaxInclusiveAmount currencyID="COP">{_money(total)}</cbc:TaxInclusiveAmount>'
+        f'<cbc:AllowanceTotalAmount currencyID="COP">{_money(discounts)}</cbc:AllowanceTotalAmount>'
+        f'<cbc:PayableAmount currencyID="COP">{_money(total)}</cbc:PayableAmount>'
+        '</cac:LegalMonetaryTotal>'
+        f'{"".join(lines)}'
+        '</Invoice>'
+    )
+    return invoice, cufe
+
+
+def cdata(text: str) -> str:
+    """Wrap text in CDATA, splitting the section around any ']]>' it contains."""
+    return '<![CDATA[' + text.replace(']]>', ']]]]><![CDATA[>') + ']]>'
+
+
+def wrap_attached_document(rng: random.Random, invoice: str, cufe: str, number: int, profile: Profile) -> str:
+    """Wrap an invoice in an AttachedDocument container.
+
+    The invoice goes in cac:Attachment as CDATA, and the DIAN validation
+    response in cac:ParentDocumentLineReference, as in real containers.
+    """
+    invoice_id = f"SETP{990000000 + number}"
+    response = (
+        '<?xml version="1.0" encoding="utf-8" standalone="no"?>'
+        f'<ApplicationResponse xmlns="{APPLICATION_RESPONSE_NS}" {NS_DECLARATIONS}>'
+        '<cbc:UBLVersionID>UBL 2.1</cbc:UBLVersionID><cbc:ID>1</cbc:ID>'
+        '<cac:DocumentResponse><cac:Response><cbc:ResponseCode>02</cbc:ResponseCode>'
+        '<cbc:Description>Documento validado por la DIAN</cbc:Description></cac:Response>'
+        f'<cac:DocumentReference><cbc:ID>{invoice_id}</cbc:ID>'
+        f'<cbc:UUID schemeName="CUFE-SHA384">{cufe}</cbc:UUID></cac:DocumentReference>'
+        '</cac:DocumentResponse></ApplicationResponse>'
+    )
+    return (
+        '<?xml version="1.0" encoding="utf-8"?>\n'
+        f'<AttachedDocument xmlns="{ATTACHED_DOCUMENT_NS}" {NS_DECLARATIONS}>\n'
+        '  <ext:UBLExtensions>\n    <ext:UBLExtension>\n      <ext:ExtensionContent>'
+        f'{build_signature(rng, profile.signature_bytes)}</ext:ExtensionContent>\n'
+        '    </ext:UBLExtension>\n  </ext:UBLExtensions>\n'
+        '  <cbc:UBLVersionID>UBL 2.1</cbc:UBLVersionID>\n'
+        '  <cbc:CustomizationID>Documentos adjuntos</cbc:CustomizationID>\n'
+        '  <cbc:ProfileID>Factura Electrónica de Venta</cbc:ProfileID>\n'
+        '  <cbc:ProfileExecutionID>1</cbc:ProfileExecutionID>\n'
+        f'  <cbc:ID>{rng.getrandbits(48)}</cbc:ID>\n'
+        '  <cbc:IssueDate>2025-01-15</cbc:IssueDate>\n  <cbc:IssueTime>10:00:00-05:00</cbc:IssueTime>\n'
+        '  <cbc:DocumentType>Contenedor de Factura Electrónica</cbc:DocumentType>\n'
+        f'  <cbc:ParentDocumentID>{invoice_id}</cbc:ParentDocumentID>\n'
+        '  <cac:Attachment>\n    <cac:ExternalReference>\n'
+        '      <cbc:MimeCode>text/xml</cbc:MimeCode>\n      <cbc:EncodingCode>UTF-8</cbc:EncodingCode>\n'
+        f'      <cbc:Description>{cdata(invoice)}</cbc:Description>\n'
+        '    </cac:ExternalReference>\n  </cac:Attachment>\n'
+        '  <cac:ParentDocumentLineReference>\n    <cbc:LineID>1</cbc:LineID>\n'
+        f'    <cac:DocumentReference>\n      <cbc:ID>{invoice_id}</cbc:ID>\n'
+        f'      <cbc:UUID schemeName="CUFE-SHA384">{cufe}</cbc:UUID>\n'
+        '      <cbc:DocumentType>ApplicationResponse</cbc:DocumentType>\n'
+        '      <cac:Attachment>\n        <cac:ExternalReference>\n'
+        '          <cbc:MimeCode>text/xml</cbc:MimeCode>\n'
+        f'          <cbc:Description>{cdata(response)}</cbc:Description>\n'
+        '        </cac:ExternalReference>\n      </cac:Attachment>\n'
+        '    </cac:DocumentReference>\n  </cac:ParentDocumentLineReference>\n'
+        '</AttachedDocument>\n'
+    )
+
+
+def build_document(profile: Profile, number: int, seed: int = 0) -> bytes:
+    """Build one synthetic document.
+
+    Args:
+        profile: Document shape
+        number: Invoice number (also varies the random content)
+        seed: Base random seed
+
+    Returns:
+        UTF-8 encoded XML document
+    """
+    rng = random.Random(f"{seed}:{profile.name}:{number}")
+    invoice, cufe = build_invoice(rng, number, profile)
+    if profile.wrapped:
+        return wrap_attached_document(rng, invoice, cufe, number, profile).encode('utf-8')
+    return invoice.encode('utf-8')
+
+
+def generate_documents(profile: Profile, count: int, seed: int = 0) -> Iterator[Tuple[str, bytes]]:
+    """Yield ``count`` documents of a profile as (filename, content) pairs."""
+    for number in range(1, count + 1):
+        yield f"{profile.name}_{number:06d}.xml", build_document(profile, number, seed)
+
+
+def get_profile(name: str) -> Profile:
+    """Return a default profile by name.
+
+    Raises:
+        KeyError: If there is no profile with that name
+    """
+    for profile in PROFILES:
+        if profile.name == name:
+            return profile
+    raise KeyError(f"Unknown profile '{name}' (available: {', '.join(p.name for p in PROFILES)})")
+
+
+def write_corpus(directory: str, profiles: List[Profile], count: int, seed: int = 0) -> int:
+    """Write ``count`` documents of each profile to a directory.
+
+    Returns:
+        Number of files written
+    """
+    os.makedirs(directory, exist_ok=True)
+    written = 0
+    for profile in profiles:
+        for filename, data in generate_documents(profile, count, seed):
+            with open(os.path.join(directory, filename), 'wb') as xml_file:
+                xml_file.write(data)
+            written += 1
+    return written
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--output', required=True, help='directory for the generated XML files')
+    parser.add_argument('--count', type=int, default=100, help='documents per profile')
+    parser.add_argument('--profile', action='append', help='profile to generate (repeatable; default: all)')
+    parser.add_argument('--seed', type=int, default=0, help='random seed')
+    args = parser.parse_args(argv)
+
+    try:
+        profiles = [get_profile(name) for name in args.profile] if args.profile else list(PROFILES)
+    except KeyError as e:
+        parser.error(e.args[0])
+
+    written = write_corpus(args.output, profiles, args.count, args.seed)
+    print(f"Wrote {written} documents to {args.output}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
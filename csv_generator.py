@@ -1,221 +1,1200 @@
-"""CSV Generator for DIAN invoice data."""
+"""CSV Generator for DIAN invoice data.
+
+The same rows can also be written as Parquet files with typed columns
+(decimal amounts, dates, dictionary-encoded names) when the optional
+pyarrow package is installed.
+"""
 
 import csv
+import io
+import itertools
 import logging
-from typing import List, Dict, Any
-import pandas as pd
+import os
+import re
+import shutil
+import struct
+import tempfile
+import time
+import zipfile
+import datetime
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
+from typing import Callable, Iterable, Iterator, List, Dict, Any, Optional, Tuple, Union
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # Parquet output is optional
+    pa = pq = None
+
+from models import (
+    Invoice,
+    InvoiceLine,
+    INVOICE_FIELDS,
+    LINE_FIELDS,
+    INVOICE_AMOUNT_FIELDS,
+    LINE_AMOUNT_FIELDS
+)
+from utils.metrics import inc, observe_stage
 
 logger = logging.getLogger(__name__)
 
+# Column headers (in Spanish as per requirements), shared with the parser
+SUMMARY_COLUMNS = list(INVOICE_FIELDS)
+
+LINE_COLUMNS = list(LINE_FIELDS)
+
+# Summary fields + line fields
+DETAIL_COLUMNS = SUMMARY_COLUMNS + LINE_COLUMNS
+
+# Fields formatted as decimals with 2 decimals
+SUMMARY_DECIMAL_FIELDS = INVOICE_AMOUNT_FIELDS
+LINE_DECIMAL_FIELDS = LINE_AMOUNT_FIELDS
+
+# Deflate level for ZIP output (0 stores the CSVs uncompressed). Level 1
+# costs noticeably less CPU than zlib's default (6) on large detail files,
+# for a somewhat bigger archive.
+ZIP_COMPRESSION_LEVEL = int(os.environ.get('ZIP_COMPRESSION_LEVEL', 1))
+
+# Rows of each CSV kept in memory while the ZIP is generated, for the
+# results page preview
+PREVIEW_ROWS = int(os.environ.get('PREVIEW_ROWS', 10))
+
+# Summary rows kept in memory while the detail entry of a ZIP is written;
+# beyond this size they go to a temporary file
+CSV_SPOOL_BYTES = int(os.environ.get('CSV_SPOOL_MB', 16)) * 1024 * 1024
+
+# Output formats; each is also the extension of the files it produces.
+# Parquet needs the optional pyarrow package.
+OUTPUT_FORMATS = ('csv', 'parquet')
+DEFAULT_OUTPUT_FORMAT = 'csv'
+PARQUET_AVAILABLE = pa is not None
+
+# Rows buffered per Parquet record batch (each batch is a row group)
+PARQUET_BATCH_ROWS = int(os.environ.get('PARQUET_BATCH_ROWS', 10000))
+
+# Precision of the decimal amounts in Parquet (the scale is 2, as in the CSVs)
+PARQUET_DECIMAL_PRECISION = 38
+
+# Parquet column types besides the decimal amounts; other columns are strings
+PARQUET_DATE_FIELDS = frozenset(['fecha_emision', 'fecha_vencimiento', 'periodo_inicio', 'periodo_fin'])
+PARQUET_TIME_FIELDS = frozenset(['hora_emision'])
+# Values repeated across many rows are stored once per row group
+PARQUET_DICTIONARY_FIELDS = frozenset([
+    'cliente_nombre', 'cliente_nit', 'cliente_municipio', 'emisor_nombre', 'emisor_nit', 'emisor_direccion'
+])
+
+# Suffix of the file keeping the original central directory of a ZIP
+# archive while entries are appended to it (see append_csv_zip)
+APPEND_JOURNAL_SUFFIX = '.journal'
+
+# Positions of the decimal fields within a row
+_SUMMARY_DECIMAL_INDEXES = tuple(i for i, col in enumerate(SUMMARY_COLUMNS) if col in SUMMARY_DECIMAL_FIELDS)
+_LINE_DECIMAL_INDEXES = tuple(i for i, col in enumerate(LINE_COLUMNS) if col in LINE_DECIMAL_FIELDS)
+
+# Line fields of a detail row for an invoice without lines
+_EMPTY_LINE = [''] * len(LINE_COLUMNS)
+
 
 class CSVGenerationError(Exception):
     """Custom exception for CSV generation errors."""
     pass
 
 
+# Amounts already in canonical form are an integer part without leading
+# zeros, optionally followed by one of these two-decimal endings ('1700',
+# '74889.47'). Digits are checked with str.strip on ASCII digits, which
+# (unlike str.isdigit) does not accept other scripts' digits.
+_DIGITS = '0123456789'
+_CANONICAL_CENTS = frozenset(f'.{cents:02d}' for cents in range(100))
+
+# Plain decimals of up to this many digits are rounded through a float: the
+# float is then close enough to the decimal value to stay on the same side
+# of every rounding boundary, so only exact ties ('0.125') need Decimal
+_FLOAT_EXACT_DIGITS = 15
+
+# Thousand separators ('1,234,567.89')
+_THOUSANDS_SEPARATOR = re.compile(',')
+_TWO_PLACES = Decimal('0.01')
+
+
+def _round_plain_amount(text: str) -> Optional[str]:
+    """Round an unsigned plain decimal ('61344.5378') half up to 2 decimals.
+
+    Args:
+        text: Amount as a string
+
+    Returns:
+        Formatted string with 2 decimals, or None if ``text`` has a sign,
+        separators or too many digits, or is a tie, and needs Decimal
+    """
+    if (1 < len(text) <= _FLOAT_EXACT_DIGITS + 1 and not text.replace('.', '', 1).strip(_DIGITS)
+            and text[text.find('.') + 3:].rstrip('0') != '5'):
+        return f"{float(text):.2f}"
+    return None
+
+
+def normalize_amount(value: Any) -> str:
+    """Normalize an amount to a string with exactly 2 decimals and dot separator.
+
+    Rounds half up exactly, so large peso totals do not lose precision
+    through a float. Strings already in 'NNN' or 'NNN.NN' form are returned
+    without any numeric conversion and integers are formatted directly;
+    other plain decimals are rounded through a float where that is exact
+    (see ``_round_plain_amount``) and the rest through Decimal.
+
+    Args:
+        value: Amount (str, int, float or Decimal)
+
+    Returns:
+        Formatted string with 2 decimals; '0.00' for empty or invalid values
+    """
+    if type(value) is str:
+        if value[-3:] in _CANONICAL_CENTS:
+            whole = value[:-3]
+            if whole and not whole.strip(_DIGITS) and (whole[0] != '0' or whole == '0'):
+                return value
+        elif not value.strip(_DIGITS):
+            if not value:
+                return '0.00'
+            if value[0] != '0' or value == '0':
+                return value + '.00'
+        text = value
+    elif value is None:
+        return '0.00'
+    elif type(value) is int:
+        return f"{value}.00"
+    elif isinstance(value, float):
+        # repr() is the shortest string that round-trips to the same float
+        text = repr(value)
+    else:
+        text = str(value)
+
+    amount = _round_plain_amount(text)
+    if amount is not None:
+        return amount
+    if isinstance(value, str):
+        text = _THOUSANDS_SEPARATOR.sub('', value.strip())
+
+    try:
+        number = Decimal(text)
+        if not number.is_finite():
+            raise InvalidOperation
+        return format(number.quantize(_TWO_PLACES, rounding=ROUND_HALF_UP), 'f')
+    except (InvalidOperation, ValueError):
+        logger.warning(f"Could not format value '{value}' as decimal, returning 0.00")
+        return '0.00'
+
+
 def format_decimal(value: Any) -> str:
     """Format a numeric value to decimal with 2 decimals and dot separator.
 
+    Kept for backward compatibility; see ``normalize_amount``.
+
     Args:
         value: Numeric value (str, float, or int)
 
     Returns:
         Formatted string with 2 decimals
     """
-    try:
-        if value == '' or value is None:
-            return '0.00'
+    return normalize_amount(value)
 
-        # Convert to float and format
-        num_value = float(str(value).replace(',', ''))
-        return f"{num_value:.2f}"
-    except (ValueError, TypeError):
-        logger.warning(f"Could not format value '{value}' as decimal, returning 0.00")
-        return '0.00'
 
+def write_csv_rows(output_path: str, columns: List[str], rows: Iterable[List[Any]]) -> Dict[str, Any]:
+    """Write rows to a CSV file as they are produced.
 
-def generate_summary_csv(invoices: List[Dict[str, Any]], output_path: str) -> None:
-    """Generate facturas_resumen.csv with one row per invoice.
+    The output matches what the previous pandas-based writer produced: UTF-8
+    with BOM (for Excel), comma separated, every non-numeric value quoted
+    and the platform line separator.
 
     Args:
-        invoices: List of parsed invoice dictionaries
         output_path: Path where CSV will be saved
+        columns: Header row
+        rows: Iterable of rows (lists of values in column order); may be a
+            generator, only one row is held at a time
 
-    Raises:
-        CSVGenerationError: If CSV cannot be generated
+    Returns:
+        Dictionary with ``path``, ``rows`` (data rows written), ``seconds``
+        and ``rows_per_second``
     """
+    start = time.perf_counter()
+    count = 0
+
+    with open(output_path, 'w', encoding='utf-8-sig', newline='') as csv_file:
+        writer = _csv_writer(csv_file)
+        writer.writerow(columns)
+        for row in rows:
+            writer.writerow(row)
+            count += 1
+
+    return _writer_stats(output_path, count, time.perf_counter() - start)
+
+
+def _csv_writer(csv_file: Any) -> Any:
+    """Create a CSV writer with the output dialect used for every file."""
+    return csv.writer(csv_file, quoting=csv.QUOTE_NONNUMERIC, lineterminator=os.linesep)
+
+
+def _writer_stats(output_path: str, rows: int, seconds: float) -> Dict[str, Any]:
+    """Build the statistics returned by the writers."""
+    return {
+        'path': output_path,
+        'rows': rows,
+        'seconds': seconds,
+        'rows_per_second': rows / seconds if seconds > 0 else 0.0
+    }
+
+
+def _record_stage(stage: str, seconds: float, size: int) -> None:
+    """Report the duration and output size of a generation stage to the metrics."""
+    observe_stage(stage, seconds)
+    inc('fac2csv_bytes_processed_total', size, stage=stage)
+
+
+def _file_size(path: Any) -> int:
+    """Return the size of an output file, or 0 for file objects and missing files."""
     try:
-        if not invoices:
-            raise CSVGenerationError("No invoices to process")
-
-        # Define column headers (in Spanish as per requirements)
-        columns = [
-            'numero_factura',
-            'prefijo',
-            'cufe',
-            'fecha_emision',
-            'hora_emision',
-            'fecha_vencimiento',
-            'periodo_inicio',
-            'periodo_fin',
-            'cliente_nombre',
-            'cliente_nit',
-            'cliente_direccion',
-            'cliente_codigo_postal',
-            'cliente_municipio',
-            'emisor_nombre',
-            'emisor_nit',
-            'emisor_direccion',
-            'subtotal',
-            'iva_porcentaje',
-            'iva_monto',
-            'imp_consumo_voz',
-            'imp_consumo_datos',
-            'descuentos_totales',
-            'total_pagar'
-        ]
+        return os.path.getsize(path) if isinstance(path, str) else 0
+    except OSError:
+        return 0
+
+
+def _require_invoices(invoices: Iterable[Dict[str, Any]]) -> Iterator[Dict[str, Any]]:
+    """Return an iterator over invoices, raising if there are none."""
+    iterator = iter(invoices)
+    try:
+        first = next(iterator)
+    except StopIteration:
+        raise CSVGenerationError("No invoices to process")
+    return itertools.chain([first], iterator)
+
+
+def _summary_values(invoice: Dict[str, Any]) -> List[Any]:
+    """Build the summary columns of an invoice, with decimals formatted."""
+    if isinstance(invoice, Invoice):
+        row = invoice.row()
+    else:
+        row = [invoice.get(col, '') for col in SUMMARY_COLUMNS]
+
+    # Format decimal fields
+    for i in _SUMMARY_DECIMAL_INDEXES:
+        row[i] = normalize_amount(row[i])
+    return row
+
+
+def _line_values(line: Dict[str, Any]) -> List[Any]:
+    """Build the line columns of a line item, with decimals formatted."""
+    if isinstance(line, InvoiceLine):
+        row = line.row()
+    else:
+        row = [line.get(col, '') for col in LINE_COLUMNS]
+
+    # Format decimal fields
+    for i in _LINE_DECIMAL_INDEXES:
+        row[i] = normalize_amount(row[i])
+    return row
+
+
+def iter_summary_rows(invoices: Iterable[Dict[str, Any]]) -> Iterator[List[Any]]:
+    """Yield one summary row per invoice.
 
-        # Prepare data rows
-        rows = []
-        for invoice in invoices:
-            row = {}
-            for col in columns:
-                value = invoice.get(col, '')
+    Args:
+        invoices: Iterable of parsed invoice dictionaries
+
+    Yields:
+        Rows in SUMMARY_COLUMNS order
+    """
+    for invoice in invoices:
+        yield _summary_values(invoice)
+
+
+def iter_detail_rows(invoices: Iterable[Dict[str, Any]]) -> Iterator[List[Any]]:
+    """Yield one detail row per invoice line item.
+
+    Invoices without lines produce one row with empty line fields. The
+    ``lineas`` entry of an invoice may itself be a lazy iterator; the rows
+    of an invoice are built before its first one is yielded.
+
+    Args:
+        invoices: Iterable of parsed invoice dictionaries
+
+    Yields:
+        Rows in DETAIL_COLUMNS order
+    """
+    counts = {'summary': 0, 'detail': 0}
+    for invoice in invoices:
+        rows: List[List[Any]] = []
+        _write_invoice_rows(invoice, _skip_row, rows.append, counts, {}, 0)
+        yield from rows
+
+
+def _skip_row(row: List[Any]) -> None:
+    """Row writer for rows that are not wanted."""
 
-                # Format decimal fields
-                if col in ['subtotal', 'iva_porcentaje', 'iva_monto', 'imp_consumo_voz',
-                          'imp_consumo_datos', 'descuentos_totales', 'total_pagar']:
-                    value = format_decimal(value)
 
-                row[col] = value
+def _write_or_cleanup(output_path: str, columns: List[str], rows: Iterable[List[Any]]) -> Dict[str, Any]:
+    """Write rows, removing a partially written file on failure."""
+    try:
+        return write_csv_rows(output_path, columns, rows)
+    except Exception:
+        if os.path.exists(output_path):
+            os.remove(output_path)
+        raise
+
+
+def generate_summary_csv(invoices: Iterable[Dict[str, Any]], output_path: str) -> Dict[str, Any]:
+    """Generate facturas_resumen.csv with one row per invoice.
+
+    Args:
+        invoices: Parsed invoice dictionaries (list or generator)
+        output_path: Path where CSV will be saved
 
-            rows.append(row)
+    Returns:
+        Writer statistics (see ``write_csv_rows``)
 
-        # Create DataFrame
-        df = pd.DataFrame(rows, columns=columns)
+    Raises:
+        CSVGenerationError: If CSV cannot be generated
+    """
+    try:
+        invoices = _require_invoices(invoices)
 
         # Write to CSV with UTF-8 BOM for Excel compatibility
-        df.to_csv(
-            output_path,
-            index=False,
-            encoding='utf-8-sig',
-            quoting=csv.QUOTE_NONNUMERIC,
-            sep=','
-        )
+        stats = _write_or_cleanup(output_path, SUMMARY_COLUMNS, iter_summary_rows(invoices))
+        _record_stage('csv', stats['seconds'], _file_size(output_path))
 
-        logger.info(f"Generated summary CSV with {len(rows)} invoices: {output_path}")
+        logger.info(
+            f"Generated summary CSV with {stats['rows']} invoices "
+            f"({stats['rows_per_second']:.0f} rows/s): {output_path}"
+        )
+        return stats
 
     except Exception as e:
         raise CSVGenerationError(f"Error generating summary CSV: {e}")
 
 
-def generate_detail_csv(invoices: List[Dict[str, Any]], output_path: str) -> None:
+def generate_detail_csv(invoices: Iterable[Dict[str, Any]], output_path: str) -> Dict[str, Any]:
     """Generate facturas_detalle.csv with one row per invoice line item.
 
     Each row includes all summary fields plus line-specific fields.
 
     Args:
-        invoices: List of parsed invoice dictionaries
+        invoices: Parsed invoice dictionaries (list or generator)
         output_path: Path where CSV will be saved
 
+    Returns:
+        Writer statistics (see ``write_csv_rows``)
+
     Raises:
         CSVGenerationError: If CSV cannot be generated
     """
     try:
-        if not invoices:
-            raise CSVGenerationError("No invoices to process")
-
-        # Define column headers (summary fields + line fields)
-        columns = [
-            # Summary fields
-            'numero_factura',
-            'prefijo',
-            'cufe',
-            'fecha_emision',
-            'hora_emision',
-            'fecha_vencimiento',
-            'periodo_inicio',
-            'periodo_fin',
-            'cliente_nombre',
-            'cliente_nit',
-            'cliente_direccion',
-            'cliente_codigo_postal',
-            'cliente_municipio',
-            'emisor_nombre',
-            'emisor_nit',
-            'emisor_direccion',
-            'subtotal',
-            'iva_porcentaje',
-            'iva_monto',
-            'imp_consumo_voz',
-            'imp_consumo_datos',
-            'descuentos_totales',
-            'total_pagar',
-            # Line-specific fields
-            'linea_numero',
-            'linea_descripcion',
-            'linea_cantidad',
-            'linea_precio_unitario',
-            'linea_descuento_porcentaje',
-            'linea_total'
+        invoices = _require_invoices(invoices)
+
+        # Write to CSV with UTF-8 BOM for Excel compatibility
+        stats = _write_or_cleanup(output_path, DETAIL_COLUMNS, iter_detail_rows(invoices))
+        _record_stage('csv', stats['seconds'], _file_size(output_path))
+
+        logger.info(
+            f"Generated detail CSV with {stats['rows']} line items "
+            f"({stats['rows_per_second']:.0f} rows/s): {output_path}"
+        )
+        return stats
+
+    except Exception as e:
+        raise CSVGenerationError(f"Error generating detail CSV: {e}")
+
+
+class CSVOutputWriter:
+    """Incremental writer for the summary and detail CSVs.
+
+    Invoices are written as they are passed to ``write``, so a caller can
+    stream any number of invoices with constant memory. Opening an existing
+    pair of files with ``append=True`` continues them without repeating
+    the header.
+
+    Args:
+        summary_path: Path of the summary CSV
+        detail_path: Path of the detail CSV
+        append: Append to existing files instead of overwriting them
+    """
+
+    def __init__(self, summary_path: str, detail_path: str, append: bool = False):
+        self.summary_path = summary_path
+        self.detail_path = detail_path
+        self._counts = {'summary': 0, 'detail': 0}
+
+        # Write to CSV with UTF-8 BOM for Excel compatibility (the BOM is
+        # only written at the start of a file, not when appending)
+        mode = 'a' if append else 'w'
+        self._summary_file = open(summary_path, mode, encoding='utf-8-sig', newline='')
+        try:
+            self._detail_file = open(detail_path, mode, encoding='utf-8-sig', newline='')
+        except Exception:
+            self._summary_file.close()
+            raise
+        self._summary_writer = _csv_writer(self._summary_file)
+        self._detail_writer = _csv_writer(self._detail_file)
+
+        if self._summary_file.tell() == 0:
+            self._summary_writer.writerow(SUMMARY_COLUMNS)
+        if self._detail_file.tell() == 0:
+            self._detail_writer.writerow(DETAIL_COLUMNS)
+
+    @property
+    def summary_count(self) -> int:
+        """Number of summary rows written."""
+        return self._counts['summary']
+
+    @property
+    def detail_count(self) -> int:
+        """Number of detail rows written."""
+        return self._counts['detail']
+
+    def write(self, invoice: Dict[str, Any]) -> None:
+        """Write the summary row and the detail rows of an invoice.
+
+        The summary fields are formatted once and reused for every detail
+        row; an invoice without lines gets one detail row with empty line
+        fields.
+        """
+        _write_invoice_rows(
+            invoice, self._summary_writer.writerow, self._detail_writer.writerow, self._counts, {}, 0
+        )
+
+    def write_stream(self, items: Iterator[Any]) -> int:
+        """Write an invoice streamed by ``xml_parser.stream_invoice``.
+
+        The summary row is written from the header and each detail row as
+        its line arrives, so no more than one line is held in memory. If the
+        stream fails, the rows already written for the invoice are removed
+        before the error is raised again.
+
+        Args:
+            items: Iterator yielding the invoice header, then its lines
+
+        Returns:
+            Number of line items written
+        """
+        files = (self._summary_file, self._detail_file)
+        for csv_file in files:
+            csv_file.flush()
+        offsets = [csv_file.tell() for csv_file in files]
+        counts = dict(self._counts)
+
+        try:
+            invoice = next(items)
+            invoice['lineas'] = items
+            return _write_invoice_rows(
+                invoice, self._summary_writer.writerow, self._detail_writer.writerow, self._counts, {}, 0
+            )
+        except BaseException:
+            for csv_file, offset in zip(files, offsets):
+                csv_file.truncate(offset)
+                csv_file.seek(offset)
+            self._counts.update(counts)
+            raise
+
+    def flush(self) -> Dict[str, int]:
+        """Flush both files to disk.
+
+        Returns:
+            Dictionary with the ``summary`` and ``detail`` file sizes, the
+            offsets a partial run can be truncated back to
+        """
+        offsets = {}
+        for name, csv_file in (('summary', self._summary_file), ('detail', self._detail_file)):
+            csv_file.flush()
+            os.fsync(csv_file.fileno())
+            offsets[name] = csv_file.tell()
+        return offsets
+
+    def close(self) -> None:
+        """Close both files."""
+        self._summary_file.close()
+        self._detail_file.close()
+
+    def __enter__(self) -> 'CSVOutputWriter':
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.close()
+
+
+def generate_csv_outputs(invoices: Iterable[Dict[str, Any]], summary_path: str, detail_path: str) -> Dict[str, Dict[str, Any]]:
+    """Generate facturas_resumen.csv and facturas_detalle.csv in a single pass.
+
+    Both files are written side by side while walking the invoices once;
+    the summary fields of each invoice are formatted once and reused for
+    every one of its detail rows.
+
+    Args:
+        invoices: Parsed invoice dictionaries (list or generator)
+        summary_path: Path where the summary CSV will be saved
+        detail_path: Path where the detail CSV will be saved
+
+    Returns:
+        Dictionary with ``summary`` and ``detail`` writer statistics (see
+        ``write_csv_rows``)
+
+    Raises:
+        CSVGenerationError: If the CSVs cannot be generated
+    """
+    try:
+        invoices = _require_invoices(invoices)
+        start = time.perf_counter()
+
+        try:
+            with CSVOutputWriter(summary_path, detail_path) as writer:
+                for invoice in invoices:
+                    writer.write(invoice)
+        except Exception:
+            for path in (summary_path, detail_path):
+                if os.path.exists(path):
+                    os.remove(path)
+            raise
+
+        seconds = time.perf_counter() - start
+        _record_stage('csv', seconds, _file_size(summary_path) + _file_size(detail_path))
+        stats = {
+            'summary': _writer_stats(summary_path, writer.summary_count, seconds),
+            'detail': _writer_stats(detail_path, writer.detail_count, seconds)
+        }
+
+        logger.info(
+            f"Generated summary CSV with {writer.summary_count} invoices and detail CSV with "
+            f"{writer.detail_count} line items in {seconds:.3f}s: {summary_path}, {detail_path}"
+        )
+        return stats
+
+    except Exception as e:
+        raise CSVGenerationError(f"Error generating CSV files: {e}")
+
+
+def _require_pyarrow() -> None:
+    """Raise if the optional pyarrow package needed for Parquet is missing."""
+    if pa is None:
+        raise CSVGenerationError("Parquet output requires the pyarrow package (pip install pyarrow)")
+
+
+def _to_text(value: Any) -> Optional[str]:
+    """Convert a CSV value to the text of a string column; None stays null."""
+    if isinstance(value, str) or value is None:
+        return value
+    return str(value)
+
+
+def _to_decimal(value: Any) -> Optional[Decimal]:
+    """Convert a formatted amount ('1234.50') to a Decimal; None if empty or invalid.
+
+    Invoices without lines get a detail row with empty line amounts, which
+    are stored as nulls.
+    """
+    try:
+        return Decimal(value) if value not in ('', None) else None
+    except (InvalidOperation, TypeError, ValueError):
+        return None
+
+
+def _to_date(value: Any) -> Optional[datetime.date]:
+    """Convert an ISO date ('2024-01-31') to a date; None if empty or invalid."""
+    try:
+        return datetime.date.fromisoformat(value) if value else None
+    except (TypeError, ValueError):
+        return None
+
+
+def _to_time(value: Any) -> Optional[datetime.time]:
+    """Convert an ISO time ('14:30:05') to a time; None if empty or invalid."""
+    try:
+        return datetime.time.fromisoformat(value) if value else None
+    except (TypeError, ValueError):
+        return None
+
+
+def _parquet_column(column: str) -> Tuple[Any, Callable[[Any], Any]]:
+    """Return the Arrow type of a column and the converter of its CSV values."""
+    if column in SUMMARY_DECIMAL_FIELDS or column in LINE_DECIMAL_FIELDS:
+        return pa.decimal128(PARQUET_DECIMAL_PRECISION, 2), _to_decimal
+    if column in PARQUET_DATE_FIELDS:
+        return pa.date32(), _to_date
+    if column in PARQUET_TIME_FIELDS:
+        return pa.time64('us'), _to_time
+    if column in PARQUET_DICTIONARY_FIELDS:
+        return pa.dictionary(pa.int32(), pa.string()), _to_text
+    return pa.string(), _to_text
+
+
+class ParquetOutputWriter:
+    """Incremental writer of one Parquet file (summary or detail rows).
+
+    Takes the same rows as the CSV writers and stores them with typed
+    columns: decimal amounts, dates and times, and dictionary-encoded
+    names and NITs. Rows are buffered column by column and written as a
+    record batch every ``batch_rows`` rows, so memory stays bounded
+    whatever the number of rows. Every column is nullable: empty values
+    (e.g. the line columns of an invoice without lines) are stored as nulls.
+
+    Args:
+        where: Path or writable binary file object (it does not need to be
+            seekable, e.g. a ZIP entry)
+        columns: Column names, in row order
+        batch_rows: Rows per record batch (and row group)
+
+    Raises:
+        CSVGenerationError: If pyarrow is not installed
+    """
+
+    def __init__(self, where: Any, columns: List[str], batch_rows: int = PARQUET_BATCH_ROWS):
+        _require_pyarrow()
+        types, self._converters = zip(*(_parquet_column(column) for column in columns))
+        self.schema = pa.schema([pa.field(column, arrow_type, nullable=True) for column, arrow_type in zip(columns, types)])
+        self.batch_rows = max(1, batch_rows)
+        self.rows = 0
+        self._buffers: List[List[Any]] = [[] for _ in columns]
+        self._writer = pq.ParquetWriter(where, self.schema)
+
+    def write(self, row: List[Any]) -> None:
+        """Add a row, writing a record batch when enough rows are buffered."""
+        for buffer, value in zip(self._buffers, row):
+            buffer.append(value)
+        self.rows += 1
+        if len(self._buffers[0]) >= self.batch_rows:
+            self._write_batch()
+
+    def _write_batch(self) -> None:
+        """Convert the buffered rows to a record batch and write it."""
+        if not self._buffers[0]:
+            return
+        arrays = [
+            pa.array([convert(value) for value in buffer], type=field.type)
+            for buffer, convert, field in zip(self._buffers, self._converters, self.schema)
         ]
+        self._writer.write_batch(pa.record_batch(arrays, schema=self.schema))
+        for buffer in self._buffers:
+            buffer.clear()
 
-        # Prepare data rows (expand lines)
-        rows = []
-        for invoice in invoices:
-            # Get line items (if any)
-            lines = invoice.get('lineas', [])
-
-            # If no lines, create one row with empty line fields
-            if not lines:
-                row = {}
-                for col in columns:
-                    if col.startswith('linea_'):
-                        row[col] = ''
-                    else:
-                        value = invoice.get(col, '')
-                        # Format decimal fields
-                        if col in ['subtotal', 'iva_porcentaje', 'iva_monto', 'imp_consumo_voz',
-                                  'imp_consumo_datos', 'descuentos_totales', 'total_pagar']:
-                            value = format_decimal(value)
-                        row[col] = value
-                rows.append(row)
-            else:
-                # Create one row per line item
-                for line in lines:
-                    row = {}
-                    for col in columns:
-                        if col.startswith('linea_'):
-                            # Line-specific field
-                            value = line.get(col, '')
-                            # Format decimal fields
-                            if col in ['linea_cantidad', 'linea_precio_unitario',
-                                      'linea_descuento_porcentaje', 'linea_total']:
-                                value = format_decimal(value)
-                            row[col] = value
-                        else:
-                            # Summary field
-                            value = invoice.get(col, '')
-                            # Format decimal fields
-                            if col in ['subtotal', 'iva_porcentaje', 'iva_monto', 'imp_consumo_voz',
-                                      'imp_consumo_datos', 'descuentos_totales', 'total_pagar']:
-                                value = format_decimal(value)
-                            row[col] = value
-                    rows.append(row)
-
-        # Create DataFrame
-        df = pd.DataFrame(rows, columns=columns)
+    def close(self) -> None:
+        """Write the remaining rows and the file footer."""
+        try:
+            self._write_batch()
+        finally:
+            self._writer.close()
 
-        # Write to CSV with UTF-8 BOM for Excel compatibility
-        df.to_csv(
-            output_path,
-            index=False,
-            encoding='utf-8-sig',
-            quoting=csv.QUOTE_NONNUMERIC,
-            sep=','
+    def abort(self) -> None:
+        """Release the writer after a failure, dropping the buffered rows.
+
+        The output is incomplete and is discarded by the caller; errors
+        while closing are logged so they do not mask the original one.
+        """
+        for buffer in self._buffers:
+            buffer.clear()
+        try:
+            self._writer.close()
+        except Exception as e:
+            logger.debug(f"Error closing aborted Parquet writer: {e}")
+
+    def __enter__(self) -> 'ParquetOutputWriter':
+        return self
+
+    def __exit__(self, exc_type: Any, *exc_info: Any) -> None:
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+def generate_parquet_outputs(
+    invoices: Iterable[Dict[str, Any]],
+    summary_path: str,
+    detail_path: str,
+    batch_rows: int = PARQUET_BATCH_ROWS
+) -> Dict[str, Dict[str, Any]]:
+    """Generate the summary and detail tables as Parquet files in a single pass.
+
+    Parquet counterpart of ``generate_csv_outputs``: same rows and column
+    names, with typed columns (see ``ParquetOutputWriter``).
+
+    Args:
+        invoices: Parsed invoice dictionaries (list or generator)
+        summary_path: Path where the summary Parquet file will be saved
+        detail_path: Path where the detail Parquet file will be saved
+        batch_rows: Rows per record batch
+
+    Returns:
+        Dictionary with ``summary`` and ``detail`` writer statistics (see
+        ``write_csv_rows``)
+
+    Raises:
+        CSVGenerationError: If pyarrow is missing or the files cannot be
+            generated
+    """
+    try:
+        _require_pyarrow()
+        invoices = _require_invoices(invoices)
+        start = time.perf_counter()
+        counts = {'summary': 0, 'detail': 0}
+
+        try:
+            with ParquetOutputWriter(summary_path, SUMMARY_COLUMNS, batch_rows) as summary_writer, \
+                    ParquetOutputWriter(detail_path, DETAIL_COLUMNS, batch_rows) as detail_writer:
+                for invoice in invoices:
+                    _write_invoice_rows(invoice, summary_writer.write, detail_writer.write, counts, {}, 0)
+        except Exception:
+            for path in (summary_path, detail_path):
+                if os.path.exists(path):
+                    os.remove(path)
+            raise
+
+        seconds = time.perf_counter() - start
+        _record_stage('parquet', seconds, _file_size(summary_path) + _file_size(detail_path))
+        logger.info(
+            f"Generated Parquet files with {counts['summary']} invoices and {counts['detail']} "
+            f"line items in {seconds:.3f}s"
         )
+        return {
+            'summary': _writer_stats(summary_path, counts['summary'], seconds),
+            'detail': _writer_stats(detail_path, counts['detail'], seconds)
+        }
+
+    except CSVGenerationError:
+        raise
+    except Exception as e:
+        raise CSVGenerationError(f"Error generating Parquet files: {e}")
+
+
+class _ChunkSink(io.RawIOBase):
+    """Unseekable write-only stream that collects what is written to it.
+
+    ZipFile writes data descriptors instead of seeking back when its output
+    is not seekable, which is what allows streaming an archive.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.chunks = []
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data: Any) -> int:
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self) -> bytes:
+        """Return and forget everything written so far."""
+        data = b''.join(self.chunks)
+        self.chunks.clear()
+        return data
+
+
+def _open_csv_zip(target: Any, compresslevel: Optional[int], mode: str = 'w') -> zipfile.ZipFile:
+    """Open a ZIP archive for writing CSV entries at the given deflate level."""
+    level = ZIP_COMPRESSION_LEVEL if compresslevel is None else compresslevel
+    if level <= 0:
+        return zipfile.ZipFile(target, mode, zipfile.ZIP_STORED)
+    return zipfile.ZipFile(target, mode, zipfile.ZIP_DEFLATED, compresslevel=min(level, 9))
+
+
+def _unique_entry_name(existing: Iterable[str], name: str) -> str:
+    """Return ``name``, with a numbered suffix if the archive already has it."""
+    existing = set(existing)
+    stem, extension = os.path.splitext(name)
+    candidate = name
+    number = 2
+    while candidate in existing:
+        candidate = f"{stem}_{number}{extension}"
+        number += 1
+    return candidate
 
-        logger.info(f"Generated detail CSV with {len(rows)} line items: {output_path}")
+
+def _open_csv_entry(zipf: zipfile.ZipFile, name: str) -> io.TextIOWrapper:
+    """Open a ZIP entry as a UTF-8 with BOM text stream for the CSV writer."""
+    return io.TextIOWrapper(zipf.open(name, 'w'), encoding='utf-8-sig', newline='')
+
+
+def _open_stored_entry(zipf: zipfile.ZipFile, name: str) -> Any:
+    """Open a ZIP entry stored without deflate, for data compressed already."""
+    info = zipfile.ZipInfo(name, date_time=time.localtime()[:6])
+    info.compress_type = zipfile.ZIP_STORED
+    return zipf.open(info, 'w')
+
+
+def _write_invoice_rows(
+    invoice: Dict[str, Any],
+    write_summary: Callable[[List[Any]], Any],
+    write_detail: Callable[[List[Any]], Any],
+    counts: Dict[str, int],
+    previews: Dict[str, List[List[Any]]],
+    preview_rows: int
+) -> int:
+    """Write the summary row and the detail rows of one invoice.
+
+    The summary fields are formatted once and reused for every detail row;
+    an invoice without lines gets one detail row with empty line fields.
+    The ``lineas`` entry may be a lazy iterator. The rows are counted in
+    ``counts`` and the first ``preview_rows`` of each kind are appended to
+    ``previews``.
+
+    Returns:
+        Number of line items written
+    """
+    summary = _summary_values(invoice)
+    write_summary(summary)
+    if counts['summary'] < preview_rows:
+        previews['summary'].append(summary)
+    counts['summary'] += 1
+
+    lines = 0
+    for line in invoice.get('lineas') or ():
+        row = summary + _line_values(line)
+        write_detail(row)
+        if counts['detail'] < preview_rows:
+            previews['detail'].append(row)
+        counts['detail'] += 1
+        lines += 1
+
+    if not lines:
+        row = summary + _EMPTY_LINE
+        write_detail(row)
+        if counts['detail'] < preview_rows:
+            previews['detail'].append(row)
+        counts['detail'] += 1
+    return lines
+
+
+def _write_csv_entries(
+    zipf: zipfile.ZipFile,
+    invoices: Iterator[Dict[str, Any]],
+    summary_name: str,
+    detail_name: str,
+    counts: Dict[str, int],
+    previews: Optional[Dict[str, List[List[Any]]]] = None,
+    preview_rows: int = 0
+) -> Iterator[None]:
+    """Write both CSVs as entries of an open ZIP archive in a single pass.
+
+    A ZIP archive accepts one open entry at a time, so the detail rows go
+    straight into their entry while the summary rows (one per invoice) are
+    buffered and written as the second entry; the buffer moves to a
+    temporary file past CSV_SPOOL_BYTES. Yields after every invoice so a
+    streaming caller can forward the compressed output.
+
+    The first ``preview_rows`` rows of each CSV are appended to the
+    ``summary`` and ``detail`` lists of ``previews`` as they are written.
+    """
+    if previews is None or preview_rows <= 0:
+        previews = {'summary': [], 'detail': []}
+        preview_rows = 0
+
+    with tempfile.SpooledTemporaryFile(CSV_SPOOL_BYTES, mode='w+', encoding='utf-8', newline='') as summary_buffer:
+        summary_writer = _csv_writer(summary_buffer)
+        summary_writer.writerow(SUMMARY_COLUMNS)
+
+        with _open_csv_entry(zipf, detail_name) as detail_file:
+            detail_writer = _csv_writer(detail_file)
+            detail_writer.writerow(DETAIL_COLUMNS)
+
+            for invoice in invoices:
+                _write_invoice_rows(
+                    invoice, summary_writer.writerow, detail_writer.writerow,
+                    counts, previews, preview_rows
+                )
+                yield
+
+        summary_buffer.seek(0)
+        with _open_csv_entry(zipf, summary_name) as summary_file:
+            shutil.copyfileobj(summary_buffer, summary_file)
+        yield
+
+
+def _write_parquet_entries(
+    zipf: zipfile.ZipFile,
+    invoices: Iterator[Dict[str, Any]],
+    summary_name: str,
+    detail_name: str,
+    counts: Dict[str, int],
+    previews: Optional[Dict[str, List[List[Any]]]] = None,
+    preview_rows: int = 0
+) -> Iterator[None]:
+    """Write both tables as Parquet entries of an open ZIP archive in a single pass.
+
+    Same flow as ``_write_csv_entries``: the detail file goes straight
+    into its entry and the summary file is buffered (in a temporary file
+    past CSV_SPOOL_BYTES) until the detail entry is complete. Parquet
+    pages are compressed already, so the entries are stored, not deflated.
+    """
+    if previews is None or preview_rows <= 0:
+        previews = {'summary': [], 'detail': []}
+        preview_rows = 0
+
+    with tempfile.SpooledTemporaryFile(CSV_SPOOL_BYTES) as summary_buffer:
+        # The writers abort on any error (or when the caller closes this
+        # generator early) so neither the Parquet writers nor the
+        # temporary file outlive a failed write
+        with ParquetOutputWriter(summary_buffer, SUMMARY_COLUMNS) as summary_writer:
+            with _open_stored_entry(zipf, detail_name) as detail_file, \
+                    ParquetOutputWriter(detail_file, DETAIL_COLUMNS) as detail_writer:
+                for invoice in invoices:
+                    _write_invoice_rows(
+                        invoice, summary_writer.write, detail_writer.write,
+                        counts, previews, preview_rows
+                    )
+                    yield
+
+        summary_buffer.seek(0)
+        with _open_stored_entry(zipf, summary_name) as summary_file:
+            shutil.copyfileobj(summary_buffer, summary_file)
+        yield
+
+
+def _entry_writer(output_format: str) -> Callable[..., Iterator[None]]:
+    """Return the function writing the ZIP entries of an output format."""
+    if output_format == 'csv':
+        return _write_csv_entries
+    if output_format == 'parquet':
+        _require_pyarrow()
+        return _write_parquet_entries
+    raise CSVGenerationError(
+        f"Unknown output format '{output_format}' (expected one of: {', '.join(OUTPUT_FORMATS)})"
+    )
+
+
+def _zip_stats(summary_name: str, detail_name: str, counts: Dict[str, int], seconds: float) -> Dict[str, Dict[str, Any]]:
+    """Build the statistics returned by the ZIP writers."""
+    return {
+        'summary': _writer_stats(summary_name, counts['summary'], seconds),
+        'detail': _writer_stats(detail_name, counts['detail'], seconds)
+    }
+
+
+def generate_csv_zip(
+    invoices: Iterable[Dict[str, Any]],
+    zip_path: Union[str, Any],
+    summary_name: str,
+    detail_name: str,
+    compresslevel: Optional[int] = None,
+    preview_rows: int = 0,
+    output_format: str = DEFAULT_OUTPUT_FORMAT
+) -> Dict[str, Dict[str, Any]]:
+    """Generate both CSVs directly inside a ZIP archive.
+
+    Rows are written into the archive entries as they are produced, so the
+    CSVs never exist as separate files and nothing is read back to be
+    compressed. The first rows of each CSV can be kept for a preview, so
+    the archive does not have to be opened again to show them. With
+    ``output_format='parquet'`` the entries are Parquet files instead.
+
+    Args:
+        invoices: Parsed invoice dictionaries (list or generator)
+        zip_path: Path of the ZIP archive to create, or a writable binary
+            file object
+        summary_name: Entry name of the summary CSV
+        detail_name: Entry name of the detail CSV
+        compresslevel: Deflate level 0-9 (default: ZIP_COMPRESSION_LEVEL);
+            0 stores the entries uncompressed
+        preview_rows: Number of rows of each CSV to return in ``preview``
+        output_format: One of OUTPUT_FORMATS
+
+    Returns:
+        Dictionary with ``summary`` and ``detail`` writer statistics (see
+        ``write_csv_rows``; ``path`` is the entry name), each with a
+        ``preview`` list holding its first rows in column order
+
+    Raises:
+        CSVGenerationError: If the archive cannot be generated
+    """
+    try:
+        write_entries = _entry_writer(output_format)
+        invoices = _require_invoices(invoices)
+        start = time.perf_counter()
+        counts = {'summary': 0, 'detail': 0}
+        previews = {'summary': [], 'detail': []}
+
+        try:
+            with _open_csv_zip(zip_path, compresslevel) as zipf:
+                for _ in write_entries(zipf, invoices, summary_name, detail_name, counts, previews, preview_rows):
+                    pass
+        except Exception:
+            if isinstance(zip_path, str) and os.path.exists(zip_path):
+                os.remove(zip_path)
+            raise
+
+        seconds = time.perf_counter() - start
+        _record_stage('zip', seconds, _file_size(zip_path))
+        logger.info(
+            f"Generated ZIP with {counts['summary']} invoices and {counts['detail']} "
+            f"line items in {seconds:.3f}s: {zip_path}"
+        )
+        stats = _zip_stats(summary_name, detail_name, counts, seconds)
+        stats['summary']['preview'] = previews['summary']
+        stats['detail']['preview'] = previews['detail']
+        return stats
 
     except Exception as e:
-        raise CSVGenerationError(f"Error generating detail CSV: {e}")
+        raise CSVGenerationError(f"Error generating ZIP archive: {e}")
+
+
+def append_csv_zip(
+    invoices: Iterable[Dict[str, Any]],
+    zip_path: str,
+    summary_name: str,
+    detail_name: str,
+    compresslevel: Optional[int] = None,
+    preview_rows: int = 0,
+    output_format: str = DEFAULT_OUTPUT_FORMAT
+) -> Dict[str, Dict[str, Any]]:
+    """Add a summary/detail CSV pair to an existing ZIP archive.
+
+    The new entries are written where the archive's central directory
+    starts and the directory is rewritten after them; the entries already
+    in the archive are neither read nor recompressed, so the cost depends
+    on the invoices added only. The original central directory is kept in
+    a journal file next to the archive until the append is complete: if
+    writing fails, or the process died during an earlier append, it is put
+    back and the archive is left as it was.
+
+    Args:
+        invoices: Parsed invoice dictionaries (list or generator)
+        zip_path: Path of the existing ZIP archive
+        summary_name: Entry name of the summary CSV (a numbered suffix is
+            added if the archive already has an entry with that name)
+        detail_name: Entry name of the detail CSV (same)
+        compresslevel: Deflate level 0-9 (default: ZIP_COMPRESSION_LEVEL)
+        preview_rows: Number of rows of each CSV to return in ``preview``
+        output_format: One of OUTPUT_FORMATS; the pair added may be in a
+            different format than the entries already in the archive
+
+    Returns:
+        Same statistics as ``generate_csv_zip``; ``path`` is the entry
+        name actually used
+
+    Raises:
+        CSVGenerationError: If there are no invoices, the archive cannot be
+            read or the entries cannot be written
+    """
+    try:
+        write_entries = _entry_writer(output_format)
+        invoices = _require_invoices(invoices)
+        start = time.perf_counter()
+        counts = {'summary': 0, 'detail': 0}
+        previews = {'summary': [], 'detail': []}
+
+        journal_path = zip_path + APPEND_JOURNAL_SUFFIX
+
+        with open(zip_path, 'r+b') as zip_file:
+            _rollback_append(zip_file, journal_path)
+            zipf = _open_csv_zip(zip_file, compresslevel, mode='a')
+            names = zipf.namelist()
+            summary_name = _unique_entry_name(names, summary_name)
+            detail_name = _unique_entry_name(names, detail_name)
+
+            # The central directory is overwritten by the new entries; keep
+            # it to restore the archive on failure
+            directory_offset = zipf.start_dir
+            zip_file.seek(directory_offset)
+            with open(journal_path, 'wb') as journal:
+                journal.write(struct.pack('<Q', directory_offset))
+                shutil.copyfileobj(zip_file, journal)
+                journal.flush()
+                os.fsync(journal.fileno())
+            zip_file.seek(directory_offset)
+
+            try:
+                with zipf:
+                    for _ in write_entries(zipf, invoices, summary_name, detail_name, counts, previews, preview_rows):
+                        pass
+            except Exception:
+                _rollback_append(zip_file, journal_path)
+                raise
+            os.remove(journal_path)
+
+        seconds = time.perf_counter() - start
+        _record_stage('zip', seconds, _file_size(zip_path))
+        logger.info(
+            f"Appended {counts['summary']} invoices and {counts['detail']} "
+            f"line items in {seconds:.3f}s to {zip_path}"
+        )
+        stats = _zip_stats(summary_name, detail_name, counts, seconds)
+        stats['summary']['preview'] = previews['summary']
+        stats['detail']['preview'] = previews['detail']
+        return stats
+
+    except CSVGenerationError:
+        raise
+    except Exception as e:
+        raise CSVGenerationError(f"Error appending to ZIP archive: {e}")
+
+
+def _rollback_append(zip_file: Any, journal_path: str) -> None:
+    """Put back the central directory saved in an append journal, if any."""
+    if not os.path.exists(journal_path):
+        return
+    with open(journal_path, 'rb') as journal:
+        header = journal.read(8)
+        if len(header) == 8:
+            directory_offset, = struct.unpack('<Q', header)
+            zip_file.seek(directory_offset)
+            shutil.copyfileobj(journal, zip_file)
+            zip_file.truncate()
+            zip_file.flush()
+            logger.warning(f"Rolled back an unfinished append to {zip_file.name}")
+    # A journal cut short was written before the archive was touched
+    os.remove(journal_path)
+
+
+def iter_csv_zip(
+    invoices: Iterable[Dict[str, Any]],
+    summary_name: str,
+    detail_name: str,
+    compresslevel: Optional[int] = None,
+    output_format: str = DEFAULT_OUTPUT_FORMAT
+) -> Iterator[bytes]:
+    """Generate the ZIP archive with both CSVs as a stream of byte chunks.
+
+    Meant to be used as an HTTP response body: compressed data is handed
+    out as it is produced and the archive is never held in full.
+
+    Args:
+        invoices: Parsed invoice dictionaries (list or generator)
+        summary_name: Entry name of the summary CSV
+        detail_name: Entry name of the detail CSV
+        compresslevel: Deflate level 0-9 (default: ZIP_COMPRESSION_LEVEL)
+        output_format: One of OUTPUT_FORMATS
+
+    Yields:
+        Consecutive pieces of the ZIP archive
+
+    Raises:
+        CSVGenerationError: If there are no invoices or the format is not
+            available (raised on the first iteration) or the archive cannot
+            be generated
+    """
+    try:
+        write_entries = _entry_writer(output_format)
+        invoices = _require_invoices(invoices)
+        sink = _ChunkSink()
+        counts = {'summary': 0, 'detail': 0}
+        # Generation time only, not the time the consumer takes between chunks
+        seconds = 0.0
+        size = 0
+
+        start = time.perf_counter()
+        with _open_csv_zip(sink, compresslevel) as zipf:
+            for _ in write_entries(zipf, invoices, summary_name, detail_name, counts):
+                if sink.chunks:
+                    chunk = sink.drain()
+                    seconds += time.perf_counter() - start
+                    size += len(chunk)
+                    yield chunk
+                    start = time.perf_counter()
+
+        # Central directory
+        chunk = sink.drain()
+        seconds += time.perf_counter() - start
+        _record_stage('zip', seconds, size + len(chunk))
+        yield chunk
+        logger.info(f"Streamed ZIP with {counts['summary']} invoices and {counts['detail']} line items")
+
+    except CSVGenerationError:
+        raise
+    except Exception as e:
+        raise CSVGenerationError(f"Error generating ZIP archive: {e}")
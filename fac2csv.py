@@ -0,0 +1,516 @@
+"""
+Command-line batch converter for DIAN electronic invoices.
+
+Converts the XML invoices found in directories, glob patterns and ZIP
+archives to facturas_resumen.csv and facturas_detalle.csv, using the same
+validation, parsing and CSV code as the web application.
+
+Files are converted in chunks and the CSVs are appended to as each chunk
+completes, so memory use does not grow with the size of the run. XML
+files larger than the upload limit (MAX_FILE_SIZE) are not rejected but
+streamed line by line (see ``xml_parser.stream_invoice``), so a single
+very large invoice does not have to fit in memory either. After
+every chunk the converted sources and the CSV sizes are recorded in a state
+file in the output directory; an interrupted run started again with the
+same output directory skips what was already converted and continues
+where it stopped.
+
+Usage:
+    python fac2csv.py facturas/ lote.zip "entrada/**/*.xml" -o salida --jobs 4
+"""
+
+import argparse
+import csv
+import glob
+import itertools
+import json
+import logging
+import os
+import sys
+import time
+from typing import Any, Dict, Iterator, List, NamedTuple, Optional, Set, Tuple
+
+import parse_cache
+from csv_generator import CSVOutputWriter
+from pipeline import (
+    PROCESSING_MODES,
+    DEFAULT_PROCESSING_MODE,
+    DEFAULT_PROCESSING_WORKERS,
+    describe_source,
+    iter_process_xml_files,
+    iter_zip_upload
+)
+from utils.validators import MAX_FILE_SIZE
+from xml_parser import ParseError, stream_invoice
+
+logger = logging.getLogger('fac2csv')
+
+# Output files, relative to the output directory
+SUMMARY_FILENAME = 'facturas_resumen.csv'
+DETAIL_FILENAME = 'facturas_detalle.csv'
+ERRORS_FILENAME = 'facturas_errores.csv'
+STATE_FILENAME = '.fac2csv_state.jsonl'
+
+ERROR_COLUMNS = ['archivo', 'tipo_error', 'error']
+
+# Files processed between two checkpoints of the state file
+DEFAULT_CHUNK_SIZE = 500
+
+# XML files above this size are streamed in the main process instead of
+# being validated and parsed as a whole by the workers
+STREAM_ABOVE_BYTES = MAX_FILE_SIZE
+
+INPUT_EXTENSIONS = ('.xml', '.zip')
+
+
+class RunStats(NamedTuple):
+    """Totals of a conversion run."""
+    files: int
+    skipped: int
+    invoices: int
+    lines: int
+    errors: int
+    cache_hits: int
+    input_bytes: int
+    seconds: float
+
+
+def collect_inputs(patterns: List[str]) -> List[str]:
+    """Expand the command-line inputs into a list of XML and ZIP files.
+
+    Directories are walked recursively and glob patterns are expanded
+    (``**`` matches any number of directories). Files are returned in a
+    stable order, without duplicates.
+
+    Args:
+        patterns: Files, directories or glob patterns
+
+    Returns:
+        Absolute paths of the XML and ZIP files found
+    """
+    paths = []
+    for pattern in patterns:
+        if glob.has_magic(pattern):
+            matches = sorted(glob.glob(pattern, recursive=True))
+            if not matches:
+                logger.warning(f"No files match {pattern}")
+        else:
+            matches = [pattern]
+
+        for match in matches:
+            if os.path.isdir(match):
+                for root, dirs, files in os.walk(match):
+                    dirs.sort()
+                    paths.extend(
+                        os.path.join(root, name) for name in sorted(files)
+                        if name.lower().endswith(INPUT_EXTENSIONS)
+                    )
+            elif os.path.isfile(match):
+                if match.lower().endswith(INPUT_EXTENSIONS):
+                    paths.append(match)
+                else:
+                    logger.warning(f"Skipping {match}: not an XML or ZIP file")
+            else:
+                logger.warning(f"Input not found: {match}")
+
+    return list(dict.fromkeys(os.path.abspath(path) for path in paths))
+
+
+def source_key(path: str, member: Optional[str] = None) -> str:
+    """Return the key a source is recorded under in the state file."""
+    return f"{path}!{member}" if member else path
+
+
+def iter_sources(paths: List[str], done: Set[str], errors: List[Dict[str, str]]) -> Iterator[Dict[str, Any]]:
+    """Yield the files to convert, skipping the ones already converted.
+
+    XML files are yielded by path; the XML members of ZIP archives are read
+    one at a time (see ``pipeline.iter_zip_upload``).
+
+    Args:
+        paths: Files from ``collect_inputs``
+        done: Keys of the sources converted by a previous run
+        errors: List where unreadable archives and members are appended,
+            as dictionaries with ``file``, ``error`` and ``key``
+
+    Yields:
+        File infos for ``process_xml_files``, with their state ``key``
+    """
+    for path in paths:
+        key = source_key(path)
+        if key in done:
+            continue
+
+        filename = os.path.basename(path)
+        if not path.lower().endswith('.zip'):
+            yield {'path': path, 'filename': filename, 'from_zip': None, 'key': key}
+            continue
+
+        member_errors = []
+        try:
+            for info in iter_zip_upload(path, filename, member_errors,
+                                        skip=lambda member: source_key(path, member) in done):
+                info['key'] = source_key(path, info['member'])
+                yield info
+                errors.extend(_keyed_errors(member_errors, path))
+                member_errors.clear()
+        except IOError as e:
+            errors.append({'file': filename, 'error': str(e), 'key': key})
+        errors.extend(_keyed_errors(member_errors, path))
+
+
+def _keyed_errors(member_errors: List[Dict[str, str]], path: str) -> List[Dict[str, str]]:
+    """Attach state keys to the read errors of ZIP members."""
+    return [dict(error, key=source_key(path, error['member'])) for error in member_errors]
+
+
+class ConversionState:
+    """Checkpoints of a run, stored as JSON lines in the output directory.
+
+    Each line lists the sources converted by one chunk and the sizes of the
+    output files once that chunk was written. On resume the output files
+    are truncated back to the last checkpoint, so a chunk interrupted half
+    way is converted again without leaving duplicate rows behind.
+
+    Args:
+        path: State file
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.done: Set[str] = set()
+        self.offsets: Dict[str, int] = {}
+
+    def load(self) -> bool:
+        """Read the checkpoints of a previous run.
+
+        Returns:
+            True if a previous run was found
+        """
+        if not os.path.exists(self.path):
+            return False
+
+        valid_lines = []
+        with open(self.path, 'r', encoding='utf-8') as state_file:
+            for line in state_file:
+                try:
+                    checkpoint = json.loads(line)
+                except ValueError:
+                    # Last line cut short by an interruption
+                    logger.warning(f"Ignoring incomplete checkpoint in {self.path}")
+                    break
+                valid_lines.append(line)
+                self.done.update(checkpoint['done'])
+                self.offsets = checkpoint['offsets']
+            else:
+                return True
+
+        # Drop the incomplete line so that new checkpoints start on a line of their own
+        with open(self.path, 'w', encoding='utf-8') as state_file:
+            state_file.writelines(valid_lines)
+        return True
+
+    def reset(self) -> None:
+        """Forget any previous run."""
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        self.done.clear()
+        self.offsets = {}
+
+    def checkpoint(self, keys: List[str], offsets: Dict[str, int]) -> None:
+        """Record a converted chunk and the output sizes after it."""
+        line = json.dumps({'done': keys, 'offsets': offsets}, ensure_ascii=False)
+        with open(self.path, 'a', encoding='utf-8') as state_file:
+            state_file.write(line + '\n')
+            state_file.flush()
+            os.fsync(state_file.fileno())
+        self.done.update(keys)
+        self.offsets = offsets
+
+
+def _truncate_outputs(paths: Dict[str, str], offsets: Dict[str, int]) -> bool:
+    """Cut the output files back to a checkpoint.
+
+    Returns:
+        False if an output file is missing or shorter than the checkpoint,
+        in which case the run cannot be resumed
+    """
+    for name, path in paths.items():
+        if name not in offsets or not os.path.exists(path) or os.path.getsize(path) < offsets[name]:
+            return False
+    for name, path in paths.items():
+        with open(path, 'r+b') as output_file:
+            output_file.truncate(offsets[name])
+    return True
+
+
+def _source_size(file_info: Dict[str, Any]) -> int:
+    """Return the size in bytes of a file to convert."""
+    if file_info.get('data') is not None:
+        return len(file_info['data'])
+    try:
+        return os.path.getsize(file_info['path'])
+    except OSError:
+        return 0
+
+
+def _streams(file_info: Dict[str, Any]) -> bool:
+    """Return whether a file is converted with the streaming parser."""
+    return file_info.get('data') is None and _source_size(file_info) > STREAM_ABOVE_BYTES
+
+
+# Stands in for the result of a file converted with the streaming parser
+_STREAMED = {'cached': False}
+
+
+def _chunk_infos(infos: Iterator[Dict[str, Any]], chunk: List[Tuple[str, int, Any]]) -> Iterator[Dict[str, Any]]:
+    """Pass the files of a chunk to the pipeline, recording them in ``chunk``.
+
+    Each file is recorded as it is taken, as (state key, size, file info if
+    it is to be streamed, else None); the ZIP members read into memory are
+    not kept. Files to stream are passed through with the ``_STREAMED``
+    result, for the caller to convert in order.
+    """
+    for info in infos:
+        stream = _streams(info)
+        chunk.append((info['key'], _source_size(info), info if stream else None))
+        yield {'result': _STREAMED} if stream else info
+
+
+def convert(
+    paths: List[str],
+    output_dir: str,
+    mode: str = DEFAULT_PROCESSING_MODE,
+    jobs: int = DEFAULT_PROCESSING_WORKERS,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    resume: bool = True,
+    progress: bool = True
+) -> RunStats:
+    """Convert XML invoices to summary, detail and error CSVs.
+
+    Args:
+        paths: Files from ``collect_inputs``
+        output_dir: Directory of the CSVs and the state file
+        mode: Processing mode ('process', 'thread' or 'serial')
+        jobs: Number of parallel workers
+        chunk_size: Files converted between two checkpoints
+        resume: Continue a previous run into the same output directory
+            instead of starting over
+        progress: Print a progress line to stderr after every chunk
+
+    Returns:
+        Totals of the run
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    outputs = {
+        'summary': os.path.join(output_dir, SUMMARY_FILENAME),
+        'detail': os.path.join(output_dir, DETAIL_FILENAME),
+        'errors': os.path.join(output_dir, ERRORS_FILENAME)
+    }
+
+    state = ConversionState(os.path.join(output_dir, STATE_FILENAME))
+    append = False
+    if resume and state.load():
+        append = _truncate_outputs(outputs, state.offsets)
+        if append:
+            logger.info(f"Resuming previous run: {len(state.done)} source(s) already converted")
+        else:
+            logger.warning("Output files do not match the state file, starting over")
+    if not append:
+        state.reset()
+    skipped = len(state.done)
+
+    start = time.perf_counter()
+    files = invoices = lines = error_count = cache_hits = input_bytes = 0
+    read_errors: List[Dict[str, str]] = []
+    sources = iter_sources(paths, set(state.done), read_errors)
+
+    writer = CSVOutputWriter(outputs['summary'], outputs['detail'], append=append)
+    try:
+        errors_file = open(outputs['errors'], 'a' if append else 'w', encoding='utf-8-sig', newline='')
+    except Exception:
+        writer.close()
+        raise
+    try:
+        errors_writer = csv.writer(errors_file, quoting=csv.QUOTE_NONNUMERIC)
+        if errors_file.tell() == 0:
+            errors_writer.writerow(ERROR_COLUMNS)
+
+        while True:
+            # The pipeline reads the files of the chunk as its window of
+            # documents in flight frees up, so only that window is in memory
+            chunk: List[Tuple[str, int, Any]] = []
+            results = iter_process_xml_files(
+                _chunk_infos(itertools.islice(sources, chunk_size), chunk), mode, jobs
+            )
+
+            # Results come back in input order, so the CSVs are deterministic
+            for seq, result in enumerate(results):
+                info = chunk[seq][2]
+                if info is not None:
+                    try:
+                        lines += writer.write_stream(stream_invoice(info['path']))
+                        invoices += 1
+                    except ParseError as e:
+                        logger.error(f"Streaming failed for {info['path']}: {e}")
+                        errors_writer.writerow([describe_source(info['filename'], info['from_zip']), 'parsing', str(e)])
+                        error_count += 1
+                    continue
+
+                invoice = result.get('invoice')
+                if invoice is not None:
+                    writer.write(invoice)
+                    invoices += 1
+                    lines += len(invoice.get('lineas') or ())
+                    cache_hits += 1 if result.get('cached') else 0
+                else:
+                    errors_writer.writerow([result['file'], result['error_type'], result['error']])
+                    error_count += 1
+
+            if not chunk and not read_errors:
+                break
+            input_bytes += sum(size for _, size, _ in chunk)
+            keys = [key for key, _, _ in chunk]
+
+            # Archives and members that could not be read count as failed files
+            for error in read_errors:
+                errors_writer.writerow([error['file'], 'validation', error['error']])
+                keys.append(error['key'])
+                error_count += 1
+            files += len(chunk) + len(read_errors)
+            read_errors.clear()
+
+            offsets = writer.flush()
+            errors_file.flush()
+            os.fsync(errors_file.fileno())
+            offsets['errors'] = errors_file.tell()
+            state.checkpoint(keys, offsets)
+
+            if progress:
+                elapsed = time.perf_counter() - start
+                rate = files / elapsed if elapsed else 0.0
+                print(
+                    f"  {files} archivos, {invoices} facturas, {error_count} errores "
+                    f"({rate:.1f} archivos/s)",
+                    file=sys.stderr, flush=True
+                )
+    finally:
+        writer.close()
+        errors_file.close()
+
+    return RunStats(
+        files=files,
+        skipped=skipped,
+        invoices=invoices,
+        lines=lines,
+        errors=error_count,
+        cache_hits=cache_hits,
+        input_bytes=input_bytes,
+        seconds=time.perf_counter() - start
+    )
+
+
+def format_report(stats: RunStats, output_dir: str) -> str:
+    """Return the end-of-run throughput report."""
+    seconds = stats.seconds or 1e-9
+    megabytes = stats.input_bytes / (1024 * 1024)
+    lines = [
+        f"Archivos procesados: {stats.files}",
+        f"Facturas convertidas: {stats.invoices} ({stats.lines} líneas, {stats.cache_hits} desde caché)",
+        f"Errores: {stats.errors}",
+        f"Tiempo: {stats.seconds:.2f} s",
+        f"Rendimiento: {stats.files / seconds:.1f} archivos/s, "
+        f"{stats.invoices / seconds:.1f} facturas/s, {megabytes / seconds:.2f} MB/s",
+        f"Salida: {os.path.abspath(output_dir)}"
+    ]
+    if stats.skipped:
+        lines.insert(1, f"Omitidos (ya convertidos): {stats.skipped}")
+    return '\n'.join(lines)
+
+
+def build_parser() -> argparse.ArgumentParser:
+    """Return the command-line argument parser."""
+    parser = argparse.ArgumentParser(
+        prog='fac2csv',
+        description='Convierte facturas electrónicas DIAN (XML o ZIP) a CSV de resumen y detalle.'
+    )
+    parser.add_argument(
+        'inputs', nargs='+',
+        help='Archivos XML o ZIP, directorios (se recorren recursivamente) o patrones glob'
+    )
+    parser.add_argument(
+        '-o', '--output', default='.',
+        help='Directorio de salida de los CSV (por defecto: directorio actual)'
+    )
+    parser.add_argument(
+        '-j', '--jobs', type=int, default=DEFAULT_PROCESSING_WORKERS,
+        help=f'Número de procesos en paralelo (por defecto: {DEFAULT_PROCESSING_WORKERS})'
+    )
+    parser.add_argument(
+        '--mode', choices=PROCESSING_MODES, default=DEFAULT_PROCESSING_MODE,
+        help=f'Modo de procesamiento (por defecto: {DEFAULT_PROCESSING_MODE})'
+    )
+    parser.add_argument(
+        '--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE,
+        help=f'Archivos por bloque entre puntos de control (por defecto: {DEFAULT_CHUNK_SIZE})'
+    )
+    parser.add_argument(
+        '--restart', action='store_true',
+        help='Ignorar una ejecución anterior en el directorio de salida y empezar de cero'
+    )
+    parser.add_argument(
+        '--no-cache', action='store_true',
+        help='No usar la caché de facturas procesadas'
+    )
+    parser.add_argument(
+        '-q', '--quiet', action='store_true',
+        help='No mostrar el progreso'
+    )
+    parser.add_argument(
+        '-v', '--verbose', action='store_true',
+        help='Mostrar los mensajes de log detallados'
+    )
+    return parser
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """Run the converter.
+
+    Returns:
+        Exit status: 0 on success, 1 if no input was found or no invoice
+        could be converted
+    """
+    args = build_parser().parse_args(argv)
+
+    logging.basicConfig(
+        level=logging.INFO if args.verbose else logging.WARNING,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        force=True
+    )
+
+    if args.no_cache:
+        # Worker processes read the setting from the environment
+        os.environ['PARSE_CACHE_ENABLED'] = '0'
+        parse_cache.PARSE_CACHE_ENABLED = False
+
+    paths = collect_inputs(args.inputs)
+    if not paths:
+        print("No se encontraron archivos XML o ZIP", file=sys.stderr)
+        return 1
+
+    stats = convert(
+        paths,
+        args.output,
+        mode=args.mode,
+        jobs=max(1, args.jobs),
+        chunk_size=max(1, args.chunk_size),
+        resume=not args.restart,
+        progress=not args.quiet
+    )
+
+    print(format_report(stats, args.output))
+    return 1 if stats.errors and not stats.invoices and not stats.skipped else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,722 @@
+"""Background processing of upload batches.
+
+An upload is recorded as a job in a local SQLite database and processed by
+worker threads of the web process, so the request returns right away and
+the browser polls ``/jobs/<id>`` for per-file progress. There is no
+external broker: any process that shares the database can run queued
+jobs, and a job left running by a process that died is picked up again
+once its heartbeat is stale.
+
+The CUFEs written to the results of a batch are indexed in the same
+database, so invoices uploaded later can be appended to the batch without
+repeating the ones it already has (see ``run_append_job``).
+"""
+
+import itertools
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Set
+
+from csv_generator import (
+    generate_csv_zip,
+    append_csv_zip,
+    SUMMARY_COLUMNS,
+    DETAIL_COLUMNS,
+    PREVIEW_ROWS,
+    DEFAULT_OUTPUT_FORMAT
+)
+from pipeline import iter_batch_files, iter_process_xml_files, list_batch_files
+from utils.metrics import inc, observe_stage
+
+logger = logging.getLogger(__name__)
+
+# Configuration, overridable from the environment
+JOBS_DB_PATH = os.environ.get('JOBS_DB_PATH', os.path.join('jobs', 'jobs.sqlite3'))
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', 1))
+JOB_STALE_SECONDS = int(os.environ.get('JOB_STALE_SECONDS', 600))
+
+# Seconds between checks for jobs queued by other processes
+JOB_POLL_INTERVAL = 2.0
+
+# Finished files returned per progress request
+JOB_FILES_PAGE = int(os.environ.get('JOB_FILES_PAGE', 200))
+
+# Job states; 'done' and 'failed' are final
+JOB_QUEUED = 'queued'
+JOB_RUNNING = 'running'
+JOB_DONE = 'done'
+JOB_FAILED = 'failed'
+
+# File states within a job
+FILE_PENDING = 'pending'
+FILE_DONE = 'done'
+FILE_ERROR = 'error'
+# Appended invoice already in the batch
+FILE_SKIPPED = 'skipped'
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    uploads TEXT NOT NULL,
+    options TEXT NOT NULL,
+    total_count INTEGER NOT NULL,
+    result TEXT,
+    error TEXT NOT NULL DEFAULT '',
+    created REAL NOT NULL,
+    started REAL,
+    finished REAL,
+    heartbeat REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created);
+CREATE TABLE IF NOT EXISTS job_files (
+    job_id TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    status TEXT NOT NULL,
+    error TEXT NOT NULL DEFAULT '',
+    PRIMARY KEY (job_id, seq)
+);
+CREATE TABLE IF NOT EXISTS batch_cufes (
+    batch_id TEXT NOT NULL,
+    cufe TEXT NOT NULL,
+    PRIMARY KEY (batch_id, cufe)
+) WITHOUT ROWID;
+"""
+
+# Runnable jobs, oldest first. An append job waits while another append
+# to the same batch is running, since both would write to its ZIP.
+_CLAIM_QUERY = """
+SELECT * FROM jobs
+WHERE (status = :queued OR (status = :running AND heartbeat < :stale))
+AND NOT EXISTS (
+    SELECT 1 FROM jobs AS other
+    WHERE other.status = :running AND other.heartbeat >= :stale AND other.id != jobs.id
+    AND json_extract(other.options, '$.append_to') = json_extract(jobs.options, '$.append_to')
+)
+ORDER BY created LIMIT 1
+"""
+
+# Finished jobs older than a cutoff. A batch is kept while an append to it
+# is pending or finished after the cutoff, since its results are still used.
+_PURGE_QUERY = """
+SELECT id FROM jobs
+WHERE status IN (:done, :failed) AND finished < :cutoff
+AND NOT EXISTS (
+    SELECT 1 FROM jobs AS other
+    WHERE json_extract(other.options, '$.append_to') = jobs.id
+    AND (other.finished IS NULL OR other.finished >= :cutoff)
+)
+"""
+
+
+class JobError(Exception):
+    """Custom exception for job processing errors."""
+    pass
+
+
+class JobStore:
+    """Jobs and their per-file progress, stored in a SQLite database.
+
+    Safe to share between threads (each thread gets its own connection)
+    and processes (jobs are claimed in an immediate transaction).
+
+    Args:
+        path: Database file
+    """
+
+    def __init__(self, path: str = JOBS_DB_PATH):
+        self.path = path
+        self._local = threading.local()
+
+    def _connect(self) -> sqlite3.Connection:
+        """Return this thread's connection, creating the database if needed."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.executescript(_SCHEMA)
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def _transaction(self) -> Iterator[sqlite3.Connection]:
+        """Run statements in a write transaction taken up front."""
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            yield conn
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+
+    def create_job(
+        self,
+        uploads: List[Dict[str, Any]],
+        total_count: int,
+        options: Optional[Dict[str, Any]] = None,
+        job_id: Optional[str] = None
+    ) -> str:
+        """Queue a new job.
+
+        Args:
+            uploads: Uploaded files, as dictionaries with ``path``,
+                ``filename`` and ``kind`` ('xml' or 'zip')
+            total_count: Number of files the user uploaded
+            options: Processing options of the batch
+            job_id: Id to give the job (default: a new uuid4 hex)
+
+        Returns:
+            Job id
+        """
+        job_id = job_id or uuid.uuid4().hex
+        with self._transaction() as conn:
+            conn.execute(
+                'INSERT INTO jobs (id, status, uploads, options, total_count, created) VALUES (?, ?, ?, ?, ?, ?)',
+                (job_id, JOB_QUEUED, json.dumps(uploads), json.dumps(options or {}), total_count, time.time())
+            )
+        logger.info(f"Queued job {job_id} with {len(uploads)} upload(s)")
+        return job_id
+
+    def claim_next(self) -> Optional[Dict[str, Any]]:
+        """Mark the oldest runnable job as running and return it.
+
+        Queued jobs are taken first; running jobs whose heartbeat is older
+        than JOB_STALE_SECONDS (their process died) are taken again. Appends
+        to a batch run one at a time.
+
+        Returns:
+            The claimed job, or None if there is nothing to run
+        """
+        now = time.time()
+        with self._transaction() as conn:
+            row = conn.execute(
+                _CLAIM_QUERY, {'queued': JOB_QUEUED, 'running': JOB_RUNNING, 'stale': now - JOB_STALE_SECONDS}
+            ).fetchone()
+            if row is None:
+                return None
+            if row['status'] == JOB_RUNNING:
+                logger.warning(f"Job {row['id']} stalled, running it again")
+            conn.execute(
+                'UPDATE jobs SET status = ?, started = ?, heartbeat = ? WHERE id = ?',
+                (JOB_RUNNING, now, now, row['id'])
+            )
+            conn.execute('DELETE FROM job_files WHERE job_id = ?', (row['id'],))
+        return self._job_from_row(row, status=JOB_RUNNING)
+
+    def set_files(self, job_id: str, files: List[Dict[str, str]]) -> None:
+        """Record the files a job will process.
+
+        Args:
+            job_id: Job id
+            files: Dictionaries with ``name``, ``status`` and ``error``, in
+                processing order
+        """
+        with self._transaction() as conn:
+            conn.execute('DELETE FROM job_files WHERE job_id = ?', (job_id,))
+            conn.executemany(
+                'INSERT INTO job_files (job_id, seq, name, status, error) VALUES (?, ?, ?, ?, ?)',
+                [(job_id, seq, f['name'], f['status'], f.get('error', '')) for seq, f in enumerate(files)]
+            )
+            conn.execute('UPDATE jobs SET heartbeat = ? WHERE id = ?', (time.time(), job_id))
+
+    def update_file(self, job_id: str, seq: int, status: str, error: str = '') -> None:
+        """Record the outcome of one file of a job."""
+        with self._transaction() as conn:
+            conn.execute(
+                'UPDATE job_files SET status = ?, error = ? WHERE job_id = ? AND seq = ?',
+                (status, error, job_id, seq)
+            )
+            conn.execute('UPDATE jobs SET heartbeat = ? WHERE id = ?', (time.time(), job_id))
+
+    def finish_job(self, job_id: str, result: Dict[str, Any]) -> None:
+        """Mark a job as done and store its result."""
+        now = time.time()
+        with self._transaction() as conn:
+            conn.execute(
+                'UPDATE jobs SET status = ?, result = ?, finished = ?, heartbeat = ? WHERE id = ?',
+                (JOB_DONE, json.dumps(result), now, now, job_id)
+            )
+
+    def fail_job(self, job_id: str, error: str) -> None:
+        """Mark a job as failed."""
+        now = time.time()
+        with self._transaction() as conn:
+            conn.execute(
+                'UPDATE jobs SET status = ?, error = ?, finished = ?, heartbeat = ? WHERE id = ?',
+                (JOB_FAILED, error, now, now, job_id)
+            )
+
+    def get_job(self, job_id: str, files: bool = True) -> Optional[Dict[str, Any]]:
+        """Return a job with its per-file progress.
+
+        Args:
+            job_id: Job id
+            files: Whether to load the per-file progress (one row per file)
+
+        Returns:
+            Job dictionary (see ``_job_from_row``) with a ``files`` list
+            (empty when ``files`` is False), or None if the job does not exist
+        """
+        conn = self._connect()
+        row = conn.execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = self._job_from_row(row)
+        if not files:
+            job['files'] = []
+            return job
+        job['files'] = [
+            {'name': f['name'], 'status': f['status'], 'error': f['error']}
+            for f in conn.execute(
+                'SELECT name, status, error FROM job_files WHERE job_id = ? ORDER BY seq', (job_id,)
+            )
+        ]
+        return job
+
+    def get_file_progress(self, job_id: str, since: int = 0, limit: int = JOB_FILES_PAGE) -> Dict[str, Any]:
+        """Return the file counts of a job and a page of its finished files.
+
+        Files are finished in upload order, so a poller passing back the
+        ``next`` value it received gets each finished file once.
+
+        Args:
+            job_id: Job id
+            since: Sequence number of the first file to return
+            limit: Maximum number of files to return
+
+        Returns:
+            Dictionary with ``total`` and ``processed`` file counts, the
+            finished ``files`` from ``since`` on (``seq``, ``name``,
+            ``status`` and ``error``) and the ``next`` sequence number
+        """
+        conn = self._connect()
+        total, processed = conn.execute(
+            'SELECT COUNT(*), COUNT(NULLIF(status, ?)) FROM job_files WHERE job_id = ?', (FILE_PENDING, job_id)
+        ).fetchone()
+        files = [
+            {'seq': f['seq'], 'name': f['name'], 'status': f['status'], 'error': f['error']}
+            for f in conn.execute(
+                'SELECT seq, name, status, error FROM job_files '
+                'WHERE job_id = ? AND seq >= ? AND status != ? ORDER BY seq LIMIT ?',
+                (job_id, max(0, since), FILE_PENDING, max(1, limit))
+            )
+        ]
+        return {
+            'total': total,
+            'processed': processed,
+            'files': files,
+            'next': files[-1]['seq'] + 1 if files else max(0, since)
+        }
+
+    def add_cufes(self, batch_id: str, cufes: Iterable[str]) -> None:
+        """Add CUFEs to the index of a batch (empty ones are left out)."""
+        with self._transaction() as conn:
+            conn.executemany(
+                'INSERT OR IGNORE INTO batch_cufes (batch_id, cufe) VALUES (?, ?)',
+                ((batch_id, cufe) for cufe in cufes if cufe)
+            )
+
+    def has_cufe(self, batch_id: str, cufe: str) -> bool:
+        """Return whether the results of a batch already include a CUFE."""
+        conn = self._connect()
+        row = conn.execute(
+            'SELECT 1 FROM batch_cufes WHERE batch_id = ? AND cufe = ?', (batch_id, cufe)
+        ).fetchone()
+        return row is not None
+
+    def active_batch_ids(self) -> Set[str]:
+        """Return the batch ids used by queued or running jobs.
+
+        These are the ids of the jobs themselves (their uploads and output
+        directories) and of the batches their appends write to.
+        """
+        conn = self._connect()
+        ids = set()
+        for job_id, append_to in conn.execute(
+            "SELECT id, json_extract(options, '$.append_to') FROM jobs WHERE status IN (?, ?)",
+            (JOB_QUEUED, JOB_RUNNING)
+        ):
+            ids.add(job_id)
+            if append_to:
+                ids.add(append_to)
+        return ids
+
+    def purge_finished(self, cutoff: float) -> int:
+        """Delete the jobs that finished before a cutoff.
+
+        Their per-file progress and the CUFE index of their batches are
+        deleted with them.
+
+        Args:
+            cutoff: Timestamp; jobs finished earlier are deleted
+
+        Returns:
+            Number of jobs deleted
+        """
+        with self._transaction() as conn:
+            ids = [
+                (row[0],) for row in
+                conn.execute(_PURGE_QUERY, {'done': JOB_DONE, 'failed': JOB_FAILED, 'cutoff': cutoff})
+            ]
+            conn.executemany('DELETE FROM job_files WHERE job_id = ?', ids)
+            conn.executemany('DELETE FROM batch_cufes WHERE batch_id = ?', ids)
+            conn.executemany('DELETE FROM jobs WHERE id = ?', ids)
+        if ids:
+            logger.info(f"Purged {len(ids)} finished job(s)")
+        return len(ids)
+
+    def count_by_status(self) -> Dict[str, int]:
+        """Return the number of jobs in each status."""
+        conn = self._connect()
+        return dict(conn.execute('SELECT status, COUNT(*) FROM jobs GROUP BY status').fetchall())
+
+    @staticmethod
+    def _job_from_row(row: sqlite3.Row, status: Optional[str] = None) -> Dict[str, Any]:
+        """Convert a jobs row to a dictionary, decoding the JSON columns."""
+        return {
+            'id': row['id'],
+            'status': status or row['status'],
+            'uploads': json.loads(row['uploads']),
+            'options': json.loads(row['options']),
+            'total_count': row['total_count'],
+            'result': json.loads(row['result']) if row['result'] else None,
+            'error': row['error'],
+            'created': row['created'],
+            'started': row['started'],
+            'finished': row['finished']
+        }
+
+
+def _new_result(job: Dict[str, Any]) -> Dict[str, Any]:
+    """Return the result of a job before any file is processed."""
+    return {
+        'zip_file': None,
+        'summary_file': None,
+        'detail_file': None,
+        'processed_count': 0,
+        'cache_hits': 0,
+        'total_count': job['total_count'],
+        'validation_errors': [],
+        'parsing_errors': [],
+        'preview': None,
+        'output_format': job['options'].get('output_format', DEFAULT_OUTPUT_FORMAT)
+    }
+
+
+def _iter_job_invoices(
+    store: JobStore,
+    job: Dict[str, Any],
+    result: Dict[str, Any],
+    cufes: List[str],
+    mode: Optional[str],
+    max_workers: Optional[int],
+    skip: Optional[Callable[[str], bool]] = None
+) -> Iterator[Any]:
+    """Pull the results of a job through the pipeline, keeping errors and progress.
+
+    Args:
+        store: Job store holding the job
+        job: Claimed job
+        result: Job result, updated with the counts and errors
+        cufes: List the CUFE of every invoice yielded is appended to
+        mode: Processing mode (see ``iter_process_xml_files``)
+        max_workers: Pool size (see ``iter_process_xml_files``)
+        skip: Called with the CUFE of each invoice; invoices it returns
+            True for are marked as skipped instead of being yielded
+
+    Yields:
+        Parsed invoices, in upload order
+    """
+    results = iter_process_xml_files(iter_batch_files(job['uploads']), mode=mode, max_workers=max_workers)
+    for seq, file_result in enumerate(results):
+        error_type = file_result['error_type']
+        if error_type:
+            store.update_file(job['id'], seq, FILE_ERROR, file_result['error'])
+            result[f'{error_type}_errors'].append({'file': file_result['file'], 'error': file_result['error']})
+            continue
+        if skip is not None and skip(file_result['cufe']):
+            store.update_file(job['id'], seq, FILE_SKIPPED, 'Ya incluida en el lote')
+            result['duplicates'].append({'file': file_result['file'], 'cufe': file_result['cufe']})
+            continue
+        store.update_file(job['id'], seq, FILE_DONE)
+        result['processed_count'] += 1
+        result['cache_hits'] += file_result['cached']
+        cufes.append(file_result['cufe'])
+        yield file_result['invoice']
+
+
+def _set_preview(result: Dict[str, Any], stats: Dict[str, Dict[str, Any]]) -> None:
+    """Store the first rows of both CSVs in a job result."""
+    result['preview'] = {
+        'summary': {'columns': SUMMARY_COLUMNS, 'rows': stats['summary']['preview']},
+        'detail': {'columns': DETAIL_COLUMNS, 'rows': stats['detail']['preview']}
+    }
+
+
+def run_upload_job(
+    store: JobStore,
+    job: Dict[str, Any],
+    output_folder: str,
+    mode: Optional[str] = None,
+    max_workers: Optional[int] = None,
+    compresslevel: Optional[int] = None,
+    preview_rows: int = PREVIEW_ROWS
+) -> Dict[str, Any]:
+    """Process the files of an upload job and build the results ZIP.
+
+    Documents flow from the uploads through the bounded pipeline (see
+    ``iter_process_xml_files``) straight into the ZIP writer, so memory
+    use does not grow with the size of the batch: only the documents in
+    flight and the error lists are held. Progress is recorded per file in
+    the job store as results are written. The CUFEs written are indexed
+    for later appends. The job's ``output_format`` option selects CSV
+    (default) or Parquet files.
+
+    Args:
+        store: Job store holding the job
+        job: Claimed job
+        output_folder: Base output directory; the results ZIP is written
+            to its ``<job id>`` subdirectory
+        mode: Processing mode (see ``iter_process_xml_files``)
+        max_workers: Pool size (see ``iter_process_xml_files``)
+        compresslevel: Deflate level of the results ZIP
+        preview_rows: Rows of each CSV kept in the result for the preview
+
+    Returns:
+        Job result: ``zip_file``, ``summary_file``, ``detail_file`` (None
+        if no invoice could be processed), ``processed_count``,
+        ``cache_hits``, ``total_count``, ``validation_errors``,
+        ``parsing_errors``, ``preview`` (``summary`` and ``detail``, each
+        with ``columns`` and ``rows``) and ``output_format``
+
+    Raises:
+        CSVGenerationError: If the CSVs cannot be generated
+    """
+    job_id = job['id']
+
+    # Only the member lists of the ZIPs are read to know the file names
+    store.set_files(job_id, [{'name': name, 'status': FILE_PENDING} for name in list_batch_files(job['uploads'])])
+
+    result = _new_result(job)
+    cufes: List[str] = []
+    invoices = _iter_job_invoices(store, job, result, cufes, mode, max_workers)
+    first_invoice = next(invoices, None)
+
+    if first_invoice is not None:
+        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+        extension = result['output_format']
+        result['summary_file'] = f"facturas_resumen_{timestamp}.{extension}"
+        result['detail_file'] = f"facturas_detalle_{timestamp}.{extension}"
+        result['zip_file'] = f"facturas_{timestamp}.zip"
+
+        # Each job writes to its own directory, so names never collide
+        batch_dir = os.path.join(output_folder, job_id)
+        os.makedirs(batch_dir, exist_ok=True)
+
+        # Both CSVs are written straight into the ZIP archive in a single
+        # pass; their first rows are stored with the job for the results page
+        stats = generate_csv_zip(
+            itertools.chain([first_invoice], invoices), os.path.join(batch_dir, result['zip_file']),
+            result['summary_file'], result['detail_file'],
+            compresslevel=compresslevel, preview_rows=preview_rows, output_format=result['output_format']
+        )
+        _set_preview(result, stats)
+        store.add_cufes(job_id, cufes)
+
+    return result
+
+
+def run_append_job(
+    store: JobStore,
+    job: Dict[str, Any],
+    output_folder: str,
+    mode: Optional[str] = None,
+    max_workers: Optional[int] = None,
+    compresslevel: Optional[int] = None,
+    preview_rows: int = PREVIEW_ROWS
+) -> Dict[str, Any]:
+    """Add the invoices of an upload job to the results of an earlier batch.
+
+    The batch is the job's ``append_to`` option. Invoices whose CUFE is in
+    the batch's index, or repeated within the upload, are skipped; the
+    others are written as a new summary/detail pair (in the job's
+    ``output_format``) appended to the batch's ZIP (see ``append_csv_zip``)
+    and added to the index. The
+    existing results are not read again, so the work depends on the size
+    of the upload, not of the batch.
+
+    Args:
+        store: Job store holding the job and the batch
+        job: Claimed job
+        output_folder: Base output directory (the batch's ZIP is in its
+            ``<batch id>`` subdirectory)
+        mode: Processing mode (see ``iter_process_xml_files``)
+        max_workers: Pool size (see ``iter_process_xml_files``)
+        compresslevel: Deflate level of the new ZIP entries
+        preview_rows: Rows of each new CSV kept in the result for the preview
+
+    Returns:
+        Job result as for ``run_upload_job``, for the invoices added
+        (``summary_file`` and ``detail_file`` are the new entries, None if
+        nothing was added), plus ``batch_id`` and ``duplicates`` (``file``
+        and ``cufe`` of each skipped invoice); ``zip_file`` is the batch's
+        archive
+
+    Raises:
+        JobError: If the batch has no results ZIP (failed or expired)
+        CSVGenerationError: If the CSVs cannot be appended
+    """
+    batch_id = job['options']['append_to']
+    batch = store.get_job(batch_id, files=False)
+    zip_file = ((batch or {}).get('result') or {}).get('zip_file')
+    batch_dir = os.path.join(output_folder, batch_id)
+    if not zip_file or not os.path.isfile(os.path.join(batch_dir, zip_file)):
+        raise JobError(f"Batch {batch_id} has no results to append to (failed or expired)")
+
+    store.set_files(job['id'], [{'name': name, 'status': FILE_PENDING} for name in list_batch_files(job['uploads'])])
+
+    result = _new_result(job)
+    result.update(batch_id=batch_id, zip_file=zip_file, duplicates=[])
+
+    # CUFEs added by this upload; only these are held in memory
+    added: Set[str] = set()
+
+    def is_duplicate(cufe: str) -> bool:
+        if not cufe:
+            return False
+        if cufe in added or store.has_cufe(batch_id, cufe):
+            return True
+        added.add(cufe)
+        return False
+
+    cufes: List[str] = []
+    invoices = _iter_job_invoices(store, job, result, cufes, mode, max_workers, skip=is_duplicate)
+    first_invoice = next(invoices, None)
+
+    if first_invoice is not None:
+        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+        extension = result['output_format']
+        stats = append_csv_zip(
+            itertools.chain([first_invoice], invoices), os.path.join(batch_dir, zip_file),
+            f"facturas_resumen_{timestamp}.{extension}", f"facturas_detalle_{timestamp}.{extension}",
+            compresslevel=compresslevel, preview_rows=preview_rows, output_format=extension
+        )
+        result['summary_file'] = stats['summary']['path']
+        result['detail_file'] = stats['detail']['path']
+        _set_preview(result, stats)
+        store.add_cufes(batch_id, cufes)
+        # The batch was modified: restart its expiry
+        os.utime(batch_dir)
+
+    logger.info(
+        f"Appended {result['processed_count']} invoice(s) to batch {batch_id}, "
+        f"skipped {len(result['duplicates'])} already included"
+    )
+    return result
+
+
+class JobQueue:
+    """Pool of worker threads running queued jobs.
+
+    Args:
+        store: Job store
+        handler: Called as ``handler(store, job)`` to run a claimed job;
+            returns the job result
+        workers: Number of worker threads
+        poll_interval: Seconds between checks for jobs queued elsewhere
+    """
+
+    def __init__(
+        self,
+        store: JobStore,
+        handler: Callable[[JobStore, Dict[str, Any]], Dict[str, Any]],
+        workers: int = JOB_WORKERS,
+        poll_interval: float = JOB_POLL_INTERVAL
+    ):
+        self.store = store
+        self.handler = handler
+        self.workers = max(1, workers)
+        self.poll_interval = poll_interval
+        self._wakeup = threading.Event()
+        self._threads: List[threading.Thread] = []
+        self._lock = threading.Lock()
+
+    def start(self) -> None:
+        """Start the worker threads (only the first call has an effect)."""
+        with self._lock:
+            if self._threads:
+                return
+            for number in range(self.workers):
+                thread = threading.Thread(target=self._work, name=f"fac2csv-job-{number}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+            logger.info(f"Started {self.workers} job worker(s)")
+
+    def submit(
+        self,
+        uploads: List[Dict[str, Any]],
+        total_count: int,
+        options: Optional[Dict[str, Any]] = None,
+        job_id: Optional[str] = None
+    ) -> str:
+        """Queue a job and wake a worker.
+
+        Args:
+            uploads: Uploaded files (see ``JobStore.create_job``)
+            total_count: Number of files the user uploaded
+            options: Processing options of the batch
+            job_id: Id to give the job (default: a new one)
+
+        Returns:
+            Job id
+        """
+        job_id = self.store.create_job(uploads, total_count, options, job_id)
+        self.start()
+        self._wakeup.set()
+        return job_id
+
+    def _work(self) -> None:
+        """Worker thread loop."""
+        while True:
+            try:
+                job = self.store.claim_next()
+            except sqlite3.Error as e:
+                logger.error(f"Error claiming job: {e}")
+                job = None
+
+            if job is None:
+                self._wakeup.wait(self.poll_interval)
+                self._wakeup.clear()
+                continue
+
+            self._run(job)
+
+    def _run(self, job: Dict[str, Any]) -> None:
+        """Run one job and record its outcome."""
+        start = time.perf_counter()
+        try:
+            result = self.handler(self.store, job)
+            self.store.finish_job(job['id'], result)
+            observe_stage('job', time.perf_counter() - start)
+            inc('fac2csv_jobs_total', status=JOB_DONE)
+            logger.info(f"Job {job['id']} done in {time.perf_counter() - start:.2f}s")
+        except Exception as e:
+            inc('fac2csv_jobs_total', status=JOB_FAILED)
+            logger.error(f"Job {job['id']} failed: {e}")
+            try:
+                self.store.fail_job(job['id'], str(e))
+            except sqlite3.Error as db_error:
+                logger.error(f"Error recording failure of job {job['id']}: {db_error}")
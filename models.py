@@ -0,0 +1,160 @@
+"""Record types for parsed DIAN invoices.
+
+The field schema defined here is shared by the XML parser (which fills the
+records) and the CSV generator (which writes them column by column).
+"""
+
+from collections.abc import Mapping
+from typing import Any, Dict, Iterable, Iterator, List, Tuple, Union
+
+# Invoice-level fields, in output column order (Spanish as per requirements)
+INVOICE_FIELDS = (
+    'numero_factura',
+    'prefijo',
+    'cufe',
+    'fecha_emision',
+    'hora_emision',
+    'fecha_vencimiento',
+    'periodo_inicio',
+    'periodo_fin',
+    'cliente_nombre',
+    'cliente_nit',
+    'cliente_direccion',
+    'cliente_codigo_postal',
+    'cliente_municipio',
+    'emisor_nombre',
+    'emisor_nit',
+    'emisor_direccion',
+    'subtotal',
+    'iva_porcentaje',
+    'iva_monto',
+    'imp_consumo_voz',
+    'imp_consumo_datos',
+    'descuentos_totales',
+    'total_pagar'
+)
+
+# Line item fields, in output column order
+LINE_FIELDS = (
+    'linea_numero',
+    'linea_descripcion',
+    'linea_cantidad',
+    'linea_precio_unitario',
+    'linea_descuento_porcentaje',
+    'linea_total'
+)
+
+# Fields holding amounts (written with 2 decimals)
+INVOICE_AMOUNT_FIELDS = frozenset([
+    'subtotal', 'iva_porcentaje', 'iva_monto', 'imp_consumo_voz',
+    'imp_consumo_datos', 'descuentos_totales', 'total_pagar'
+])
+LINE_AMOUNT_FIELDS = frozenset([
+    'linea_cantidad', 'linea_precio_unitario', 'linea_descuento_porcentaje', 'linea_total'
+])
+
+
+class _Record(Mapping):
+    """Fixed-schema record stored in ``__slots__``.
+
+    A slotted instance has no per-object ``__dict__``, so a record costs one
+    pointer per field instead of a hash table. Records behave like the
+    read-only dictionaries the parser used to return (``record['cufe']``,
+    ``record.get(...)``, ``dict(record)``, comparison with a dict) and also
+    accept item assignment and ``update`` for fields of the schema.
+
+    Unset fields read as an empty string.
+    """
+
+    __slots__ = ()
+
+    # Field names in column order; set by subclasses
+    FIELDS: Tuple[str, ...] = ()
+
+    def __init__(self, values: Union[Mapping, Iterable[Tuple[str, Any]], None] = None, **fields: Any):
+        for name in self.__slots__:
+            setattr(self, name, '')
+        if values is not None:
+            self.update(values)
+        if fields:
+            self.update(fields)
+
+    @classmethod
+    def from_values(cls, values: Iterable[Any]) -> '_Record':
+        """Build a record from values given in ``__slots__`` order."""
+        record = cls.__new__(cls)
+        for name, value in zip(cls.__slots__, values):
+            setattr(record, name, value)
+        return record
+
+    def __getitem__(self, name: str) -> Any:
+        if name not in self.__slots__:
+            raise KeyError(name)
+        return getattr(self, name)
+
+    def __setitem__(self, name: str, value: Any) -> None:
+        if name not in self.__slots__:
+            raise KeyError(f"'{name}' is not a field of {type(self).__name__}")
+        setattr(self, name, value)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.__slots__)
+
+    def __len__(self) -> int:
+        return len(self.__slots__)
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}({self.to_dict()!r})"
+
+    def __reduce__(self):
+        # Compact pickling for results sent back by worker processes
+        return (type(self).from_values, (tuple(getattr(self, name) for name in self.__slots__),))
+
+    def update(self, values: Union[Mapping, Iterable[Tuple[str, Any]]] = (), **fields: Any) -> None:
+        """Set several fields at once, like ``dict.update``.
+
+        Raises:
+            KeyError: If a key is not a field of the record
+        """
+        items = values.items() if isinstance(values, Mapping) else values
+        for name, value in items:
+            self[name] = value
+        for name, value in fields.items():
+            self[name] = value
+
+    def row(self) -> List[Any]:
+        """Return the values of ``FIELDS`` as a list, in column order."""
+        return [getattr(self, name) for name in self.FIELDS]
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Return the record as a plain dictionary."""
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+class InvoiceLine(_Record):
+    """A line item (cac:InvoiceLine) of an invoice."""
+
+    __slots__ = LINE_FIELDS
+    FIELDS = LINE_FIELDS
+
+
+class Invoice(_Record):
+    """Invoice-level fields plus the list of line items in ``lineas``."""
+
+    __slots__ = INVOICE_FIELDS + ('lineas',)
+    FIELDS = INVOICE_FIELDS
+
+    def __init__(self, values: Union[Mapping, Iterable[Tuple[str, Any]], None] = None, **fields: Any):
+        super().__init__(values, **fields)
+        if self.lineas == '':
+            self.lineas = []
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Return the invoice as a plain dictionary, lines included."""
+        data = super().to_dict()
+        data['lineas'] = [
+            line.to_dict() if isinstance(line, _Record) else line
+            for line in (data['lineas'] or [])
+        ]
+        return data
+
@@ -0,0 +1,297 @@
+"""On-disk cache of parsed invoices.
+
+Parse results are stored in a local SQLite database, keyed by a BLAKE2b
+digest of the document content, so re-uploaded invoices skip validation
+and parsing, and indexed by CUFE. Entries are stamped with the parser
+version and the field schema; entries written by another version are discarded. The least
+recently used entries are evicted once the cache grows past its size
+limit, tracked in a running total kept by triggers. Hits and misses are
+counted in the process metrics, so lookups that miss write nothing.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from typing import Any, Dict, NamedTuple, Optional
+
+from models import Invoice, InvoiceLine, INVOICE_FIELDS, LINE_FIELDS
+from xml_parser import PARSER_VERSION
+from utils.metrics import inc
+
+logger = logging.getLogger(__name__)
+
+# Configuration, overridable from the environment
+PARSE_CACHE_ENABLED = os.environ.get('PARSE_CACHE_ENABLED', '1').lower() not in ('0', 'false', 'no')
+PARSE_CACHE_PATH = os.environ.get('PARSE_CACHE_PATH', os.path.join('cache', 'parse_cache.sqlite3'))
+PARSE_CACHE_MAX_BYTES = int(os.environ.get('PARSE_CACHE_MAX_MB', 256)) * 1024 * 1024
+
+# Entries are only valid for the parser version and field schema that wrote them
+CACHE_VERSION = '{}:{}'.format(
+    PARSER_VERSION,
+    hashlib.blake2b('|'.join(INVOICE_FIELDS + LINE_FIELDS).encode('utf-8'), digest_size=4).hexdigest()
+)
+
+# Fraction of the size limit kept after an eviction pass
+_EVICT_TARGET = 0.9
+
+# Entries deleted per statement during an eviction pass
+_EVICT_BATCH = 256
+
+# Seconds before a hit updates the last use of an entry again; the LRU
+# order does not need more precision and most hits then write nothing
+_TOUCH_INTERVAL = 60
+
+# The totals row is filled from the existing entries once, then kept up
+# to date by the triggers in the same transaction as each change
+_SCHEMA = """
+BEGIN IMMEDIATE;
+CREATE TABLE IF NOT EXISTS invoices (
+    digest TEXT PRIMARY KEY,
+    cufe TEXT NOT NULL,
+    version TEXT NOT NULL,
+    payload BLOB NOT NULL,
+    size INTEGER NOT NULL,
+    last_used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS invoices_last_used ON invoices (last_used);
+CREATE INDEX IF NOT EXISTS invoices_cufe ON invoices (cufe);
+CREATE TABLE IF NOT EXISTS totals (
+    id INTEGER PRIMARY KEY CHECK (id = 0),
+    entries INTEGER NOT NULL,
+    bytes INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO totals (id, entries, bytes) SELECT 0, COUNT(*), COALESCE(SUM(size), 0) FROM invoices;
+CREATE TRIGGER IF NOT EXISTS invoices_insert AFTER INSERT ON invoices BEGIN
+    UPDATE totals SET entries = entries + 1, bytes = bytes + new.size WHERE id = 0;
+END;
+CREATE TRIGGER IF NOT EXISTS invoices_delete AFTER DELETE ON invoices BEGIN
+    UPDATE totals SET entries = entries - 1, bytes = bytes - old.size WHERE id = 0;
+END;
+CREATE TRIGGER IF NOT EXISTS invoices_resize AFTER UPDATE OF size ON invoices BEGIN
+    UPDATE totals SET bytes = bytes + new.size - old.size WHERE id = 0;
+END;
+COMMIT;
+"""
+
+
+def content_digest(data: bytes) -> str:
+    """Return the cache key of a document.
+
+    Args:
+        data: Raw document bytes
+
+    Returns:
+        Hex BLAKE2b digest of the content
+    """
+    hasher = content_hasher()
+    hasher.update(data)
+    return hasher.hexdigest()
+
+
+def content_hasher() -> Any:
+    """Return a hash object computing the cache key of a document in pieces.
+
+    Feeding it the document with ``update`` and calling ``hexdigest`` gives
+    the same key as ``content_digest``.
+    """
+    return hashlib.blake2b(digest_size=20)
+
+
+def encode_invoice(invoice: Invoice) -> bytes:
+    """Serialize an invoice to the compact cache format.
+
+    The format is the compressed JSON of the field values in schema order
+    (the field names are implied by the schema stamp).
+    """
+    values = [invoice.row(), [line.row() for line in invoice['lineas']]]
+    return zlib.compress(json.dumps(values, ensure_ascii=False, separators=(',', ':')).encode('utf-8'))
+
+
+def decode_invoice(payload: bytes) -> Invoice:
+    """Rebuild an invoice serialized with ``encode_invoice``."""
+    header, lines = json.loads(zlib.decompress(payload))
+    return Invoice.from_values(header + [[InvoiceLine.from_values(line) for line in lines]])
+
+
+class CacheEntry(NamedTuple):
+    """A cached parse result."""
+    invoice: Invoice
+    cufe: str
+
+
+class ParseCache:
+    """Parsed invoices stored in a SQLite database.
+
+    Safe to share between threads (each thread gets its own connection)
+    and between processes (SQLite locking, WAL journal). Cache failures are
+    logged and reported as misses, never raised.
+
+    Args:
+        path: Database file
+        max_bytes: Size limit of the stored payloads
+    """
+
+    def __init__(self, path: str = PARSE_CACHE_PATH, max_bytes: int = PARSE_CACHE_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._local = threading.local()
+
+    def _connect(self) -> sqlite3.Connection:
+        """Return this thread's connection, creating the database if needed."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.executescript(_SCHEMA)
+            # Drop entries written by another parser version
+            conn.execute('DELETE FROM invoices WHERE version != ?', (CACHE_VERSION,))
+            conn.commit()
+            self._local.conn = conn
+        return conn
+
+    def get(self, digest: str) -> Optional[CacheEntry]:
+        """Return the cached invoice for a content digest.
+
+        The hit or miss is counted in ``fac2csv_parse_cache_lookups_total``.
+
+        Args:
+            digest: Digest from ``content_digest``
+
+        Returns:
+            Cached invoice and its CUFE, or None on a miss
+        """
+        entry = self._lookup('digest', digest)
+        inc('fac2csv_parse_cache_lookups_total', result='miss' if entry is None else 'hit')
+        return entry
+
+    def get_by_cufe(self, cufe: str) -> Optional[CacheEntry]:
+        """Return the cached invoice with a CUFE, whatever file it came from.
+
+        Args:
+            cufe: Invoice CUFE (cbc:UUID value)
+
+        Returns:
+            The most recently used entry with that CUFE, or None
+        """
+        if not cufe:
+            return None
+        return self._lookup('cufe', cufe)
+
+    def _lookup(self, column: str, key: str) -> Optional[CacheEntry]:
+        """Return the most recently used entry whose ``column`` is ``key``."""
+        try:
+            conn = self._connect()
+            row = conn.execute(
+                f'SELECT digest, payload, cufe, last_used FROM invoices WHERE {column} = ? AND version = ? '
+                'ORDER BY last_used DESC LIMIT 1',
+                (key, CACHE_VERSION)
+            ).fetchone()
+            if row is None:
+                return None
+            now = time.time()
+            if now - row[3] >= _TOUCH_INTERVAL:
+                with conn:
+                    conn.execute('UPDATE invoices SET last_used = ? WHERE digest = ?', (now, row[0]))
+            return CacheEntry(decode_invoice(row[1]), row[2])
+        except (sqlite3.Error, OSError, ValueError, zlib.error) as e:
+            logger.warning(f"Parse cache lookup failed: {e}")
+            return None
+
+    def put(self, digest: str, invoice: Invoice, cufe: str = '') -> bool:
+        """Store a parsed invoice, evicting old entries if the cache is full.
+
+        Args:
+            digest: Digest from ``content_digest``
+            invoice: Parsed invoice
+            cufe: Invoice CUFE, for lookups by CUFE
+
+        Returns:
+            True if the entry was stored
+        """
+        try:
+            payload = encode_invoice(invoice)
+            conn = self._connect()
+            with conn:
+                # An upsert rather than INSERT OR REPLACE, whose implicit
+                # delete would not fire the trigger keeping the totals
+                conn.execute(
+                    'INSERT INTO invoices (digest, cufe, version, payload, size, last_used) '
+                    'VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT(digest) DO UPDATE SET '
+                    'cufe = excluded.cufe, version = excluded.version, payload = excluded.payload, '
+                    'size = excluded.size, last_used = excluded.last_used',
+                    (digest, cufe, CACHE_VERSION, payload, len(payload), time.time())
+                )
+                self._evict(conn)
+            return True
+        except (sqlite3.Error, OSError, TypeError, ValueError) as e:
+            logger.warning(f"Parse cache store failed: {e}")
+            return False
+
+    def _evict(self, conn: sqlite3.Connection) -> None:
+        """Delete least recently used entries while over the size limit."""
+        total = conn.execute('SELECT bytes FROM totals WHERE id = 0').fetchone()[0]
+        if total <= self.max_bytes:
+            return
+
+        target = self.max_bytes * _EVICT_TARGET
+        evicted = 0
+        while total > target:
+            oldest = conn.execute(
+                'SELECT digest, size FROM invoices ORDER BY last_used LIMIT ?', (_EVICT_BATCH,)
+            ).fetchall()
+            if not oldest:
+                break
+            for digest, size in oldest:
+                if total <= target:
+                    break
+                conn.execute('DELETE FROM invoices WHERE digest = ?', (digest,))
+                total -= size
+                evicted += 1
+        logger.info(f"Parse cache evicted {evicted} entr{'y' if evicted == 1 else 'ies'}")
+
+    def stats(self) -> Dict[str, Any]:
+        """Return the number of entries and the size of the cache.
+
+        Hits and misses are in the ``fac2csv_parse_cache_lookups_total``
+        metric.
+
+        Returns:
+            Dictionary with ``entries`` and ``bytes``
+        """
+        try:
+            conn = self._connect()
+            entries, size = conn.execute('SELECT entries, bytes FROM totals WHERE id = 0').fetchone()
+        except sqlite3.Error as e:
+            logger.warning(f"Parse cache stats failed: {e}")
+            entries, size = 0, 0
+        return {'entries': entries, 'bytes': size}
+
+    def clear(self) -> None:
+        """Remove every entry."""
+        conn = self._connect()
+        with conn:
+            conn.execute('DELETE FROM invoices')
+
+
+_default_cache: Optional[ParseCache] = None
+_default_cache_lock = threading.Lock()
+
+
+def get_parse_cache() -> Optional[ParseCache]:
+    """Return the shared parse cache, or None when caching is disabled."""
+    global _default_cache
+    if not PARSE_CACHE_ENABLED:
+        return None
+    with _default_cache_lock:
+        if _default_cache is None:
+            _default_cache = ParseCache()
+        return _default_cache
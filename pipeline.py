@@ -0,0 +1,747 @@
+"""Processing pipeline for uploaded DIAN invoice files.
+
+Each XML document is parsed exactly once; the resulting tree is shared
+between validation and field extraction. XML files inside uploaded ZIP
+archives are read into memory and never written to disk. Documents seen
+before are served from the parse cache without being parsed at all.
+"""
+
+import logging
+import mmap
+import multiprocessing
+import os
+import threading
+import time
+import zipfile
+from collections import deque
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from typing import Callable, Dict, Any, Iterable, Iterator, List, NamedTuple, Optional
+from lxml import etree as ET
+
+from xml_parser import unwrap_invoice, parse_invoice_element, parse_invoice_cufe, ParseError
+from parse_cache import get_parse_cache, content_digest, content_hasher
+from utils.validators import (
+    read_document,
+    sniff_xml_bytes,
+    validate_xml_bytes,
+    validate_file_extension,
+    validate_content_size,
+    validate_ubl_root,
+    ValidationError,
+    MAX_FILE_SIZE,
+    SNIFF_BYTES
+)
+from utils.file_manager import list_zip_xml_members, read_zip_member, unique_path
+from utils.metrics import inc, observe_stage
+
+logger = logging.getLogger(__name__)
+
+# Execution modes for batch processing
+PROCESSING_MODES = ('process', 'thread', 'serial')
+
+# Defaults, overridable from the environment
+DEFAULT_PROCESSING_MODE = os.environ.get('PROCESSING_MODE', 'process')
+DEFAULT_PROCESSING_WORKERS = int(os.environ.get('PROCESSING_WORKERS', os.cpu_count() or 1))
+
+# Streamed documents larger than this are written to disk as they arrive
+# instead of being kept in memory (see StreamingDocument)
+UPLOAD_SPILL_BYTES = int(os.environ.get('UPLOAD_SPILL_BYTES', 1024 * 1024))
+
+# Bounds of the documents in flight in a batch (see iter_process_xml_files):
+# a count (0 = four per worker) and a total size in bytes
+MAX_IN_FLIGHT = int(os.environ.get('MAX_IN_FLIGHT', 0))
+MAX_IN_FLIGHT_BYTES = int(os.environ.get('MAX_IN_FLIGHT_MB', 256)) * 1024 * 1024
+
+# Worker pools are created lazily and reused across requests
+_executors: Dict[tuple, Executor] = {}
+_executors_lock = threading.Lock()
+
+
+def describe_source(filename: str, from_zip: Optional[str] = None) -> str:
+    """Build the name used to report a file in error lists.
+
+    Args:
+        filename: Name of the XML file
+        from_zip: Name of the ZIP archive the file came from, if any
+
+    Returns:
+        Human readable source description
+    """
+    return f"{filename} (from {from_zip})" if from_zip else filename
+
+
+def process_xml_file(file_path: str, filename: str, from_zip: Optional[str] = None) -> Dict[str, Any]:
+    """Validate and parse a single XML invoice file.
+
+    The file is parsed once; the same tree is validated and then handed to
+    the extractor (after unwrapping an AttachedDocument if needed). If the
+    same content was parsed before, the cached result is returned instead.
+
+    Args:
+        file_path: Path to the XML file
+        filename: Original filename
+        from_zip: Name of the ZIP archive the file came from, if any.
+            Extracted files skip the extension check.
+
+    Returns:
+        Dictionary with keys ``file`` (source description), ``invoice``
+        (parsed invoice data or None), ``cufe`` (invoice CUFE),
+        ``error_type`` ('validation', 'parsing' or ''), ``error`` (message,
+        empty on success), ``bytes_copied`` (embedded invoice bytes copied
+        before parsing) and ``cached`` (whether the parse cache was used)
+    """
+    result = _new_result(filename, from_zip)
+
+    # Check extension (skipped for extracted files) and size, then read
+    try:
+        data = read_document(file_path, filename, check_extension=from_zip is None)
+    except Exception as e:
+        return _validation_failed(result, e)
+
+    return _process_data(result, data, os.path.basename(file_path), file_path)
+
+
+def process_xml_bytes(data: bytes, filename: str, from_zip: Optional[str] = None) -> Dict[str, Any]:
+    """Validate and parse an XML invoice held in memory.
+
+    Same as ``process_xml_file`` for a document that was never written to
+    disk, such as a member read from a ZIP archive.
+
+    Args:
+        data: Raw XML bytes
+        filename: Original filename
+        from_zip: Name of the ZIP archive the document came from, if any.
+            Extracted files skip the extension check.
+
+    Returns:
+        Dictionary with the same keys as ``process_xml_file``
+    """
+    result = _new_result(filename, from_zip)
+
+    try:
+        if from_zip is None:
+            validate_file_extension(filename)
+        validate_content_size(len(data))
+        sniff_xml_bytes(data)
+    except Exception as e:
+        return _validation_failed(result, e)
+
+    return _process_data(result, data, filename, filename)
+
+
+def _new_result(filename: str, from_zip: Optional[str]) -> Dict[str, Any]:
+    """Create an empty processing result."""
+    source = describe_source(filename, from_zip)
+    return {
+        'file': source, 'invoice': None, 'cufe': '', 'error_type': '', 'error': '',
+        'bytes_copied': 0, 'cached': False
+    }
+
+
+def _count_document(result: Dict[str, Any]) -> None:
+    """Count a finished document in the metrics, by outcome."""
+    if result['cached']:
+        outcome = 'cached'
+    elif result['error_type']:
+        outcome = f"{result['error_type']}_error"
+    else:
+        outcome = 'parsed'
+    inc('fac2csv_documents_total', outcome=outcome)
+
+
+def _validation_failed(result: Dict[str, Any], error: Exception) -> Dict[str, Any]:
+    """Record a validation failure in a processing result."""
+    source = result['file']
+    if isinstance(error, ValidationError):
+        logger.warning(f"Validation failed for {source}: {error}")
+        result.update(error_type='validation', error=str(error))
+    else:
+        logger.error(f"Unexpected validation error for {source}: {error}")
+        result.update(error_type='validation', error=f"Unexpected error: {error}")
+    _count_document(result)
+    return result
+
+
+def _process_data(result: Dict[str, Any], data: bytes, parse_name: str, name: str) -> Dict[str, Any]:
+    """Serve a document from the parse cache, or validate, parse and cache it.
+
+    The caller has already checked the size and sniffed the document type.
+    """
+    cache = get_parse_cache()
+    digest = None
+
+    if cache is not None:
+        digest = content_digest(data)
+        entry = cache.get(digest)
+        if entry is not None:
+            result.update(invoice=entry.invoice, cufe=entry.cufe, cached=True)
+            logger.info(f"Parse cache hit: {result['file']}")
+            _count_document(result)
+            return result
+
+    try:
+        root = validate_xml_bytes(data, parse_name, check_extension=False, sniff=False)
+    except Exception as e:
+        return _validation_failed(result, e)
+
+    _parse_validated(result, root, name, data)
+    _count_document(result)
+
+    if cache is not None and result['invoice'] is not None:
+        cache.put(digest, result['invoice'], result['cufe'])
+    return result
+
+
+def _parse_validated(result: Dict[str, Any], root: Any, name: str, data: bytes) -> Dict[str, Any]:
+    """Extract the invoice from an already validated tree."""
+    source = result['file']
+
+    # Parse invoice from the already parsed tree
+    try:
+        invoice_root, result['bytes_copied'] = unwrap_invoice(root, name, data)
+        result['invoice'] = parse_invoice_element(invoice_root)
+        result['cufe'] = parse_invoice_cufe(invoice_root)
+        logger.info(f"Successfully parsed: {source}")
+    except ParseError as e:
+        logger.error(f"Parse error for {source}: {e}")
+        result.update(error_type='parsing', error=str(e))
+    except Exception as e:
+        logger.error(f"Parse error for {source}: {e}")
+        result.update(error_type='parsing', error=f"Unexpected error parsing {name}: {e}")
+
+    return result
+
+
+class StreamingDocument:
+    """Validate and parse an XML document while its bytes are received.
+
+    Every chunk passed to ``feed`` is sniffed (until the root element is
+    identified), hashed for the parse cache and fed to an incremental
+    parser, so the document tree is complete as soon as the last byte
+    arrives and parsing overlaps with the transfer. Junk is rejected on
+    its first bytes; the rest of it is then only counted.
+
+    The raw bytes are kept for the zero-copy unwrap of an AttachedDocument:
+    in memory up to ``spill_threshold``, above it in a file of
+    ``spill_dir`` that is mapped into memory when the document is closed
+    and deleted afterwards.
+
+    Args:
+        filename: Original filename
+        spill_dir: Directory for documents above the threshold
+        spill_threshold: Largest document kept in memory, in bytes
+    """
+
+    def __init__(self, filename: str, spill_dir: str, spill_threshold: int = UPLOAD_SPILL_BYTES):
+        self.filename = filename
+        self.spill_dir = spill_dir
+        self.spill_threshold = spill_threshold
+        self.size = 0
+        self._error: Optional[Exception] = None
+        self._head: Optional[bytearray] = bytearray()
+        self._hasher = content_hasher()
+        self._parser = ET.XMLParser()
+        self._data: Optional[bytearray] = bytearray()
+        self._spill_path: Optional[str] = None
+        self._spill_file: Any = None
+        self._seconds = 0.0
+
+        try:
+            validate_file_extension(filename)
+        except ValidationError as e:
+            self._fail(e)
+
+    def feed(self, chunk: bytes) -> None:
+        """Process the next piece of the document."""
+        self.size += len(chunk)
+        if self._error is not None or not chunk:
+            return
+
+        start = time.perf_counter()
+        try:
+            validate_content_size(self.size)
+            if self._head is not None:
+                # Sniffing stops at the root element or after SNIFF_BYTES
+                self._head += chunk
+                if sniff_xml_bytes(self._head) is not None or len(self._head) >= SNIFF_BYTES:
+                    self._head = None
+            self._hasher.update(chunk)
+            self._parser.feed(chunk)
+            self._keep(chunk)
+        except ET.XMLSyntaxError as e:
+            self._fail(ValidationError(f"XML syntax error: {e}"))
+        except (ValidationError, OSError) as e:
+            self._fail(e)
+        self._seconds += time.perf_counter() - start
+
+    def _keep(self, chunk: bytes) -> None:
+        """Store a chunk in memory, or in the spill file once over the threshold."""
+        if self._spill_file is not None:
+            self._spill_file.write(chunk)
+            return
+
+        self._data += chunk
+        if len(self._data) > self.spill_threshold:
+            self._spill_path = unique_path(self.spill_dir, f"{self.filename}.part")
+            self._spill_file = open(self._spill_path, 'w+b')
+            self._spill_file.write(self._data)
+            self._data = None
+
+    def _fail(self, error: Exception) -> None:
+        """Reject the document and drop what was kept of it."""
+        self._error = error
+        self._head = None
+        self._data = None
+        self._parser = None
+        self._discard_spill()
+
+    def discard(self) -> None:
+        """Drop the document without processing it."""
+        self._fail(ValidationError("Upload interrupted."))
+
+    def _discard_spill(self) -> None:
+        if self._spill_file is not None:
+            self._spill_file.close()
+            self._spill_file = None
+        if self._spill_path is not None:
+            try:
+                os.remove(self._spill_path)
+            except OSError as e:
+                logger.warning(f"Could not delete {self._spill_path}: {e}")
+            self._spill_path = None
+
+    def close(self) -> Dict[str, Any]:
+        """Finish the document and extract its invoice.
+
+        Returns:
+            Processing result, with the same keys as ``process_xml_file``
+        """
+        result = _new_result(self.filename, None)
+        try:
+            if self._error is not None:
+                return _validation_failed(result, self._error)
+
+            start = time.perf_counter()
+            try:
+                validate_content_size(self.size)
+                root = self._parser.close()
+                validate_ubl_root(root)
+            except ET.XMLSyntaxError as e:
+                return _validation_failed(result, ValidationError(f"XML syntax error: {e}"))
+            except ValidationError as e:
+                return _validation_failed(result, e)
+            finally:
+                self._parser = None
+                observe_stage('validate', self._seconds + time.perf_counter() - start)
+                inc('fac2csv_bytes_processed_total', self.size, stage='validate')
+
+            cache = get_parse_cache()
+            digest = self._hasher.hexdigest()
+            if cache is not None:
+                entry = cache.get(digest)
+                if entry is not None:
+                    result.update(invoice=entry.invoice, cufe=entry.cufe, cached=True)
+                    logger.info(f"Parse cache hit: {result['file']}")
+                    _count_document(result)
+                    return result
+
+            if self._spill_file is None:
+                _parse_validated(result, root, self.filename, self._data)
+            else:
+                self._spill_file.flush()
+                with mmap.mmap(self._spill_file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                    _parse_validated(result, root, self.filename, data)
+            _count_document(result)
+
+            if cache is not None and result['invoice'] is not None:
+                cache.put(digest, result['invoice'], result['cufe'])
+            return result
+
+        finally:
+            self._data = None
+            self._discard_spill()
+
+
+def iter_zip_upload(
+    zip_source: Any,
+    zip_name: str,
+    errors: List[Dict[str, str]],
+    skip: Optional[Callable[[str], bool]] = None
+) -> Iterator[Dict[str, Any]]:
+    """Read the XML members of a ZIP archive into memory, one at a time.
+
+    Members are decompressed straight from the archive; the size declared
+    for each member is checked before it is read and reading stops at
+    MAX_FILE_SIZE, so no member can use more memory than a single uploaded
+    XML file. Only the member being yielded is held in memory.
+
+    Args:
+        zip_source: Path or seekable binary file object of the ZIP archive
+        zip_name: Name of the archive
+        errors: List where members that could not be read are appended, as
+            dictionaries with ``file``, ``error`` and ``member``
+        skip: Optional predicate on the member name; matching members are
+            not read
+
+    Yields:
+        File infos ready for ``process_xml_files``, with the member content
+        under ``data``
+
+    Raises:
+        IOError: If the archive is invalid or contains no XML files
+    """
+    try:
+        with zipfile.ZipFile(zip_source) as zipf:
+            members = list_zip_xml_members(zipf)
+            if not members:
+                raise IOError("No XML files found in ZIP archive")
+
+            for info in members:
+                if skip is not None and skip(info.filename):
+                    continue
+
+                filename = os.path.basename(info.filename)
+                try:
+                    validate_content_size(info.file_size)
+                    data = read_zip_member(zipf, info, MAX_FILE_SIZE)
+                except (ValidationError, IOError) as e:
+                    logger.warning(f"Skipping {info.filename} from {zip_name}: {e}")
+                    errors.append({'file': describe_source(filename, zip_name), 'error': str(e)})
+                    continue
+
+                yield {'data': data, 'filename': filename, 'from_zip': zip_name, 'member': info.filename}
+
+    except zipfile.BadZipFile:
+        logger.error(f"Invalid ZIP file: {zip_name}")
+        raise IOError("Invalid ZIP file format")
+
+
+def iter_batch_files(uploads: Iterable[Dict[str, Any]]) -> Iterator[Dict[str, Any]]:
+    """Yield the file infos of a batch one document at a time.
+
+    Input of ``iter_process_xml_files``: ZIP members are read only when
+    the consumer asks for them, so a large archive is never held in
+    memory. Archives and members that cannot be
+    read are yielded in place, as infos whose ``result`` is the validation
+    failure; every name of ``list_batch_files`` gets exactly one info.
+
+    Args:
+        uploads: Dictionaries with ``path``, ``filename`` and ``kind``
+            ('xml' or 'zip')
+
+    Yields:
+        File infos for ``iter_process_xml_files``
+    """
+    for upload in uploads:
+        if upload['kind'] != 'zip':
+            yield {'path': upload['path'], 'filename': upload['filename'], 'from_zip': None}
+            continue
+
+        errors: List[Dict[str, str]] = []
+        try:
+            for info in iter_zip_upload(upload['path'], upload['filename'], errors):
+                yield from _error_infos(errors, upload['filename'])
+                yield info
+            yield from _error_infos(errors, upload['filename'])
+        except IOError as e:
+            logger.error(f"ZIP extraction error for {upload['filename']}: {e}")
+            yield {'result': _validation_failed(_new_result(upload['filename'], None), ValidationError(str(e)))}
+
+
+def _error_infos(errors: List[Dict[str, str]], zip_name: str) -> Iterator[Dict[str, Any]]:
+    """Turn the members ``iter_zip_upload`` could not read into failed infos."""
+    while errors:
+        error = errors.pop(0)
+        result = _new_result(os.path.basename(error['member']), zip_name)
+        yield {'result': _validation_failed(result, ValidationError(error['error']))}
+
+
+def list_batch_files(uploads: Iterable[Dict[str, Any]]) -> List[str]:
+    """Return the names of the documents of a batch, without reading them.
+
+    Only the member list of ZIP archives is read, so this is cheap even
+    for large archives. The order and number of names match the infos of
+    ``iter_batch_files``, for progress reporting.
+
+    Args:
+        uploads: Dictionaries with ``path``, ``filename`` and ``kind``
+
+    Returns:
+        Names as used in error lists (see ``describe_source``)
+    """
+    names = []
+    for upload in uploads:
+        if upload['kind'] != 'zip':
+            names.append(upload['filename'])
+            continue
+        try:
+            with zipfile.ZipFile(upload['path']) as zipf:
+                members = list_zip_xml_members(zipf)
+        except (zipfile.BadZipFile, OSError):
+            members = []
+        if not members:
+            # The whole archive is reported as one failed entry
+            names.append(upload['filename'])
+            continue
+        names.extend(describe_source(os.path.basename(info.filename), upload['filename']) for info in members)
+    return names
+
+
+class BatchSummary(NamedTuple):
+    """Outcome of a batch, split by kind."""
+    invoices: List[Any]
+    validation_errors: List[Dict[str, str]]
+    parsing_errors: List[Dict[str, str]]
+    cache_hits: int
+
+
+def summarize_results(results: List[Dict[str, Any]], read_errors: Optional[List[Dict[str, str]]] = None) -> BatchSummary:
+    """Split the results of ``process_xml_files`` into invoices and errors.
+
+    Args:
+        results: Processing results, in batch order
+        read_errors: Validation errors found before processing (e.g.
+            archives that could not be read); they are listed first
+
+    Returns:
+        BatchSummary with the parsed invoices in batch order
+    """
+    summary = BatchSummary([], list(read_errors or []), [], 0)
+    cache_hits = 0
+
+    for result in results:
+        if result['error_type'] == 'validation':
+            summary.validation_errors.append({'file': result['file'], 'error': result['error']})
+        elif result['error_type'] == 'parsing':
+            summary.parsing_errors.append({'file': result['file'], 'error': result['error']})
+        else:
+            summary.invoices.append(result['invoice'])
+            if result['cached']:
+                cache_hits += 1
+
+    return summary._replace(cache_hits=cache_hits)
+
+
+def _process_file_info(file_info: Dict[str, Any]) -> Dict[str, Any]:
+    """Worker entry point: process one entry of a batch file list."""
+    if file_info.get('data') is not None:
+        return process_xml_bytes(file_info['data'], file_info['filename'], file_info.get('from_zip'))
+    return process_xml_file(file_info['path'], file_info['filename'], file_info.get('from_zip'))
+
+
+def _init_worker(log_level: int) -> None:
+    """Process pool initializer: log at the same level as the parent process."""
+    logging.getLogger().setLevel(log_level)
+
+
+def get_executor(mode: str, max_workers: int) -> Executor:
+    """Return the shared worker pool for a mode, creating it on first use.
+
+    Process pools use the 'spawn' start method so they are safe to create
+    from a multi-threaded server worker.
+
+    Args:
+        mode: 'process' or 'thread'
+        max_workers: Number of workers in the pool
+
+    Returns:
+        The executor for the given mode and size
+    """
+    key = (mode, max_workers)
+    with _executors_lock:
+        executor = _executors.get(key)
+        if executor is None:
+            if mode == 'process':
+                executor = ProcessPoolExecutor(
+                    max_workers=max_workers,
+                    mp_context=multiprocessing.get_context('spawn'),
+                    initializer=_init_worker,
+                    initargs=(logging.getLogger().getEffectiveLevel(),)
+                )
+            else:
+                executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='fac2csv')
+            _executors[key] = executor
+            logger.info(f"Started {mode} pool with {max_workers} worker(s)")
+        return executor
+
+
+def _discard_executor(mode: str, max_workers: int) -> None:
+    """Forget a broken pool so the next batch starts a fresh one."""
+    with _executors_lock:
+        executor = _executors.pop((mode, max_workers), None)
+    if executor is not None:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def process_xml_files(
+    file_infos: List[Dict[str, Any]],
+    mode: Optional[str] = None,
+    max_workers: Optional[int] = None,
+    on_result: Optional[Callable[[int, Dict[str, Any]], None]] = None
+) -> List[Dict[str, Any]]:
+    """Validate and parse a batch of XML files, optionally in parallel.
+
+    lxml releases the GIL while parsing, so the thread mode also scales,
+    but the process mode (default) parallelizes the Python-side extraction
+    as well.
+
+    Args:
+        file_infos: List of dictionaries with ``filename`` and ``from_zip``
+            keys and either ``path`` (file on disk) or ``data`` (document
+            content)
+        mode: 'process', 'thread' or 'serial' (default: PROCESSING_MODE)
+        max_workers: Pool size (default: PROCESSING_WORKERS)
+        on_result: Called as ``on_result(index, result)`` as soon as each
+            file is done (in completion order), e.g. to report progress
+
+    Returns:
+        List of results from ``process_xml_file``, in the same order as
+        ``file_infos``
+    """
+    mode = mode or DEFAULT_PROCESSING_MODE
+    max_workers = max_workers or DEFAULT_PROCESSING_WORKERS
+    results: List[Optional[Dict[str, Any]]] = [None] * len(file_infos)
+
+    def finish(index: int, result: Dict[str, Any]) -> None:
+        results[index] = result
+        if on_result is not None:
+            on_result(index, result)
+
+    if mode not in PROCESSING_MODES:
+        logger.warning(f"Unknown processing mode '{mode}', falling back to serial")
+        mode = 'serial'
+
+    # A pool only pays off when there is more than one file to fan out
+    if mode != 'serial' and max_workers >= 2 and len(file_infos) >= 2:
+        executor = get_executor(mode, max_workers)
+        try:
+            futures = {executor.submit(_process_file_info, info): index for index, info in enumerate(file_infos)}
+            for future in as_completed(futures):
+                finish(futures[future], future.result())
+        except BrokenProcessPool as e:
+            logger.error(f"Worker pool failed ({e}), processing the rest of the batch serially")
+            _discard_executor(mode, max_workers)
+
+    # Serial mode, or whatever a broken pool left unprocessed
+    for index, info in enumerate(file_infos):
+        if results[index] is None:
+            finish(index, _process_file_info(info))
+
+    _log_cache_hits(results)
+    return results
+
+
+def _info_size(file_info: Dict[str, Any]) -> int:
+    """Return the size of the document of a file info, in bytes."""
+    if file_info.get('data') is not None:
+        return len(file_info['data'])
+    try:
+        return os.path.getsize(file_info['path'])
+    except (KeyError, OSError):
+        return 0
+
+
+def iter_process_xml_files(
+    file_infos: Iterable[Dict[str, Any]],
+    mode: Optional[str] = None,
+    max_workers: Optional[int] = None,
+    max_in_flight: Optional[int] = None,
+    max_in_flight_bytes: Optional[int] = None
+) -> Iterator[Dict[str, Any]]:
+    """Validate and parse a stream of XML files with bounded memory.
+
+    Bounded counterpart of ``process_xml_files`` for batches of any size.
+    File infos are taken from ``file_infos`` (typically the lazy
+    ``iter_batch_files``) only while fewer than ``max_in_flight`` documents
+    are submitted and not yet consumed, and their sizes add up to less
+    than ``max_in_flight_bytes`` (a single larger document is still let
+    through). Results are yielded in input order, so a slow consumer such
+    as the CSV writer holds back reading and parsing instead of letting
+    results pile up.
+
+    Args:
+        file_infos: Iterable of file infos (see ``process_xml_files``); an
+            info with a ``result`` is passed through as is
+        mode: 'process', 'thread' or 'serial' (default: PROCESSING_MODE)
+        max_workers: Pool size (default: PROCESSING_WORKERS)
+        max_in_flight: Most documents in flight (default: MAX_IN_FLIGHT,
+            or four per worker)
+        max_in_flight_bytes: Most document bytes in flight (default:
+            MAX_IN_FLIGHT_BYTES)
+
+    Yields:
+        Results from ``process_xml_file``, in the same order as
+        ``file_infos``
+    """
+    mode = mode or DEFAULT_PROCESSING_MODE
+    max_workers = max_workers or DEFAULT_PROCESSING_WORKERS
+    max_in_flight = max(1, max_in_flight or MAX_IN_FLIGHT or max_workers * 4)
+    max_in_flight_bytes = max_in_flight_bytes or MAX_IN_FLIGHT_BYTES
+
+    if mode not in PROCESSING_MODES:
+        logger.warning(f"Unknown processing mode '{mode}', falling back to serial")
+        mode = 'serial'
+    executor = get_executor(mode, max_workers) if mode != 'serial' and max_workers >= 2 else None
+
+    sources = iter(file_infos)
+    # [file info, size, future]; the future is None for ready or serial entries
+    window: deque = deque()
+    window_bytes = 0
+    hits = total = 0
+
+    try:
+        while True:
+            while len(window) < max_in_flight and (not window or window_bytes < max_in_flight_bytes):
+                info = next(sources, None)
+                if info is None:
+                    break
+                size = 0 if 'result' in info else _info_size(info)
+                future = None
+                if executor is not None and 'result' not in info:
+                    try:
+                        future = executor.submit(_process_file_info, info)
+                    except BrokenProcessPool as e:
+                        logger.error(f"Worker pool failed ({e}), processing the rest of the batch serially")
+                        _discard_executor(mode, max_workers)
+                        executor = None
+                window.append((info, size, future))
+                window_bytes += size
+
+            if not window:
+                break
+
+            info, size, future = window.popleft()
+            window_bytes -= size
+            if 'result' in info:
+                result = info['result']
+            elif future is not None:
+                try:
+                    result = future.result()
+                except BrokenProcessPool as e:
+                    logger.error(f"Worker pool failed ({e}), processing the rest of the batch serially")
+                    _discard_executor(mode, max_workers)
+                    executor = None
+                    window = deque((queued, queued_size, None) for queued, queued_size, _ in window)
+                    result = _process_file_info(info)
+            else:
+                result = _process_file_info(info)
+
+            total += 1
+            hits += result['cached']
+            yield result
+    finally:
+        # Abandoned by the consumer: do not start what is still queued
+        for _, _, future in window:
+            if future is not None:
+                future.cancel()
+
+    if total and get_parse_cache() is not None:
+        logger.info(f"Parse cache: {hits}/{total} hits ({hits / total:.0%})")
+
+
+def _log_cache_hits(results: List[Dict[str, Any]]) -> None:
+    """Log the parse cache hit ratio of a batch."""
+    if results and get_parse_cache() is not None:
+        hits = sum(1 for result in results if result['cached'])
+        logger.info(f"Parse cache: {hits}/{len(results)} hits ({hits / len(results):.0%})")
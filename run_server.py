@@ -36,7 +36,7 @@ else:
 
 # Import Flask app after loading environment
 try:
-    from app import app
+    from app import app, start_background_services
     logger.info("Successfully imported Flask application")
 except ImportError as e:
     logger.error(f"Failed to import Flask app: {e}")
@@ -71,6 +71,8 @@ def run_production_server():
     logger.info(f"Environment: {os.getenv('FLASK_ENV', 'production')}")
     logger.info("=" * 60)
 
+    start_background_services()
+
     try:
         serve(
             app,
@@ -7,6 +7,14 @@ document.addEventListener('DOMContentLoaded', function() {
     const fileListContent = document.getElementById('fileListContent');
     const submitBtn = document.getElementById('submitBtn');
     const uploadForm = document.getElementById('uploadForm');
+    const jobProgress = document.getElementById('jobProgress');
+    const maxFiles = uploadForm ? parseInt(uploadForm.dataset.maxFiles, 10) : 0;
+    const maxFileSize = uploadForm ? parseInt(uploadForm.dataset.maxFileSize, 10) : 0;
+
+    // Results page of a job still processing: poll until it finishes
+    if (jobProgress) {
+        pollJob(jobProgress.dataset.statusUrl);
+    }
 
     // Only run if we're on the upload page
     if (!fileInput || !dropZone) {
@@ -69,8 +77,9 @@ document.addEventListener('DOMContentLoaded', function() {
                 showAlert(`Archivo ignorado: "${file.name}" (solo se permiten archivos .xml o .zip)`, 'warning');
                 return false;
             }
-            if (file.size > 10 * 1024 * 1024) {
-                showAlert(`Archivo ignorado: "${file.name}" (excede 10MB)`, 'warning');
+            // ZIP archives may be larger; the limit applies to the XMLs inside
+            if (fileName.endsWith('.xml') && file.size > maxFileSize) {
+                showAlert(`Archivo ignorado: "${file.name}" (excede ${Math.round(maxFileSize / 1024 / 1024)}MB)`, 'warning');
                 return false;
             }
             return true;
@@ -80,9 +89,9 @@ document.addEventListener('DOMContentLoaded', function() {
         selectedFiles = selectedFiles.concat(fileArray);
 
         // Check max files limit
-        if (selectedFiles.length > 50) {
-            showAlert('Máximo 50 archivos permitidos. Se han seleccionado los primeros 50.', 'warning');
-            selectedFiles = selectedFiles.slice(0, 50);
+        if (selectedFiles.length > maxFiles) {
+            showAlert(`Máximo ${maxFiles} archivos permitidos. Se han seleccionado los primeros ${maxFiles}.`, 'warning');
+            selectedFiles = selectedFiles.slice(0, maxFiles);
         }
 
         // Update file input with selected files
@@ -208,4 +217,87 @@ document.addEventListener('DOMContentLoaded', function() {
             alertDiv.remove();
         }, 5000);
     }
+
+    /**
+     * Poll a processing job until it finishes, then show its results.
+     * Each response lists the files finished since the previous one.
+     */
+    function pollJob(statusUrl, since = 0) {
+        fetch(`${statusUrl}?since=${since}`, { headers: { 'Accept': 'application/json' } })
+            .then(response => {
+                if (!response.ok) {
+                    // Unknown job: let the results page report it
+                    window.location.reload();
+                    return null;
+                }
+                return response.json();
+            })
+            .then(job => {
+                if (!job) {
+                    return;
+                }
+                renderJobProgress(job);
+                if (job.status === 'done' || job.status === 'failed') {
+                    window.location.href = job.results_url;
+                } else {
+                    // More finished files waiting: fetch them right away
+                    setTimeout(() => pollJob(statusUrl, job.next_file), job.has_more ? 0 : 1000);
+                }
+            })
+            .catch(() => {
+                // Network hiccup: try again a bit later
+                setTimeout(() => pollJob(statusUrl, since), 3000);
+            });
+    }
+
+    /**
+     * Update the progress bar and add the newly finished files to the list
+     */
+    function renderJobProgress(job) {
+        const bar = document.getElementById('jobProgressBar');
+        const text = document.getElementById('jobProgressText');
+        const list = document.getElementById('jobFileList');
+
+        const percent = job.total_files ? Math.round(100 * job.processed_files / job.total_files) : 0;
+        bar.style.width = `${percent}%`;
+        bar.setAttribute('aria-valuenow', percent);
+        bar.textContent = `${percent}%`;
+
+        if (job.status === 'queued') {
+            text.textContent = 'En cola...';
+        } else {
+            text.textContent = `Procesados ${job.processed_files} de ${job.total_files} archivos`;
+        }
+
+        const items = document.createDocumentFragment();
+        job.files.forEach(file => {
+            const item = document.createElement('li');
+            item.className = 'list-group-item';
+
+            const icon = document.createElement('i');
+            if (file.status === 'done') {
+                icon.className = 'bi bi-check-circle text-success me-2';
+            } else if (file.status === 'error') {
+                icon.className = 'bi bi-x-circle text-danger me-2';
+            } else {
+                icon.className = 'bi bi-skip-forward text-secondary me-2';
+            }
+
+            const name = document.createElement('span');
+            name.textContent = file.name;
+
+            item.appendChild(icon);
+            item.appendChild(name);
+
+            if (file.error) {
+                const error = document.createElement('small');
+                error.className = file.status === 'skipped' ? 'text-muted d-block' : 'text-danger d-block';
+                error.textContent = file.error;
+                item.appendChild(error);
+            }
+
+            items.appendChild(item);
+        });
+        list.appendChild(items);
+    }
 });
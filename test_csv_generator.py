@@ -0,0 +1,220 @@
+"""Tests for the amount normalization and the Parquet and ZIP outputs of csv_generator."""
+
+import datetime
+import glob
+import os
+import struct
+import zipfile
+from decimal import Decimal
+
+import pytest
+
+from models import Invoice, InvoiceLine
+from xml_parser import parse_single_invoice
+from csv_generator import (
+    APPEND_JOURNAL_SUFFIX, CSVGenerationError, append_csv_zip, generate_csv_outputs, generate_csv_zip,
+    generate_parquet_outputs, iter_csv_zip, normalize_amount
+)
+
+
+@pytest.mark.parametrize('value, expected', [
+    ('74889.47', '74889.47'),
+    ('1700', '1700.00'),
+    ('0', '0.00'),
+    ('', '0.00'),
+    (None, '0.00'),
+    ('0.125', '0.13'),
+    ('2.675', '2.68'),
+    ('-0.125', '-0.13'),
+    ('0.52999999999884', '0.53'),
+    ('61344.5378', '61344.54'),
+    ('9.995', '10.00'),
+    ('007.5', '7.50'),
+    ('1.', '1.00'),
+    ('.5', '0.50'),
+    ('1234567890123456.785', '1234567890123456.79'),
+])
+def test_normalize_amount_rounds_half_up(value, expected):
+    """Amounts get two decimals, ties rounded away from zero."""
+    assert normalize_amount(value) == expected
+
+
+@pytest.mark.parametrize('value, expected', [
+    ('1,234,567.891', '1234567.89'),
+    (' 1,700 ', '1700.00'),
+    (' 74889.47\n', '74889.47'),
+])
+def test_normalize_amount_strips_separators(value, expected):
+    """Thousand separators and surrounding whitespace are ignored."""
+    assert normalize_amount(value) == expected
+
+
+@pytest.mark.parametrize('value', ['NaN', 'inf', '-Infinity', float('nan'), float('inf'), Decimal('NaN'), 'abc', '.'])
+def test_normalize_amount_rejects_non_finite(value):
+    """Values that are not finite numbers become zero."""
+    assert normalize_amount(value) == '0.00'
+
+
+@pytest.mark.parametrize('value, expected', [
+    (1700, '1700.00'),
+    (-5, '-5.00'),
+    (0.125, '0.13'),
+    (2.675, '2.68'),
+    (1e20, '100000000000000000000.00'),
+    (Decimal('2.675'), '2.68'),
+    (Decimal('12345678901234567890.125'), '12345678901234567890.13'),
+    (Decimal('1E+3'), '1000.00'),
+])
+def test_normalize_amount_numbers(value, expected):
+    """Numbers are rounded on their decimal representation."""
+    assert normalize_amount(value) == expected
+
+
+def test_normalize_amount_matches_decimal():
+    """Every plain decimal string gets the exact Decimal result."""
+    values = [
+        f"{whole}.{fraction}"
+        for whole in ('0', '7', '19', '61344', '123456789012')
+        for fraction in ('', '5', '49', '005', '995', '4999', '5000', '50001', '52999999999884')
+    ]
+    for value in values:
+        expected = format(Decimal(value).quantize(Decimal('0.01'), rounding='ROUND_HALF_UP'), 'f')
+        assert normalize_amount(value) == expected, value
+
+
+def _invoice_without_lines():
+    """Parse a sample invoice and drop its lines."""
+    invoice = parse_single_invoice('facturas/dian_FW346786.xml')
+    invoice['lineas'] = []
+    return invoice
+
+
+def test_records_are_dict_compatible(tmp_path):
+    """Invoice records read like dicts and give the CSVs of the equivalent dicts."""
+    invoices = [parse_single_invoice(path) for path in sorted(glob.glob('facturas/*.xml'))]
+    invoices.append(_invoice_without_lines())
+    invoice = invoices[0]
+    assert isinstance(invoice, Invoice) and isinstance(invoice['lineas'][0], InvoiceLine)
+    assert invoice == invoice.to_dict()
+    assert dict(invoice)['numero_factura'] == invoice['numero_factura'] == invoice.get('numero_factura')
+    assert invoice.get('no_existe', 'x') == 'x'
+    assert invoice['lineas'][0].get('linea_total') == invoice.to_dict()['lineas'][0]['linea_total']
+    with pytest.raises(KeyError):
+        invoice['no_existe'] = 'x'
+
+    outputs = {}
+    for kind, rows in (('records', invoices), ('dicts', [invoice.to_dict() for invoice in invoices])):
+        paths = (tmp_path / f'{kind}_resumen.csv', tmp_path / f'{kind}_detalle.csv')
+        generate_csv_outputs(rows, str(paths[0]), str(paths[1]))
+        outputs[kind] = [path.read_bytes() for path in paths]
+    assert outputs['records'] == outputs['dicts']
+
+
+def test_parquet_invoice_without_lines(tmp_path):
+    """An invoice with no lines is written with null line columns."""
+    pq = pytest.importorskip('pyarrow.parquet')
+    pa = pytest.importorskip('pyarrow')
+    summary_path = str(tmp_path / 'resumen.parquet')
+    detail_path = str(tmp_path / 'detalle.parquet')
+
+    stats = generate_parquet_outputs([_invoice_without_lines()], summary_path, detail_path)
+
+    assert stats['summary']['rows'] == 1
+    assert stats['detail']['rows'] == 1
+    summary = pq.read_table(summary_path)
+    detail = pq.read_table(detail_path)
+    assert summary.schema.field('total_pagar').type == pa.decimal128(38, 2)
+    assert summary.schema.field('fecha_emision').type == pa.date32()
+    assert summary.schema.field('hora_emision').type == pa.time64('us')
+    assert all(field.nullable for field in detail.schema)
+
+    row = detail.to_pylist()[0]
+    assert row['total_pagar'] == Decimal('209900.00')
+    assert row['fecha_emision'] == datetime.date(2025, 10, 21)
+    assert row['hora_emision'] == datetime.time(16, 19, 22)
+    assert row['periodo_inicio'] is None
+    line_amounts = [field.name for field in detail.schema
+                    if pa.types.is_decimal(field.type) and field.name not in summary.schema.names]
+    assert line_amounts
+    assert all(row[name] is None for name in line_amounts)
+
+
+def test_parquet_zip_failure_discards_output(tmp_path):
+    """A failing invoice aborts the Parquet writers without leaving a ZIP behind."""
+    pytest.importorskip('pyarrow')
+    zip_path = str(tmp_path / 'facturas.zip')
+
+    def invoices():
+        yield _invoice_without_lines()
+        raise RuntimeError('parse failed')
+
+    with pytest.raises(Exception):
+        generate_csv_zip(invoices(), zip_path, 'resumen.parquet', 'detalle.parquet', output_format='parquet')
+    assert not (tmp_path / 'facturas.zip').exists()
+
+
+@pytest.mark.parametrize('compresslevel', [0, 1, 9])
+def test_streamed_zip_is_valid(tmp_path, compresslevel):
+    """The streamed ZIP is a valid archive with both CSVs, as written to a file."""
+    invoices = [parse_single_invoice(path) for path in sorted(glob.glob('facturas/*.xml'))]
+    chunks = list(iter_csv_zip(iter(invoices), 'resumen.csv', 'detalle.csv', compresslevel))
+    assert len(chunks) > 1
+
+    zip_path = str(tmp_path / 'facturas.zip')
+    generate_csv_zip(invoices, zip_path, 'resumen.csv', 'detalle.csv', compresslevel)
+    stream_path = tmp_path / 'streamed.zip'
+    stream_path.write_bytes(b''.join(chunks))
+    with zipfile.ZipFile(str(stream_path)) as streamed, zipfile.ZipFile(zip_path) as written:
+        assert streamed.testzip() is None
+        assert sorted(streamed.namelist()) == ['detalle.csv', 'resumen.csv']
+        for name in streamed.namelist():
+            assert streamed.read(name) == written.read(name)
+        summary = streamed.read('resumen.csv').decode('utf-8-sig').splitlines()
+        assert len(summary) == len(invoices) + 1
+
+
+def _sample_zip(tmp_path):
+    """Write a ZIP with one CSV pair and return its path and bytes."""
+    zip_path = str(tmp_path / 'facturas.zip')
+    generate_csv_zip([_invoice_without_lines()], zip_path, 'resumen.csv', 'detalle.csv')
+    with open(zip_path, 'rb') as zip_file:
+        return zip_path, zip_file.read()
+
+
+def test_append_failure_restores_archive(tmp_path):
+    """A failing append puts the original central directory back."""
+    zip_path, original = _sample_zip(tmp_path)
+
+    def invoices():
+        yield _invoice_without_lines()
+        raise RuntimeError('parse failed')
+
+    with pytest.raises(CSVGenerationError):
+        append_csv_zip(invoices(), zip_path, 'resumen.csv', 'detalle.csv')
+
+    with open(zip_path, 'rb') as zip_file:
+        assert zip_file.read() == original
+    assert not os.path.exists(zip_path + APPEND_JOURNAL_SUFFIX)
+
+
+def test_append_recovers_interrupted_journal(tmp_path):
+    """A journal left by an interrupted append is rolled back before appending."""
+    zip_path, original = _sample_zip(tmp_path)
+    with zipfile.ZipFile(zip_path) as zipf:
+        directory_offset = zipf.start_dir
+
+    # Simulate a process that died after overwriting the central directory
+    with open(zip_path + APPEND_JOURNAL_SUFFIX, 'wb') as journal:
+        journal.write(struct.pack('<Q', directory_offset))
+        journal.write(original[directory_offset:])
+    with open(zip_path, 'r+b') as zip_file:
+        zip_file.seek(directory_offset)
+        zip_file.write(b'\0' * 64)
+
+    stats = append_csv_zip([_invoice_without_lines()], zip_path, 'resumen.csv', 'detalle.csv')
+
+    assert stats['summary']['path'] == 'resumen_2.csv'
+    assert not os.path.exists(zip_path + APPEND_JOURNAL_SUFFIX)
+    with zipfile.ZipFile(zip_path) as zipf:
+        assert zipf.testzip() is None
+        assert sorted(zipf.namelist()) == ['detalle.csv', 'detalle_2.csv', 'resumen.csv', 'resumen_2.csv']
@@ -0,0 +1,47 @@
+"""Tests for the streamed conversion of large files by the command-line converter."""
+
+import shutil
+
+import fac2csv
+
+
+def _convert(inputs, output_dir):
+    """Run a serial conversion without the parse cache; return the CSVs' contents."""
+    stats = fac2csv.convert(fac2csv.collect_inputs(inputs), str(output_dir), mode='serial', progress=False)
+    contents = {}
+    for name in (fac2csv.SUMMARY_FILENAME, fac2csv.DETAIL_FILENAME):
+        with open(output_dir / name, encoding='utf-8-sig') as csv_file:
+            contents[name] = csv_file.read()
+    return stats, contents
+
+
+def test_streamed_files_match_parsed_output(tmp_path, monkeypatch):
+    """Files above the streaming threshold give the same rows as parsed ones."""
+    monkeypatch.setattr(fac2csv.parse_cache, 'PARSE_CACHE_ENABLED', False)
+    inputs = ['facturas/dian_FW346786.xml', 'facturas/fv089090094300625011AF297.xml']
+    parsed_stats, parsed = _convert(inputs, tmp_path / 'parsed')
+
+    monkeypatch.setattr(fac2csv, 'STREAM_ABOVE_BYTES', 0)
+    streamed_stats, streamed = _convert(inputs, tmp_path / 'streamed')
+
+    assert streamed == parsed
+    assert (streamed_stats.invoices, streamed_stats.lines) == (parsed_stats.invoices, parsed_stats.lines)
+
+
+def test_streaming_error_leaves_no_rows(tmp_path, monkeypatch):
+    """An invoice that fails mid-stream is reported and its rows are removed."""
+    monkeypatch.setattr(fac2csv.parse_cache, 'PARSE_CACHE_ENABLED', False)
+    monkeypatch.setattr(fac2csv, 'STREAM_ABOVE_BYTES', 0)
+    source = tmp_path / 'entrada'
+    source.mkdir()
+    shutil.copy('facturas/dian_FW346786.xml', source / 'a.xml')
+    with open('facturas/fv089090094300625011AF297.xml', 'rb') as xml_file:
+        data = xml_file.read()
+    # Cut inside the invoice lines
+    (source / 'b.xml').write_bytes(data[:data.index(b'<cac:InvoiceLine>') + 200])
+
+    stats, contents = _convert([str(source)], tmp_path / 'salida')
+    _, expected = _convert(['facturas/dian_FW346786.xml'], tmp_path / 'esperado')
+
+    assert (stats.invoices, stats.errors) == (1, 1)
+    assert contents == expected
@@ -0,0 +1,80 @@
+"""Tests for reading ZIP uploads and sweeping expired files."""
+
+import io
+import os
+import struct
+import time
+import zipfile
+
+import pytest
+
+from utils.file_manager import FileSweeper, read_zip_member
+from pipeline import iter_zip_upload
+
+XML = b'<?xml version="1.0" encoding="UTF-8"?><Invoice>' + b'<Note>texto</Note>' * 50 + b'</Invoice>'
+
+
+def _archive_with(patch):
+    """Write a ZIP with two XML members and let ``patch`` corrupt the second one."""
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as zipf:
+        zipf.writestr('buena.xml', XML)
+        zipf.writestr('mala.xml', XML)
+    data = bytearray(buffer.getvalue())
+    with zipfile.ZipFile(io.BytesIO(bytes(data))) as zipf:
+        info = zipf.getinfo('mala.xml')
+        directory_offset = zipf.start_dir
+    patch(data, info, directory_offset)
+    return io.BytesIO(bytes(data))
+
+
+def _corrupt_deflate(data, info, directory_offset):
+    """Overwrite the compressed data of the member with an invalid block."""
+    name_length, extra_length = struct.unpack('<HH', data[info.header_offset + 26:info.header_offset + 30])
+    start = info.header_offset + 30 + name_length + extra_length
+    data[start:start + info.compress_size] = b'\xff' * info.compress_size
+
+
+def _unsupported_method(data, info, directory_offset):
+    """Declare an unknown compression method in both headers of the member."""
+    data[info.header_offset + 8:info.header_offset + 10] = struct.pack('<H', 99)
+    entry = data.index(b'mala.xml', directory_offset) - 46
+    data[entry + 10:entry + 12] = struct.pack('<H', 99)
+
+
+@pytest.mark.parametrize('patch', [_corrupt_deflate, _unsupported_method])
+def test_read_zip_member_reports_ioerror(patch):
+    """Corrupt data and unsupported methods are reported as IOError."""
+    with zipfile.ZipFile(_archive_with(patch)) as zipf:
+        assert read_zip_member(zipf, zipf.getinfo('buena.xml'), 1024 * 1024) == XML
+        with pytest.raises(IOError):
+            read_zip_member(zipf, zipf.getinfo('mala.xml'), 1024 * 1024)
+
+
+@pytest.mark.parametrize('patch', [_corrupt_deflate, _unsupported_method])
+def test_corrupt_member_is_a_file_error(patch):
+    """A corrupt member becomes a per-file error and the other members are read."""
+    errors = []
+    files = list(iter_zip_upload(_archive_with(patch), 'facturas.zip', errors))
+    assert [info['filename'] for info in files] == ['buena.xml']
+    assert len(errors) == 1
+    assert 'mala.xml' in errors[0]['file']
+
+
+def test_sweeper_keeps_entries_in_use(tmp_path):
+    """Expired entries reported in use are kept; the others are deleted."""
+    (tmp_path / 'pendiente').mkdir()
+    (tmp_path / 'terminado').mkdir()
+    sweeper = FileSweeper([str(tmp_path)], max_age=60, in_use=lambda path: path.endswith('pendiente'))
+    sweeper.scan()
+
+    assert sweeper.sweep(now=time.time() + 120)[0] == 1
+    assert sorted(os.listdir(tmp_path)) == ['pendiente']
+
+
+def test_sweeper_reports_cutoff(tmp_path):
+    """Each sweep passes its cutoff time to the on_sweep callback."""
+    cutoffs = []
+    sweeper = FileSweeper([str(tmp_path)], max_age=60, on_sweep=cutoffs.append)
+    sweeper.sweep(now=1000.0)
+    assert cutoffs == [940.0]
@@ -0,0 +1,57 @@
+"""Tests for the job progress reported while a job runs and the purge of old jobs."""
+
+import time
+
+from jobs import JobStore, FILE_DONE, FILE_ERROR, FILE_PENDING
+
+
+def test_file_progress_pages(tmp_path):
+    """Finished files are returned once, a page at a time, after the cursor."""
+    store = JobStore(str(tmp_path / 'jobs.sqlite3'))
+    job_id = store.create_job([], 5)
+    store.set_files(job_id, [{'name': f'{n}.xml', 'status': FILE_PENDING} for n in range(5)])
+    store.update_file(job_id, 0, FILE_DONE)
+    store.update_file(job_id, 1, FILE_ERROR, 'XML inválido')
+    store.update_file(job_id, 2, FILE_DONE)
+
+    page = store.get_file_progress(job_id, since=0, limit=2)
+    assert (page['total'], page['processed']) == (5, 3)
+    assert [f['name'] for f in page['files']] == ['0.xml', '1.xml']
+    assert page['files'][1]['error'] == 'XML inválido'
+
+    page = store.get_file_progress(job_id, since=page['next'], limit=2)
+    assert [f['name'] for f in page['files']] == ['2.xml']
+
+    page = store.get_file_progress(job_id, since=page['next'], limit=2)
+    assert page['files'] == []
+    assert page['next'] == 3
+
+
+def test_purge_finished_jobs(tmp_path):
+    """Jobs finished before the cutoff are deleted with their files and CUFEs."""
+    store = JobStore(str(tmp_path / 'jobs.sqlite3'))
+    old, recent, queued, appended = (store.create_job([], 1) for _ in range(4))
+    for job_id in (old, recent, appended):
+        store.set_files(job_id, [{'name': 'a.xml', 'status': FILE_DONE}])
+        store.add_cufes(job_id, ['cufe-1'])
+        store.finish_job(job_id, {})
+    append = store.create_job([], 1, options={'append_to': appended})
+    store.finish_job(append, {})
+    cutoff = time.time()
+    store.finish_job(recent, {})
+    conn = store._connect()
+    conn.execute('UPDATE jobs SET finished = ? WHERE id != ?', (cutoff - 60, recent))
+    # The batch appended to after the cutoff is still in use
+    conn.execute('UPDATE jobs SET finished = ? WHERE id = ?', (cutoff + 60, append))
+
+    assert store.purge_finished(cutoff) == 1
+    assert store.get_job(old) is None
+    assert store.get_file_progress(old)['total'] == 0
+    assert not store.has_cufe(old, 'cufe-1')
+    for job_id in (recent, queued, appended, append):
+        assert store.get_job(job_id) is not None
+    assert store.has_cufe(appended, 'cufe-1')
+
+    conn.execute('UPDATE jobs SET finished = ? WHERE id = ?', (cutoff - 60, append))
+    assert store.purge_finished(cutoff) == 2
+    assert not store.has_cufe(appended, 'cufe-1')
@@ -0,0 +1,43 @@
+"""Tests for the per-process metrics files."""
+
+import json
+import os
+import time
+
+from utils import metrics
+
+
+def _isolate_registry(monkeypatch, directory):
+    """Point the metrics of this process at ``directory``, starting empty."""
+    monkeypatch.setattr(metrics, 'METRICS_ENABLED', True)
+    for name in ('directory', 'pid', 'path', 'counters', 'stages', 'written', 'dirty'):
+        monkeypatch.setattr(metrics._registry, name, getattr(metrics._registry, name))
+    metrics._registry.directory = directory
+    metrics._registry.pid = None
+
+
+def test_stale_process_files_are_folded(tmp_path, monkeypatch):
+    """The file of an ended process is folded in once, keeping its counts."""
+    _isolate_registry(monkeypatch, str(tmp_path))
+
+    stale = tmp_path / 'metrics_1_deadbeef.json'
+    stale.write_text(json.dumps({'counters': [['fac2csv_invoices_total', {}, 5]], 'stages': {}}))
+    old = time.time() - metrics.METRICS_STALE_SECONDS - 60
+    os.utime(stale, (old, old))
+    metrics.inc('fac2csv_invoices_total', 2)
+
+    for _ in range(2):
+        data = metrics.collect_metrics(str(tmp_path))
+        assert data['counters'][('fac2csv_invoices_total', ())] == 7
+    assert not stale.exists()
+    assert os.listdir(tmp_path) == [os.path.basename(metrics._registry.path)]
+
+
+def test_no_files_without_metrics_directory(tmp_path, monkeypatch):
+    """Without a metrics directory the metrics stay in memory."""
+    _isolate_registry(monkeypatch, str(tmp_path / 'metrics'))
+
+    metrics.inc('fac2csv_invoices_total', 1)
+    metrics.flush_metrics()
+
+    assert not (tmp_path / 'metrics').exists()
@@ -0,0 +1,64 @@
+"""Tests for the lookups, size accounting and eviction of the parse cache."""
+
+import sqlite3
+
+from parse_cache import ParseCache, encode_invoice
+from xml_parser import parse_single_invoice
+
+
+def _cache_with_entries(path, count, max_bytes):
+    """Fill a cache with ``count`` copies of a sample invoice under distinct digests."""
+    invoice = parse_single_invoice('facturas/dian_FW346786.xml')
+    cache = ParseCache(str(path), max_bytes=max_bytes)
+    for number in range(count):
+        assert cache.put(f'digest-{number}', invoice, invoice['cufe'])
+    return cache, invoice, len(encode_invoice(invoice))
+
+
+def test_size_total_tracks_changes(tmp_path):
+    """The running totals follow inserts, replacements and deletions."""
+    cache, invoice, size = _cache_with_entries(tmp_path / 'cache.sqlite3', 3, 1024 * 1024)
+    assert cache.stats() == {'entries': 3, 'bytes': 3 * size}
+
+    # Storing a digest again replaces its entry instead of adding one
+    cache.put('digest-0', invoice, invoice['cufe'])
+    assert cache.stats() == {'entries': 3, 'bytes': 3 * size}
+    assert cache.get('digest-0').cufe == invoice['cufe']
+    assert cache.get('missing') is None
+
+    cache.clear()
+    assert cache.stats() == {'entries': 0, 'bytes': 0}
+
+
+def test_eviction_keeps_recent_entries(tmp_path):
+    """Past the size limit the least recently used entries are evicted."""
+    path = tmp_path / 'cache.sqlite3'
+    _, _, size = _cache_with_entries(tmp_path / 'probe.sqlite3', 1, 1024 * 1024)
+    cache, _, _ = _cache_with_entries(path, 10, 5 * size)
+
+    stats = cache.stats()
+    assert stats['bytes'] <= 5 * size
+    assert stats['entries'] == stats['bytes'] // size
+    assert cache.get('digest-9') is not None
+    assert cache.get('digest-0') is None
+
+    # A new connection (e.g. another process) sees the same totals
+    assert ParseCache(str(path), max_bytes=5 * size).stats() == stats
+
+
+def test_lookup_by_cufe(tmp_path):
+    """Entries are found by CUFE through its index, most recently used first."""
+    path = tmp_path / 'cache.sqlite3'
+    cache, invoice, _ = _cache_with_entries(path, 1, 1024 * 1024)
+    other = parse_single_invoice('facturas/XML_BEC481550444.xml')
+    cache.put('digest-other', other, 'cufe-other')
+
+    assert cache.get_by_cufe('cufe-other').invoice == other
+    assert cache.get_by_cufe(invoice['cufe']).invoice == invoice
+    assert cache.get_by_cufe('missing') is None
+    assert cache.get_by_cufe('') is None
+
+    conn = sqlite3.connect(str(path))
+    plan = conn.execute("EXPLAIN QUERY PLAN SELECT digest FROM invoices WHERE cufe = 'x'").fetchall()
+    conn.close()
+    assert 'invoices_cufe' in str(plan)
@@ -0,0 +1,177 @@
+"""Tests for the document processing pipeline and the streamed uploads."""
+
+import glob
+import io
+import os
+
+import pytest
+
+import parse_cache
+from pipeline import (
+    StreamingDocument, describe_source, iter_process_xml_files, process_xml_bytes, process_xml_file, process_xml_files
+)
+from upload_stream import receive_multipart
+from utils.validators import validate_file_extension, validate_ubl_namespace, validate_xml_wellformed
+from xml_parser import extract_embedded_invoice, parse_invoice_cufe, parse_single_invoice
+
+SAMPLES = sorted(glob.glob('facturas/*.xml'))
+
+# Fields that depend only on the document, not on how it was received
+COMPARED = ('file', 'invoice', 'cufe', 'error', 'error_type')
+
+
+@pytest.fixture(autouse=True)
+def _no_parse_cache(monkeypatch):
+    """Parse every document instead of answering from the shared cache."""
+    monkeypatch.setattr(parse_cache, 'PARSE_CACHE_ENABLED', False)
+
+
+def _read(path):
+    with open(path, 'rb') as xml_file:
+        return xml_file.read()
+
+
+def _expected(data, filename):
+    result = process_xml_bytes(data, filename)
+    return {key: result[key] for key in COMPARED}
+
+
+@pytest.mark.parametrize('xml_path', SAMPLES)
+def test_single_parse_matches_separate_passes(xml_path):
+    """Validating and parsing one shared tree gives the result of the separate passes."""
+    filename = os.path.basename(xml_path)
+    validate_file_extension(filename)
+    validate_xml_wellformed(xml_path)
+    validate_ubl_namespace(xml_path)
+    invoice = parse_single_invoice(xml_path)
+    cufe = parse_invoice_cufe(extract_embedded_invoice(xml_path))
+
+    for result in (process_xml_file(xml_path, filename), process_xml_bytes(_read(xml_path), filename)):
+        assert result['error'] == ''
+        assert result['invoice'] == invoice
+        assert result['cufe'] == cufe
+
+
+def _mixed_batch():
+    """Return file infos of the samples with failing documents in between."""
+    infos = [{'path': path, 'filename': os.path.basename(path), 'from_zip': None} for path in SAMPLES]
+    infos.insert(1, {'data': b'no es XML', 'filename': 'basura.xml', 'from_zip': None})
+    infos.insert(3, {'data': b'<?xml version="1.0"?><Otro/>', 'filename': 'otro.xml', 'from_zip': 'lote.zip'})
+    return infos
+
+
+@pytest.mark.parametrize('mode', ['process', 'thread', 'serial'])
+def test_pool_keeps_order_and_errors(mode):
+    """Pool results come back in input order, each failing file with its own error."""
+    infos = _mixed_batch()
+    finished = []
+    results = process_xml_files(infos, mode, 3, on_result=lambda index, result: finished.append(index))
+
+    assert [result['file'] for result in results] == [describe_source(info['filename'], info['from_zip']) for info in infos]
+    assert [result['error_type'] for result in results] == ['', 'validation', '', 'validation'] + [''] * (len(infos) - 4)
+    assert all(result['invoice'] is not None for result in results if not result['error_type'])
+    assert sorted(finished) == list(range(len(infos)))
+
+
+@pytest.mark.parametrize('spill_threshold', [1 << 30, 100])
+@pytest.mark.parametrize('xml_path', SAMPLES)
+def test_streamed_document_matches_bytes(tmp_path, xml_path, spill_threshold):
+    """A document fed in small chunks gives the result of the whole bytes and leaves no file."""
+    data = _read(xml_path)
+    filename = os.path.basename(xml_path)
+    document = StreamingDocument(filename, str(tmp_path), spill_threshold=spill_threshold)
+    for offset in range(0, len(data), 997):
+        document.feed(data[offset:offset + 997])
+        if spill_threshold < offset:
+            assert os.listdir(tmp_path)
+    result = document.close()
+
+    assert {key: result[key] for key in COMPARED} == _expected(data, filename)
+    assert result['invoice'] is not None
+    assert os.listdir(tmp_path) == []
+
+
+def test_discarded_document_removes_spill_file(tmp_path):
+    """A document cut short by the upload leaves no spill file behind."""
+    data = _read(SAMPLES[0])
+    document = StreamingDocument('cut.xml', str(tmp_path), spill_threshold=100)
+    document.feed(data[:len(data) // 2])
+    assert os.listdir(tmp_path)
+    document.discard()
+
+    assert os.listdir(tmp_path) == []
+    assert document.close()['error_type'] == 'validation'
+
+
+def test_truncated_document_is_rejected(tmp_path):
+    """A document that ends early fails validation like its bytes would."""
+    data = _read(SAMPLES[0])[:-50]
+    document = StreamingDocument('cut.xml', str(tmp_path), spill_threshold=100)
+    document.feed(data)
+    result = document.close()
+
+    assert result['error_type'] == process_xml_bytes(data, 'cut.xml')['error_type'] == 'validation'
+    assert os.listdir(tmp_path) == []
+
+
+def _multipart(boundary, parts):
+    """Encode (filename, content) pairs as the ``files`` field of a form body."""
+    body = io.BytesIO()
+    body.write(b'--%s\r\nContent-Disposition: form-data; name="note"\r\n\r\nignored\r\n' % boundary)
+    for filename, content in parts:
+        body.write(b'--%s\r\n' % boundary)
+        body.write(b'Content-Disposition: form-data; name="files"; filename="%s"\r\n' % filename.encode())
+        body.write(b'Content-Type: application/octet-stream\r\n\r\n')
+        body.write(content)
+        body.write(b'\r\n')
+    body.write(b'--%s--\r\n' % boundary)
+    body.seek(0)
+    return body
+
+
+def test_receive_multipart_matches_bytes(tmp_path, monkeypatch):
+    """Streamed XML parts give the results of their bytes, in upload order."""
+    monkeypatch.setattr('upload_stream.STREAM_READ_SIZE', 1000)
+    parts = [(os.path.basename(path), _read(path)) for path in SAMPLES]
+    boundary = b'----fac2csv-test'
+    upload = receive_multipart(_multipart(boundary, parts), boundary, str(tmp_path), spill_threshold=4096)
+
+    assert upload.file_count == len(parts)
+    assert [{key: result[key] for key in COMPARED} for result in upload.results] == [
+        _expected(content, filename) for filename, content in parts
+    ]
+    assert os.listdir(tmp_path) == []
+
+
+def test_receive_multipart_rejects_other_parts(tmp_path):
+    """Parts that are neither UBL XML nor ZIP fail validation on their own."""
+    pdf = _read(glob.glob('facturas/*.pdf')[0])
+    parts = [('factura.pdf', pdf), ('renombrado.xml', pdf), (os.path.basename(SAMPLES[0]), _read(SAMPLES[0]))]
+    boundary = b'----fac2csv-test'
+    upload = receive_multipart(_multipart(boundary, parts), boundary, str(tmp_path), spill_threshold=4096)
+
+    assert [result['error_type'] for result in upload.results] == ['validation', 'validation', '']
+    assert os.listdir(tmp_path) == []
+
+
+@pytest.mark.parametrize('max_in_flight, max_in_flight_bytes, window', [(3, 1 << 30, 3), (8, 1, 1)])
+def test_bounded_pipeline_keeps_order_and_window(max_in_flight, max_in_flight_bytes, window):
+    """Results keep input order and no more than the window is read ahead of the consumer."""
+    infos = [
+        {'data': _read(path), 'filename': f'{number}.xml', 'from_zip': 'lote.zip'}
+        for number, path in enumerate(SAMPLES * 5)
+    ]
+    taken = []
+
+    def sources():
+        for info in infos:
+            taken.append(info['filename'])
+            yield info
+
+    consumed = []
+    for result in iter_process_xml_files(sources(), 'thread', 2, max_in_flight, max_in_flight_bytes):
+        assert len(taken) - len(consumed) <= window
+        consumed.append(result)
+
+    assert [result['file'] for result in consumed] == [describe_source(info['filename'], 'lote.zip') for info in infos]
+    assert all(result['invoice'] is not None for result in consumed)
@@ -0,0 +1,40 @@
+"""Tests for the sniffing of uploaded documents."""
+
+import glob
+
+import pytest
+
+from utils.validators import SNIFF_BYTES, ValidationError, sniff_xml_bytes
+from xml_parser import NAMESPACES
+
+
+def _read(path):
+    with open(path, 'rb') as sample:
+        return sample.read()
+
+
+def test_sniffer_identifies_samples():
+    """Every sample is identified from its first bytes."""
+    for xml_path in sorted(glob.glob('facturas/*.xml')):
+        document_type = sniff_xml_bytes(_read(xml_path))
+        assert document_type.name in ('Invoice', 'AttachedDocument'), xml_path
+
+
+@pytest.mark.parametrize('data', [
+    _read(glob.glob('facturas/*.pdf')[0]),
+    _read(glob.glob('facturas/*.zip')[0]),
+    b'numero;total\r\nFV1;100\r\n',
+    b'\x00\x01\x02\x03' * 100,
+    b'<html><body>no</body></html>',
+    '<?xml version="1.0"?><Order xmlns="{invoice}"/>'.format(**NAMESPACES).encode('utf-8'),
+])
+def test_sniffer_rejects_other_documents(data):
+    """Documents that are not UBL XML are rejected from their first bytes."""
+    with pytest.raises(ValidationError):
+        sniff_xml_bytes(data)
+
+
+def test_sniffer_leaves_late_root_to_full_parse():
+    """A root element beyond SNIFF_BYTES is not decided by the sniffer."""
+    data = b'<?xml version="1.0"?><!--' + b' ' * SNIFF_BYTES + b'--><Invoice/>'
+    assert sniff_xml_bytes(data) is None
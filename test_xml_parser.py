@@ -0,0 +1,168 @@
+"""Tests for the zero-copy CDATA payload slicing and the compiled paths of xml_parser."""
+
+import glob
+import mmap
+import os
+
+from lxml import etree as ET
+
+import parse_cache
+from pipeline import StreamingDocument
+import xml_parser
+from xml_parser import NAMESPACES, extract_embedded_invoice, parse_invoice_element, unwrap_invoice
+
+INVOICE = (
+    '<Invoice xmlns="{invoice}" xmlns:cbc="{cbc}"><cbc:ID>{number}</cbc:ID>'
+    '<cbc:Note>Descripción</cbc:Note></Invoice>'
+)
+
+
+def _invoice(number):
+    """Return a minimal embedded Invoice document."""
+    return INVOICE.format(number=number, **NAMESPACES)
+
+
+def _attached_document(before, payload):
+    """Build a single-line AttachedDocument with ``before`` ahead of the attachment."""
+    return (
+        '<?xml version="1.0" encoding="UTF-8"?>'
+        '<AttachedDocument xmlns="{attached}" xmlns:cac="{cac}" xmlns:cbc="{cbc}">'
+        '{before}<cac:Attachment><cac:ExternalReference><cbc:MimeCode>text/xml</cbc:MimeCode>'
+        '<cbc:Description><![CDATA[{payload}]]></cbc:Description>'
+        '</cac:ExternalReference></cac:Attachment></AttachedDocument>'
+    ).format(before=before, payload=payload, **NAMESPACES).encode('utf-8')
+
+
+def _unwrap(data):
+    """Unwrap the invoice of a document, returning (ID, payload bytes copied)."""
+    invoice, bytes_copied = unwrap_invoice(ET.fromstring(data), 'test', data)
+    return invoice.findtext('cbc:ID', namespaces=NAMESPACES), bytes_copied
+
+
+def test_cdata_slice_without_copy():
+    """The payload of a minified document is parsed from a slice of the raw bytes."""
+    assert _unwrap(_attached_document('', _invoice('FV1'))) == ('FV1', 0)
+
+
+def test_cdata_slice_multiline():
+    """CRLF line breaks in the payload do not prevent slicing."""
+    data = _attached_document('', '\r\n' + _invoice('FV1').replace('><', '>\r\n<') + '\r\n')
+    assert _unwrap(data) == ('FV1', 0)
+
+
+def test_cdata_slice_skips_earlier_description():
+    """A Description outside the ExternalReference on the same line is not taken."""
+    decoy = '<cac:Note><cbc:Description><![CDATA[{0}]]></cbc:Description></cac:Note>'.format(_invoice('DECOY'))
+    assert _unwrap(_attached_document(decoy, _invoice('FV1'))) == ('FV1', 0)
+
+
+def test_cdata_slice_mismatch_falls_back_to_text():
+    """A payload that does not match the element text is read through a copy."""
+    decoy = (
+        '<!--<cac:ExternalReference><cbc:Description><![CDATA[{0}]]>'
+        '</cbc:Description></cac:ExternalReference>-->'
+    ).format(_invoice('DECOY'))
+    number, bytes_copied = _unwrap(_attached_document(decoy, _invoice('FV1')))
+    assert number == 'FV1'
+    assert bytes_copied > 0
+
+
+def test_cdata_slice_from_mmap(tmp_path):
+    """The payload is sliced from an mmap as well (spilled uploads are mapped)."""
+    path = tmp_path / 'factura.xml'
+    path.write_bytes(_attached_document('', '\r\n' + _invoice('FV1').replace('><', '>\r\n<')))
+    with open(path, 'rb') as xml_file, mmap.mmap(xml_file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        assert _unwrap(data) == ('FV1', 0)
+
+
+def test_spilled_upload_is_parsed(tmp_path, monkeypatch):
+    """A streamed upload spilled to disk is parsed without copying its payload."""
+    monkeypatch.setattr(parse_cache, 'PARSE_CACHE_ENABLED', False)
+    for xml_path in sorted(glob.glob('facturas/*.xml')):
+        with open(xml_path, 'rb') as xml_file:
+            data = xml_file.read()
+        document = StreamingDocument(os.path.basename(xml_path), str(tmp_path), spill_threshold=100)
+        document.feed(data)
+        result = document.close()
+        assert result['error'] == '', xml_path
+        assert result['invoice'] is not None
+        assert result['bytes_copied'] == 0
+
+
+def _element_path(element):
+    """Return the location of an element, or None."""
+    return None if element is None else element.getroottree().getpath(element)
+
+
+def _compare_paths(context, paths):
+    """Check the rewritten './/' paths against ElementPath on one context element."""
+    for path in paths:
+        if not path.startswith('.//'):
+            continue
+        xpath, attribute = xml_parser._compile_path(path)
+        head, sep, _ = path.rpartition('/@')
+        found = xpath(context)
+        expected = context.find(head if sep else path, NAMESPACES)
+        assert _element_path(found[0] if found else None) == _element_path(expected), path
+
+
+def test_rewritten_paths_match_element_path():
+    """The descendant:: rewrite selects what .find()/.findall() select on the samples."""
+    header_sections = (
+        xml_parser.GENERAL_SECTION, xml_parser.CUSTOMER_SECTION, xml_parser.SUPPLIER_SECTION,
+        xml_parser.MONETARY_SECTION, xml_parser.IVA_SECTION, xml_parser.DOCUMENT_KEY_SECTION
+    )
+    line_sections = (xml_parser.LINE_SECTION, xml_parser.LINE_DISCOUNT_SECTION)
+    lines_xpath = xml_parser._compile_path(xml_parser.INVOICE_LINES_FALLBACK, first_only=False)[0]
+
+    for xml_path in sorted(glob.glob('facturas/*.xml')):
+        root = extract_embedded_invoice(xml_path)
+        lines = root.findall(xml_parser.INVOICE_LINES_FALLBACK, NAMESPACES)
+        assert lines
+        assert [_element_path(line) for line in lines_xpath(root)] == [_element_path(line) for line in lines]
+
+        for sections, contexts in ((header_sections, [root]), (line_sections, lines)):
+            for context in contexts:
+                for section in sections:
+                    scope = context
+                    if section.scope_fallback:
+                        _compare_paths(context, [section.scope_fallback])
+                    if section.scope:
+                        found = xml_parser._compile_path(section.scope)[0](context)
+                        if not found:
+                            continue
+                        scope = found[0]
+                    for field in section.fields:
+                        _compare_paths(scope, field.paths + field.fallbacks)
+
+
+def _count_fallbacks(monkeypatch):
+    """Record the fields whose fallback search is counted."""
+    fields = []
+
+    def inc(name, value=1, **labels):
+        if name == 'fac2csv_parse_fallbacks_total':
+            fields.append(labels['field'])
+    monkeypatch.setattr(xml_parser, 'inc', inc)
+    return fields
+
+
+def test_fallback_counted_only_when_anchored_path_misses(monkeypatch):
+    """Fallbacks are counted for the fields whose anchored path missed, and only those."""
+    fallbacks = _count_fallbacks(monkeypatch)
+    for xml_path in sorted(glob.glob('facturas/*.xml')):
+        xml_parser.parse_single_invoice(xml_path)
+    assert fallbacks == []
+
+    anchored = ET.fromstring(_invoice('FV1'))
+    nested = ET.fromstring(
+        '<Invoice xmlns="{invoice}" xmlns:cac="{cac}" xmlns:cbc="{cbc}"><cac:Signature><cbc:ID>FV2</cbc:ID>'
+        '</cac:Signature></Invoice>'.format(**NAMESPACES)
+    )
+    assert parse_invoice_element(anchored)['numero_factura'] == 'FV1'
+    assert 'numero_factura' not in fallbacks
+    # Optional fields without a fallback are never counted
+    assert 'fecha_vencimiento' not in fallbacks
+
+    assert parse_invoice_element(nested)['numero_factura'] == 'FV2'
+    assert fallbacks.count('numero_factura') == 1
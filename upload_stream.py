@@ -0,0 +1,147 @@
+"""Multipart uploads processed while the request body is received.
+
+The request body is decoded with werkzeug's sans-IO multipart decoder
+instead of being parsed into files first: every XML part is fed to a
+StreamingDocument as its bytes arrive, so most of the batch is parsed by
+the time the upload finishes and on a slow link the processing hides
+behind the transfer. ZIP parts are written to the batch directory and
+processed once complete, since an archive lists its members at the end.
+"""
+
+import logging
+import time
+from typing import Any, Dict, Iterator, List, NamedTuple, Optional
+
+from werkzeug.sansio.multipart import Data, Epilogue, File, MultipartDecoder, NeedData
+
+from pipeline import StreamingDocument, iter_batch_files, iter_process_xml_files, UPLOAD_SPILL_BYTES
+from utils.validators import validate_files_count, ValidationError, MAX_FILES
+from utils.file_manager import sanitize_filename, unique_path
+from utils.metrics import inc, observe_stage
+
+logger = logging.getLogger(__name__)
+
+# Bytes read from the request body at a time
+STREAM_READ_SIZE = 64 * 1024
+
+
+class StreamedUpload(NamedTuple):
+    """Outcome of a streamed upload."""
+    results: List[Dict[str, Any]]
+    file_count: int
+
+
+def receive_multipart(
+    stream: Any,
+    boundary: bytes,
+    upload_dir: str,
+    field: str = 'files',
+    max_files: int = MAX_FILES,
+    spill_threshold: int = UPLOAD_SPILL_BYTES,
+    mode: Optional[str] = None,
+    max_workers: Optional[int] = None
+) -> StreamedUpload:
+    """Read a multipart/form-data body, processing its files as they arrive.
+
+    Args:
+        stream: Binary stream of the request body
+        boundary: Multipart boundary (from the Content-Type header)
+        upload_dir: Batch directory for ZIP parts and large XML parts
+        field: Form field holding the files; other parts are ignored
+        max_files: Largest number of files accepted
+        spill_threshold: Largest XML part kept in memory (see
+            ``StreamingDocument``)
+        mode: Processing mode of the ZIP members (see ``process_xml_files``)
+        max_workers: Pool size for the ZIP members
+
+    Returns:
+        StreamedUpload with the processing results in upload order (ZIP
+        members, or the archive itself if it cannot be read, in place of
+        the archive)
+
+    Raises:
+        ValidationError: If there are no files or too many
+    """
+    decoder = MultipartDecoder(boundary)
+    # (kind, value): ('xml', StreamingDocument, then its result) or ('zip', upload)
+    entries: List[List[Any]] = []
+    target: Any = None
+    zip_file: Any = None
+    file_count = 0
+    size = 0
+    start = time.perf_counter()
+
+    try:
+        while True:
+            chunk = stream.read(STREAM_READ_SIZE)
+            size += len(chunk)
+            decoder.receive_data(chunk or None)
+
+            event = decoder.next_event()
+            while not isinstance(event, (Epilogue, NeedData)):
+                if isinstance(event, File) and event.name == field and event.filename:
+                    file_count += 1
+                    if file_count > max_files:
+                        raise ValidationError(f"Too many files. Maximum allowed: {max_files}.")
+                    filename = sanitize_filename(event.filename)
+                    if filename.lower().endswith('.zip'):
+                        path = unique_path(upload_dir, filename)
+                        zip_file = open(path, 'wb')
+                        target = zip_file.write
+                        entries.append(['zip', {'path': path, 'filename': filename, 'kind': 'zip'}])
+                    else:
+                        document = StreamingDocument(filename, upload_dir, spill_threshold)
+                        target = document.feed
+                        entries.append(['xml', document])
+                elif isinstance(event, Data):
+                    if target is not None:
+                        target(event.data)
+                        if not event.more_data:
+                            _finish_part(entries[-1], zip_file)
+                            target = zip_file = None
+                else:
+                    # Other fields, and file inputs left empty
+                    target = None
+                event = decoder.next_event()
+
+            if not chunk:
+                break
+    finally:
+        if zip_file is not None:
+            zip_file.close()
+        # Parts cut short by an error or a truncated body
+        for entry in entries:
+            if isinstance(entry[1], StreamingDocument):
+                entry[1].discard()
+
+    observe_stage('upload', time.perf_counter() - start)
+    inc('fac2csv_bytes_processed_total', size, stage='upload')
+    validate_files_count(file_count)
+
+    results = _process_zip_parts(entries, mode, max_workers)
+    logger.info(f"Received {file_count} file(s), {size} bytes, as a stream")
+    return StreamedUpload(results, file_count)
+
+
+def _finish_part(entry: List[Any], zip_file: Any) -> None:
+    """Close the part that just ended; an XML part is replaced by its result."""
+    if entry[0] == 'zip':
+        zip_file.close()
+    else:
+        entry[1] = entry[1].close()
+
+
+def _process_zip_parts(
+    entries: List[List[Any]],
+    mode: Optional[str],
+    max_workers: Optional[int]
+) -> List[Dict[str, Any]]:
+    """Process the members of the ZIP parts and merge all results in upload order."""
+    def file_infos() -> Iterator[Dict[str, Any]]:
+        for kind, value in entries:
+            if kind == 'zip':
+                yield from iter_batch_files([value])
+            else:
+                yield {'result': value}
+
+    return list(iter_process_xml_files(file_infos(), mode=mode, max_workers=max_workers))
@@ -1,16 +1,33 @@
 """File management utilities."""
 
+import heapq
 import os
 import logging
+import re
+import shutil
+import threading
 import time
+import uuid
 import zipfile
-from typing import List
+import zlib
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
 from werkzeug.utils import secure_filename
 
+from utils.metrics import inc, stage_timer
+
 logger = logging.getLogger(__name__)
 
 # Cleanup threshold (in seconds)
-CLEANUP_AGE = 3600  # 1 hour
+CLEANUP_AGE = int(float(os.environ.get('CLEANUP_AFTER_HOURS', 1)) * 3600)
+
+# Seconds between two passes of the background sweeper
+CLEANUP_INTERVAL = int(os.environ.get('CLEANUP_INTERVAL_SECONDS', 300))
+
+# Files the sweeper never deletes
+_KEEP_FILES = ('.gitkeep',)
+
+# Batch ids are uuid4 hex strings
+_BATCH_ID = re.compile(r'^[0-9a-f]{32}$')
 
 
 def sanitize_filename(filename: str) -> str:
@@ -37,78 +54,259 @@ def ensure_directories(*directories: str) -> None:
             logger.info(f"Created directory: {directory}")
 
 
-def cleanup_old_files(directory: str, max_age_seconds: int = CLEANUP_AGE) -> int:
-    """Remove files older than specified age from directory.
+def new_batch_id() -> str:
+    """Return a new unique batch id."""
+    return uuid.uuid4().hex
+
+
+def is_valid_batch_id(batch_id: str) -> bool:
+    """Check that a value is a batch id, and therefore safe to use in a path."""
+    return bool(_BATCH_ID.match(batch_id or ''))
+
+
+def create_batch_dir(parent: str, batch_id: str) -> str:
+    """Create the working directory of a batch.
 
     Args:
-        directory: Directory to clean
-        max_age_seconds: Maximum file age in seconds (default: 1 hour)
+        parent: Base directory (uploads or outputs)
+        batch_id: Id from ``new_batch_id``
 
     Returns:
-        Number of files deleted
-    """
-    if not os.path.exists(directory):
-        return 0
+        Path of the new directory
 
-    deleted_count = 0
-    current_time = time.time()
-
-    try:
-        for filename in os.listdir(directory):
-            file_path = os.path.join(directory, filename)
+    Raises:
+        ValueError: If the batch id is not valid
+        FileExistsError: If the directory already exists
+    """
+    if not is_valid_batch_id(batch_id):
+        raise ValueError(f"Invalid batch id: {batch_id!r}")
+    path = os.path.join(parent, batch_id)
+    os.makedirs(path)
+    return path
 
-            # Skip directories and .gitkeep files
-            if os.path.isdir(file_path) or filename == '.gitkeep':
-                continue
 
-            # Check file age
-            file_age = current_time - os.path.getmtime(file_path)
+def batch_path(parent: str, batch_id: str, filename: str = '') -> str:
+    """Return the path of a batch directory, or of a file inside it.
 
-            if file_age > max_age_seconds:
-                try:
-                    os.remove(file_path)
-                    deleted_count += 1
-                    logger.info(f"Deleted old file: {file_path}")
-                except OSError as e:
-                    logger.error(f"Error deleting file {file_path}: {e}")
+    Raises:
+        ValueError: If the batch id is not valid
+    """
+    if not is_valid_batch_id(batch_id):
+        raise ValueError(f"Invalid batch id: {batch_id!r}")
+    if filename:
+        return os.path.join(parent, batch_id, sanitize_filename(filename))
+    return os.path.join(parent, batch_id)
 
-    except Exception as e:
-        logger.error(f"Error during cleanup of {directory}: {e}")
 
-    if deleted_count > 0:
-        logger.info(f"Cleaned up {deleted_count} old file(s) from {directory}")
+def remove_batch_dir(path: str) -> None:
+    """Delete a batch working directory and everything in it."""
+    try:
+        shutil.rmtree(path)
+        logger.debug(f"Deleted batch directory: {path}")
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        logger.error(f"Error deleting batch directory {path}: {e}")
 
-    return deleted_count
 
+def unique_path(directory: str, filename: str) -> str:
+    """Return a path for ``filename`` in ``directory`` that is not taken yet.
 
-def create_zip_archive(csv_files: List[str], output_path: str) -> str:
-    """Create a ZIP archive containing CSV files.
+    A second 'factura.xml' becomes 'factura_2.xml', and so on.
+    """
+    path = os.path.join(directory, filename)
+    stem, extension = os.path.splitext(filename)
+    number = 2
+    while os.path.exists(path):
+        path = os.path.join(directory, f"{stem}_{number}{extension}")
+        number += 1
+    return path
+
+
+def _path_size(path: str) -> int:
+    """Return the size of a file, or the total size of a directory tree."""
+    if not os.path.isdir(path):
+        return os.path.getsize(path)
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+
+class FileSweeper:
+    """Background thread deleting expired temporary files and directories.
+
+    Entries are kept in a heap ordered by modification time, so a pass only
+    looks at the entries that are due instead of listing the directories.
+    Files created by this process are added with ``track`` as they are
+    written; a full scan of the directories, at startup and then every
+    ``rescan_interval`` seconds, picks up leftovers from earlier runs and
+    files written by other processes.
 
     Args:
-        csv_files: List of CSV file paths to include
-        output_path: Path where ZIP file will be created
+        directories: Directories to keep clean (top-level entries only;
+            subdirectories are deleted as a whole)
+        max_age: Age in seconds after which an entry is deleted
+        interval: Seconds between two sweeps
+        rescan_interval: Seconds between two full scans (default: max_age)
+        in_use: Called with the path of an expired entry; entries for which
+            it returns True (e.g. the uploads of a queued job) are kept and
+            checked again after ``max_age``
+        on_sweep: Called with the cutoff time (now - ``max_age``) after
+            each sweep, e.g. to purge the records of expired batches
+    """
 
-    Returns:
-        Path to the created ZIP file
+    def __init__(
+        self,
+        directories: Iterable[str],
+        max_age: int = CLEANUP_AGE,
+        interval: int = CLEANUP_INTERVAL,
+        rescan_interval: Optional[int] = None,
+        in_use: Optional[Callable[[str], bool]] = None,
+        on_sweep: Optional[Callable[[float], Any]] = None
+    ):
+        self.directories = list(directories)
+        self.max_age = max_age
+        self.interval = interval
+        self.rescan_interval = rescan_interval or max_age
+        self.in_use = in_use
+        self.on_sweep = on_sweep
+        self._heap: List[Tuple[float, str]] = []
+        self._tracked: Dict[str, float] = {}
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._last_scan = 0.0
+
+    def start(self) -> None:
+        """Start the sweeper thread (only the first call has an effect)."""
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name='fac2csv-sweeper', daemon=True)
+            self._thread.start()
+        logger.info(
+            f"Started file sweeper for {', '.join(self.directories)} "
+            f"(max age {self.max_age}s, every {self.interval}s)"
+        )
+
+    def track(self, path: str, mtime: Optional[float] = None) -> None:
+        """Add a file or directory to the index.
+
+        Args:
+            path: Path inside one of the swept directories
+            mtime: Modification time (default: now)
+        """
+        mtime = time.time() if mtime is None else mtime
+        with self._lock:
+            if self._tracked.get(path) == mtime:
+                return
+            self._tracked[path] = mtime
+            heapq.heappush(self._heap, (mtime, path))
+
+    def scan(self) -> int:
+        """Add every entry of the swept directories to the index.
+
+        Returns:
+            Number of entries found
+        """
+        found = 0
+        for directory in self.directories:
+            try:
+                with os.scandir(directory) as entries:
+                    for entry in entries:
+                        if entry.name in _KEEP_FILES:
+                            continue
+                        try:
+                            self.track(entry.path, entry.stat().st_mtime)
+                            found += 1
+                        except OSError:
+                            pass
+            except OSError as e:
+                logger.error(f"Error scanning {directory}: {e}")
+        self._last_scan = time.time()
+        return found
+
+    def sweep(self, now: Optional[float] = None) -> Tuple[int, int]:
+        """Delete the indexed entries older than ``max_age``.
+
+        Returns:
+            Tuple of (entries deleted, bytes reclaimed)
+        """
+        now = time.time() if now is None else now
+        cutoff = now - self.max_age
+        deleted_count = 0
+        deleted_bytes = 0
+
+        with stage_timer('cleanup'):
+            while True:
+                with self._lock:
+                    if not self._heap or self._heap[0][0] > cutoff:
+                        break
+                    mtime, path = heapq.heappop(self._heap)
+                    if self._tracked.get(path) != mtime:
+                        # Superseded by a newer entry for the same path
+                        continue
+                    del self._tracked[path]
 
-    Raises:
-        IOError: If ZIP creation fails
-    """
-    try:
-        with zipfile.ZipFile(output_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
-            for csv_file in csv_files:
-                if os.path.exists(csv_file):
-                    # Add file with just its basename (no path)
-                    zipf.write(csv_file, os.path.basename(csv_file))
-                else:
-                    logger.warning(f"CSV file not found, skipping: {csv_file}")
+                try:
+                    current_mtime = os.path.getmtime(path)
+                    if current_mtime > mtime:
+                        # Modified since it was indexed: check again later
+                        self.track(path, current_mtime)
+                        continue
+                    if self._in_use(path):
+                        self.track(path, now)
+                        continue
+                    size = _path_size(path)
+                    if os.path.isdir(path):
+                        shutil.rmtree(path)
+                    else:
+                        os.remove(path)
+                    deleted_count += 1
+                    deleted_bytes += size
+                    logger.info(f"Deleted old file: {path}")
+                except FileNotFoundError:
+                    # Already deleted (by the app or another process)
+                    pass
+                except OSError as e:
+                    logger.error(f"Error deleting file {path}: {e}")
 
-        logger.info(f"Created ZIP archive: {output_path}")
-        return output_path
+            if self.on_sweep is not None:
+                try:
+                    self.on_sweep(cutoff)
+                except Exception as e:
+                    logger.error(f"Error after sweeping: {e}")
+
+        inc('fac2csv_files_removed_total', deleted_count)
+        inc('fac2csv_bytes_removed_total', deleted_bytes)
+        if deleted_count > 0:
+            logger.info(f"Cleaned up {deleted_count} old file(s), {deleted_bytes} bytes")
+        return deleted_count, deleted_bytes
+
+    def _in_use(self, path: str) -> bool:
+        """Return whether an expired entry must be kept; errors keep it too."""
+        if self.in_use is None:
+            return False
+        try:
+            return self.in_use(path)
+        except Exception as e:
+            logger.error(f"Error checking whether {path} is in use: {e}")
+            return True
 
-    except Exception as e:
-        logger.error(f"Error creating ZIP archive: {e}")
-        raise IOError(f"Failed to create ZIP archive: {e}")
+    def _run(self) -> None:
+        """Thread body: scan when due, sweep, sleep."""
+        while True:
+            try:
+                if time.time() - self._last_scan >= self.rescan_interval:
+                    self.scan()
+                self.sweep()
+            except Exception as e:
+                logger.error(f"File sweeper error: {e}")
+            time.sleep(self.interval)
 
 
 def delete_file(file_path: str) -> bool:
@@ -131,63 +329,55 @@ def delete_file(file_path: str) -> bool:
         return False
 
 
-def extract_xml_from_zip(zip_path: str, extract_to: str) -> List[str]:
-    """Extract XML files from a ZIP archive.
+def list_zip_xml_members(zipf: zipfile.ZipFile) -> List[zipfile.ZipInfo]:
+    """List the XML members of an open ZIP archive.
+
+    Directories and macOS metadata (``__MACOSX/``) are skipped.
 
     Args:
-        zip_path: Path to ZIP file
-        extract_to: Directory to extract files to
+        zipf: Open ZIP archive
 
     Returns:
-        List of paths to extracted XML files
-
-    Raises:
-        IOError: If extraction fails or no XML files found
+        ZipInfo entries of the XML files, in archive order
     """
-    extracted_files = []
+    return [
+        info for info in zipf.infolist()
+        if not info.is_dir()
+        and info.filename.lower().endswith('.xml')
+        and not info.filename.startswith('__MACOSX/')
+    ]
 
-    try:
-        # Ensure extraction directory exists
-        ensure_directories(extract_to)
-
-        with zipfile.ZipFile(zip_path, 'r') as zipf:
-            # Get list of XML files in the archive
-            xml_files = [f for f in zipf.namelist() if f.lower().endswith('.xml') and not f.startswith('__MACOSX/')]
-
-            if not xml_files:
-                raise IOError("No XML files found in ZIP archive")
 
-            # Extract only XML files
-            for xml_file in xml_files:
-                # Skip directories
-                if xml_file.endswith('/'):
-                    continue
+def read_zip_member(zipf: zipfile.ZipFile, info: zipfile.ZipInfo, max_size: int) -> bytes:
+    """Decompress a ZIP member into memory, reading at most ``max_size`` bytes.
 
-                # Extract file
-                extracted_path = zipf.extract(xml_file, extract_to)
+    The size declared in the archive is not trusted: decompression stops as
+    soon as the limit is exceeded, so a corrupt or malicious member cannot
+    use more than ``max_size`` bytes of memory.
 
-                # If file was in subdirectory, move it to root of extract_to
-                if os.path.dirname(xml_file):
-                    base_name = os.path.basename(xml_file)
-                    new_path = os.path.join(extract_to, sanitize_filename(base_name))
-
-                    # Move file to root directory
-                    if extracted_path != new_path:
-                        os.rename(extracted_path, new_path)
-                        extracted_path = new_path
-
-                extracted_files.append(extracted_path)
-                logger.info(f"Extracted XML file: {os.path.basename(extracted_path)}")
+    Args:
+        zipf: Open ZIP archive
+        info: Member to read
+        max_size: Maximum uncompressed size in bytes
 
-        logger.info(f"Extracted {len(extracted_files)} XML file(s) from {os.path.basename(zip_path)}")
-        return extracted_files
+    Returns:
+        Uncompressed member content
 
-    except zipfile.BadZipFile:
-        logger.error(f"Invalid ZIP file: {zip_path}")
-        raise IOError("Invalid ZIP file format")
-    except Exception as e:
-        logger.error(f"Error extracting ZIP file {zip_path}: {e}")
-        raise IOError(f"Failed to extract ZIP file: {e}")
+    Raises:
+        IOError: If the member is larger than ``max_size`` or cannot be read
+    """
+    try:
+        with zipf.open(info) as member:
+            data = member.read(max_size + 1)
+    except (zipfile.BadZipFile, RuntimeError, OSError, EOFError, NotImplementedError, zlib.error) as e:
+        # RuntimeError: encrypted member; NotImplementedError: unsupported
+        # compression method; zlib.error/EOFError: corrupt or truncated data
+        raise IOError(f"Failed to read {info.filename} from ZIP archive: {e}")
+
+    if len(data) > max_size:
+        raise IOError(f"File size exceeds maximum allowed ({max_size} bytes).")
+    inc('fac2csv_bytes_processed_total', len(data), stage='zip_read')
+    return data
 
 
 def get_file_info(file_path: str) -> dict:
@@ -0,0 +1,400 @@
+"""Lightweight metrics: stage timings and counters in Prometheus text format.
+
+Each process keeps its counters and stage-duration histograms in memory
+and periodically writes them to its own file in METRICS_DIR (gunicorn
+workers, job workers and processing pool workers all record their share).
+``render_metrics`` adds up the files of every process, so the /metrics
+endpoint reports the whole deployment whichever worker serves it. Files
+are only written when METRICS_DIR exists (the web application creates
+it), so command-line runs leave no files behind. Live processes refresh
+their file every few seconds; the file of a process that stopped doing so
+is folded into the file of the process serving /metrics, so the totals
+keep counting it while the number of files stays bounded.
+
+When METRICS_ENABLED is off, ``stage_timer`` returns a shared no-op
+context manager and the other functions return immediately, so the
+instrumented code pays one flag check per call.
+"""
+
+import atexit
+import bisect
+import glob
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from contextlib import nullcontext
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Configuration, overridable from the environment
+METRICS_ENABLED = os.environ.get('METRICS_ENABLED', '1').lower() not in ('0', 'false', 'no')
+METRICS_DIR = os.environ.get('METRICS_DIR', 'metrics')
+METRICS_FLUSH_INTERVAL = float(os.environ.get('METRICS_FLUSH_INTERVAL', 2.0))
+# Files not refreshed for this long belong to processes that ended
+METRICS_STALE_SECONDS = float(os.environ.get('METRICS_STALE_SECONDS', 300))
+
+# Upper bounds (seconds) of the stage duration histogram buckets
+STAGE_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 120.0)
+
+STAGE_METRIC = 'fac2csv_stage_duration_seconds'
+
+# Help text of the metrics, also the list of known counter names
+METRIC_HELP = {
+    STAGE_METRIC: 'Time spent per processing stage',
+    'fac2csv_bytes_processed_total': 'Bytes handled per processing stage',
+    'fac2csv_invoices_total': 'Invoices extracted',
+    'fac2csv_lines_total': 'Invoice line items extracted',
+    'fac2csv_documents_total': 'Documents processed, by outcome',
+    'fac2csv_payload_bytes_copied_total': 'Embedded invoice bytes copied before parsing',
+    'fac2csv_parse_fallbacks_total': 'Field lookups that fell back to a whole-document search',
+    'fac2csv_parse_cache_lookups_total': 'Parse cache lookups, by result (hit or miss)',
+    'fac2csv_files_removed_total': 'Temporary files deleted by the cleanup',
+    'fac2csv_bytes_removed_total': 'Bytes of temporary files deleted by the cleanup',
+    'fac2csv_jobs_total': 'Background jobs finished, by status',
+}
+
+_NULL_TIMER = nullcontext()
+
+# Label sets are stored as sorted tuples of (name, value) pairs
+_LabelKey = Tuple[Tuple[str, str], ...]
+
+
+class _Histogram:
+    """Bucket counts, sum and count of one stage."""
+
+    __slots__ = ('buckets', 'sum', 'count')
+
+    def __init__(self):
+        self.buckets = [0] * len(STAGE_BUCKETS)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        index = bisect.bisect_left(STAGE_BUCKETS, value)
+        if index < len(STAGE_BUCKETS):
+            self.buckets[index] += 1
+        self.sum += value
+        self.count += 1
+
+
+class _Registry:
+    """Metrics of this process and the file they are saved to."""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.lock = threading.Lock()
+        self.counters: Dict[Tuple[str, _LabelKey], float] = {}
+        self.stages: Dict[str, _Histogram] = {}
+        self.dirty = False
+        self.written = False
+        self.pid = None
+        self.path = None
+        self.flusher = None
+
+    def _ensure_process(self) -> None:
+        """Start over with empty metrics and a new file after a fork."""
+        pid = os.getpid()
+        if self.pid == pid:
+            return
+        self.pid = pid
+        self.counters = {}
+        self.stages = {}
+        self.written = False
+        # A random suffix keeps a reused pid from overwriting a dead process's file
+        self.path = os.path.join(self.directory, f"metrics_{pid}_{uuid.uuid4().hex[:8]}.json")
+        self.flusher = threading.Thread(target=self._flush_loop, name='fac2csv-metrics', daemon=True)
+        self.flusher.start()
+
+    def inc(self, name: str, value: float, labels: _LabelKey) -> None:
+        with self.lock:
+            self._ensure_process()
+            key = (name, labels)
+            self.counters[key] = self.counters.get(key, 0) + value
+            self.dirty = True
+
+    def observe(self, stage: str, seconds: float) -> None:
+        with self.lock:
+            self._ensure_process()
+            histogram = self.stages.get(stage)
+            if histogram is None:
+                histogram = self.stages[stage] = _Histogram()
+            histogram.observe(seconds)
+            self.dirty = True
+
+    def merge(self, data: Dict[str, Any]) -> None:
+        """Add the metrics saved by another process to this process's."""
+        with self.lock:
+            self._ensure_process()
+            for name, labels, value in data.get('counters', []):
+                key = (name, _label_key(labels))
+                self.counters[key] = self.counters.get(key, 0) + value
+            for stage, saved in data.get('stages', {}).items():
+                if len(saved['buckets']) != len(STAGE_BUCKETS):
+                    continue
+                histogram = self.stages.get(stage)
+                if histogram is None:
+                    histogram = self.stages[stage] = _Histogram()
+                histogram.buckets = [a + b for a, b in zip(histogram.buckets, saved['buckets'])]
+                histogram.sum += saved['sum']
+                histogram.count += saved['count']
+            self.dirty = True
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            'counters': [[name, dict(labels), value] for (name, labels), value in self.counters.items()],
+            'stages': {
+                stage: {'buckets': histogram.buckets, 'sum': histogram.sum, 'count': histogram.count}
+                for stage, histogram in self.stages.items()
+            }
+        }
+
+    def flush(self) -> None:
+        """Write this process's metrics to its file, or refresh it if nothing changed."""
+        with self.lock:
+            if self.pid != os.getpid():
+                return
+            path = self.path
+            if self.written and not os.path.exists(path):
+                # Taken for a dead process's file and folded by another
+                # process: those counts are in its file now
+                logger.warning(f"Metrics file {path} was folded by another process, starting over")
+                self.counters = {}
+                self.stages = {}
+                self.written = False
+                self.dirty = False
+            if not self.dirty:
+                data = None
+            elif os.path.isdir(self.directory):
+                data = json.dumps(self.snapshot())
+                self.dirty = False
+            else:
+                # No metrics directory (e.g. a command-line run): keep them in memory
+                return
+
+        try:
+            if data is None:
+                if self.written:
+                    os.utime(path)
+                return
+            temp_path = f"{path}.tmp"
+            with open(temp_path, 'w', encoding='utf-8') as metrics_file:
+                metrics_file.write(data)
+            os.replace(temp_path, path)
+            self.written = True
+        except OSError as e:
+            logger.warning(f"Could not write metrics to {path}: {e}")
+
+    def _flush_loop(self) -> None:
+        while True:
+            time.sleep(METRICS_FLUSH_INTERVAL)
+            self.flush()
+
+
+_registry = _Registry(METRICS_DIR)
+atexit.register(_registry.flush)
+
+
+def _label_key(labels: Dict[str, Any]) -> _LabelKey:
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+def inc(name: str, value: float = 1, **labels: Any) -> None:
+    """Add to a counter.
+
+    Args:
+        name: Metric name (one of METRIC_HELP)
+        value: Amount to add
+        **labels: Label values
+    """
+    if not METRICS_ENABLED or not value:
+        return
+    _registry.inc(name, value, _label_key(labels))
+
+
+def observe_stage(stage: str, seconds: float) -> None:
+    """Record the duration of a processing stage."""
+    if not METRICS_ENABLED:
+        return
+    _registry.observe(stage, seconds)
+
+
+class _StageTimer:
+    """Context manager recording the time spent in its block."""
+
+    __slots__ = ('stage', 'start')
+
+    def __init__(self, stage: str):
+        self.stage = stage
+
+    def __enter__(self) -> '_StageTimer':
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        _registry.observe(self.stage, time.perf_counter() - self.start)
+
+
+def stage_timer(stage: str):
+    """Time a block of code as a processing stage.
+
+    Usage::
+
+        with stage_timer('parse'):
+            ...
+
+    Args:
+        stage: Stage name (the ``stage`` label of the histogram)
+
+    Returns:
+        Context manager (a no-op when metrics are disabled)
+    """
+    if not METRICS_ENABLED:
+        return _NULL_TIMER
+    return _StageTimer(stage)
+
+
+def flush_metrics() -> None:
+    """Write this process's metrics to disk now."""
+    if METRICS_ENABLED:
+        _registry.flush()
+
+
+def _fold_stale_files(directory: str) -> int:
+    """Move the metrics of processes that ended into this process's file.
+
+    A file not refreshed for METRICS_STALE_SECONDS is renamed first, so
+    only one of the processes serving /metrics folds it.
+
+    Returns:
+        Number of files folded
+    """
+    cutoff = time.time() - METRICS_STALE_SECONDS
+    folded = 0
+    for path in glob.glob(os.path.join(directory, 'metrics_*.json')):
+        if path == _registry.path:
+            continue
+        claimed = f"{path}.fold-{os.getpid()}"
+        try:
+            if os.path.getmtime(path) >= cutoff:
+                continue
+            os.rename(path, claimed)
+        except OSError:
+            # Refreshed, or already folded by another process
+            continue
+        try:
+            with open(claimed, 'r', encoding='utf-8') as metrics_file:
+                _registry.merge(json.load(metrics_file))
+            folded += 1
+        except (OSError, ValueError) as e:
+            logger.debug(f"Dropping unreadable metrics file {path}: {e}")
+        try:
+            os.remove(claimed)
+        except OSError as e:
+            logger.warning(f"Could not remove folded metrics file {claimed}: {e}")
+    if folded:
+        logger.info(f"Folded the metrics of {folded} ended process(es)")
+    return folded
+
+
+def _read_process_files(directory: str) -> Iterable[Dict[str, Any]]:
+    for path in glob.glob(os.path.join(directory, 'metrics_*.json')):
+        try:
+            with open(path, 'r', encoding='utf-8') as metrics_file:
+                yield json.load(metrics_file)
+        except (OSError, ValueError) as e:
+            # Being replaced right now, or left truncated by a crash
+            logger.debug(f"Skipping metrics file {path}: {e}")
+
+
+def collect_metrics(directory: Optional[str] = None) -> Dict[str, Any]:
+    """Add up the metrics of every process.
+
+    Args:
+        directory: Metrics directory (default: METRICS_DIR)
+
+    Returns:
+        Dictionary with ``counters`` ({(name, labels): value}) and ``stages``
+        ({stage: {'buckets', 'sum', 'count'}})
+    """
+    directory = directory or METRICS_DIR
+    if METRICS_ENABLED and directory == _registry.directory:
+        _fold_stale_files(directory)
+    flush_metrics()
+    counters: Dict[Tuple[str, _LabelKey], float] = {}
+    stages: Dict[str, Dict[str, Any]] = {}
+
+    for data in _read_process_files(directory):
+        for name, labels, value in data.get('counters', []):
+            key = (name, _label_key(labels))
+            counters[key] = counters.get(key, 0) + value
+        for stage, histogram in data.get('stages', {}).items():
+            total = stages.setdefault(stage, {'buckets': [0] * len(STAGE_BUCKETS), 'sum': 0.0, 'count': 0})
+            if len(histogram['buckets']) != len(STAGE_BUCKETS):
+                continue
+            total['buckets'] = [a + b for a, b in zip(total['buckets'], histogram['buckets'])]
+            total['sum'] += histogram['sum']
+            total['count'] += histogram['count']
+
+    return {'counters': counters, 'stages': stages}
+
+
+def _format_labels(labels: Iterable[Tuple[str, str]]) -> str:
+    pairs = [
+        '{}="{}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for name, value in labels
+    ]
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+def render_metrics(gauges: Optional[List[Tuple[str, str, float]]] = None, directory: Optional[str] = None) -> str:
+    """Render the metrics of every process in the Prometheus text format.
+
+    Args:
+        gauges: Extra point-in-time values as (name, help, value) tuples
+        directory: Metrics directory (default: METRICS_DIR)
+
+    Returns:
+        Exposition text (version 0.0.4)
+    """
+    data = collect_metrics(directory)
+    output = []
+
+    if data['stages']:
+        output.append(f"# HELP {STAGE_METRIC} {METRIC_HELP[STAGE_METRIC]}")
+        output.append(f"# TYPE {STAGE_METRIC} histogram")
+        for stage in sorted(data['stages']):
+            histogram = data['stages'][stage]
+            cumulative = 0
+            for bound, count in zip(STAGE_BUCKETS, histogram['buckets']):
+                cumulative += count
+                labels = _format_labels([('stage', stage), ('le', repr(bound))])
+                output.append(f"{STAGE_METRIC}_bucket{labels} {cumulative}")
+            labels = _format_labels([('stage', stage), ('le', '+Inf')])
+            output.append(f"{STAGE_METRIC}_bucket{labels} {histogram['count']}")
+            labels = _format_labels([('stage', stage)])
+            output.append(f"{STAGE_METRIC}_sum{labels} {_format_value(histogram['sum'])}")
+            output.append(f"{STAGE_METRIC}_count{labels} {histogram['count']}")
+
+    by_name: Dict[str, List[Tuple[_LabelKey, float]]] = {}
+    for (name, labels), value in data['counters'].items():
+        by_name.setdefault(name, []).append((labels, value))
+    for name in sorted(by_name):
+        output.append(f"# HELP {name} {METRIC_HELP.get(name, name)}")
+        output.append(f"# TYPE {name} counter")
+        for labels, value in sorted(by_name[name]):
+            output.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+
+    for name, help_text, value in gauges or ():
+        output.append(f"# HELP {name} {help_text}")
+        output.append(f"# TYPE {name} gauge")
+        output.append(f"{name} {_format_value(value)}")
+
+    return '\n'.join(output) + '\n'
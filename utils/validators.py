@@ -2,15 +2,32 @@
 
 import os
 import logging
-from typing import Tuple
+from typing import NamedTuple, Optional
 from lxml import etree as ET
 
+from utils.metrics import inc, stage_timer
+
 logger = logging.getLogger(__name__)
 
-# File constraints
+# File constraints. MAX_FILE_SIZE applies to each XML document (uploaded or
+# inside a ZIP); batches are processed with bounded memory, so the number
+# of files per batch can be large
 MAX_FILE_SIZE = 10 * 1024 * 1024  # 10MB in bytes
 ALLOWED_EXTENSIONS = ['.xml', '.zip']
-MAX_FILES = 50
+MAX_FILES = int(os.environ.get('MAX_FILES', 5000))
+
+# Bytes read from the start of a document to identify it before a full parse
+SNIFF_BYTES = 4096
+_SNIFF_CHUNK_SIZE = 1024
+
+# Root elements of the UBL documents accepted for conversion
+UBL_DOCUMENT_TYPES = ('Invoice', 'CreditNote', 'DebitNote', 'AttachedDocument')
+
+# Namespace prefixes that identify a UBL document
+UBL_NAMESPACES = (
+    'urn:oasis:names:specification:ubl:schema:xsd',
+    'urn:oasis:names:specification:ubl'
+)
 
 
 class ValidationError(Exception):
@@ -18,6 +35,12 @@ class ValidationError(Exception):
     pass
 
 
+class DocumentType(NamedTuple):
+    """Root element of a document, as identified by ``sniff_xml_bytes``."""
+    name: str
+    namespace: str
+
+
 def validate_file_extension(filename: str) -> bool:
     """Validate that file has .xml or .zip extension.
 
@@ -35,6 +58,25 @@ def validate_file_extension(filename: str) -> bool:
     return True
 
 
+def validate_content_size(size: int) -> bool:
+    """Validate that a document size is within limits.
+
+    Args:
+        size: Size of the document in bytes
+
+    Returns:
+        True if the size is valid
+
+    Raises:
+        ValidationError: If size exceeds limit or the document is empty
+    """
+    if size > MAX_FILE_SIZE:
+        raise ValidationError(f"File size ({size} bytes) exceeds maximum allowed ({MAX_FILE_SIZE} bytes).")
+    if size == 0:
+        raise ValidationError("File is empty.")
+    return True
+
+
 def validate_file_size(file_path: str) -> bool:
     """Validate that file size is within limits.
 
@@ -48,42 +90,60 @@ def validate_file_size(file_path: str) -> bool:
         ValidationError: If file size exceeds limit
     """
     try:
-        file_size = os.path.getsize(file_path)
-        if file_size > MAX_FILE_SIZE:
-            raise ValidationError(f"File size ({file_size} bytes) exceeds maximum allowed ({MAX_FILE_SIZE} bytes).")
-        if file_size == 0:
-            raise ValidationError("File is empty.")
-        return True
+        return validate_content_size(os.path.getsize(file_path))
     except OSError as e:
         raise ValidationError(f"Error checking file size: {e}")
 
 
-def validate_xml_wellformed(file_path: str) -> bool:
-    """Validate that XML file is well-formed.
+def parse_xml_document(file_path: str) -> ET._Element:
+    """Parse an XML file once and return its root element.
+
+    The returned root can be passed to ``validate_ubl_root`` and to the
+    invoice extractor, so the document is not parsed again.
 
     Args:
         file_path: Path to the XML file
 
     Returns:
-        True if XML is well-formed
+        Root element of the parsed document
 
     Raises:
         ValidationError: If XML is malformed
     """
     try:
-        ET.parse(file_path)
-        return True
+        return ET.parse(file_path).getroot()
     except ET.XMLSyntaxError as e:
         raise ValidationError(f"XML syntax error: {e}")
     except Exception as e:
         raise ValidationError(f"Error parsing XML: {e}")
 
 
-def validate_ubl_namespace(file_path: str) -> bool:
-    """Validate that XML contains UBL 2.1 namespace.
+def parse_xml_bytes(data: bytes, source: str = 'document') -> ET._Element:
+    """Parse an in-memory XML document and return its root element.
 
     Args:
-        file_path: Path to the XML file
+        data: Raw XML bytes
+        source: Name of the document, used in parser error messages
+
+    Returns:
+        Root element of the parsed document
+
+    Raises:
+        ValidationError: If XML is malformed
+    """
+    try:
+        return ET.fromstring(data, base_url=source)
+    except ET.XMLSyntaxError as e:
+        raise ValidationError(f"XML syntax error: {e}")
+    except Exception as e:
+        raise ValidationError(f"Error parsing XML: {e}")
+
+
+def validate_ubl_root(root: ET._Element) -> bool:
+    """Validate that a parsed document root uses a UBL 2.1 namespace.
+
+    Args:
+        root: Root element of the parsed XML document
 
     Returns:
         True if UBL namespace is present
@@ -91,55 +151,171 @@ def validate_ubl_namespace(file_path: str) -> bool:
     Raises:
         ValidationError: If UBL namespace not found
     """
-    try:
-        tree = ET.parse(file_path)
-        root = tree.getroot()
+    if not _is_ubl_namespace(ET.QName(root).namespace or ''):
+        raise ValidationError("File does not appear to be a UBL 2.1 document.")
+
+    return True
+
 
-        # Check for UBL namespaces
-        ubl_namespaces = [
-            'urn:oasis:names:specification:ubl:schema:xsd',
-            'urn:oasis:names:specification:ubl'
-        ]
+def _is_ubl_namespace(namespace: str) -> bool:
+    """Check whether a namespace URI belongs to UBL."""
+    return any(ubl_ns in namespace for ubl_ns in UBL_NAMESPACES)
 
-        root_namespace = root.tag.split('}')[0].strip('{') if '}' in root.tag else ''
 
-        if not any(ubl_ns in root_namespace for ubl_ns in ubl_namespaces):
-            raise ValidationError("File does not appear to be a UBL 2.1 document.")
+def sniff_xml_bytes(data: bytes) -> Optional[DocumentType]:
+    """Identify a document from its first bytes, without parsing all of it.
 
-        return True
+    Feeds at most SNIFF_BYTES to an incremental parser and stops at the
+    root start tag, so junk uploads are rejected before the document is
+    parsed (or even read) in full.
+
+    Args:
+        data: Start of the document (any length; only SNIFF_BYTES are used)
+
+    Returns:
+        Type of the document, or None if the root element does not start
+        within SNIFF_BYTES (left to the full parse)
+
+    Raises:
+        ValidationError: If the start of the document is not XML, or the
+            root is not one of UBL_DOCUMENT_TYPES in a UBL namespace
+    """
+    parser = ET.XMLPullParser(events=('start',), resolve_entities=False)
+    root = None
+    try:
+        # Small pieces, so parsing stops soon after the root start tag
+        for offset in range(0, min(len(data), SNIFF_BYTES), _SNIFF_CHUNK_SIZE):
+            parser.feed(bytes(data[offset:offset + _SNIFF_CHUNK_SIZE]))
+            root = next((elem for _, elem in parser.read_events()), None)
+            if root is not None:
+                break
     except ET.XMLSyntaxError as e:
         raise ValidationError(f"XML syntax error: {e}")
+
+    if root is None:
+        return None
+
+    tag = ET.QName(root)
+    if not _is_ubl_namespace(tag.namespace or ''):
+        raise ValidationError("File does not appear to be a UBL 2.1 document.")
+    if tag.localname not in UBL_DOCUMENT_TYPES:
+        raise ValidationError(f"Unsupported UBL document type: {tag.localname}.")
+    return DocumentType(tag.localname, tag.namespace)
+
+
+def sniff_xml_file(file_path: str) -> Optional[DocumentType]:
+    """Identify an XML file from its first bytes (see ``sniff_xml_bytes``).
+
+    Raises:
+        ValidationError: If the file is not a supported UBL document or
+            cannot be read
+    """
+    try:
+        with open(file_path, 'rb') as xml_file:
+            head = xml_file.read(SNIFF_BYTES)
+    except OSError as e:
+        raise ValidationError(f"Error reading file: {e}")
+    return sniff_xml_bytes(head)
+
+
+def validate_xml_wellformed(file_path: str) -> bool:
+    """Validate that XML file is well-formed.
+
+    Args:
+        file_path: Path to the XML file
+
+    Returns:
+        True if XML is well-formed
+
+    Raises:
+        ValidationError: If XML is malformed
+    """
+    parse_xml_document(file_path)
+    return True
+
+
+def validate_ubl_namespace(file_path: str) -> bool:
+    """Validate that XML contains UBL 2.1 namespace.
+
+    Only the start of the file is read (see ``sniff_xml_file``); the full
+    document is parsed only when its root element lies beyond it.
+
+    Args:
+        file_path: Path to the XML file
+
+    Returns:
+        True if UBL namespace is present
+
+    Raises:
+        ValidationError: If UBL namespace not found
+    """
+    try:
+        if sniff_xml_file(file_path) is not None:
+            return True
+        return validate_ubl_root(parse_xml_document(file_path))
     except ValidationError:
         raise
     except Exception as e:
         raise ValidationError(f"Error validating namespace: {e}")
 
 
-def validate_file(file_path: str, filename: str) -> Tuple[bool, str]:
-    """Run all validations on a file.
+def validate_xml_bytes(data: bytes, filename: str, check_extension: bool = True, sniff: bool = True) -> ET._Element:
+    """Run all validations on an in-memory document, parsing it only once.
 
     Args:
-        file_path: Path to the file
+        data: Raw XML bytes
         filename: Original filename
+        check_extension: Whether to validate the file extension (files
+            extracted from a ZIP archive skip this check)
+        sniff: Whether to identify the document from its first bytes
+            before the full parse (False when the caller already did)
 
     Returns:
-        Tuple of (is_valid, error_message). error_message is empty if valid.
+        Root element of the parsed document, ready for extraction
+
+    Raises:
+        ValidationError: If any validation fails
     """
-    try:
-        validate_file_extension(filename)
-        validate_file_size(file_path)
-        validate_xml_wellformed(file_path)
-        validate_ubl_namespace(file_path)
+    with stage_timer('validate'):
+        if check_extension:
+            validate_file_extension(filename)
+        validate_content_size(len(data))
+        if sniff:
+            sniff_xml_bytes(data)
+        root = parse_xml_bytes(data, filename)
+        validate_ubl_root(root)
+    inc('fac2csv_bytes_processed_total', len(data), stage='validate')
+    return root
 
-        logger.info(f"File validated successfully: {filename}")
-        return (True, "")
 
-    except ValidationError as e:
-        logger.warning(f"Validation failed for {filename}: {e}")
-        return (False, str(e))
-    except Exception as e:
-        logger.error(f"Unexpected validation error for {filename}: {e}")
-        return (False, f"Unexpected error: {e}")
+def read_document(file_path: str, filename: str, check_extension: bool = True) -> bytes:
+    """Check the extension, size and type of a file and read its content.
+
+    The type is sniffed from the start of the file (see
+    ``sniff_xml_bytes``) before the rest is read.
+
+    Args:
+        file_path: Path to the file
+        filename: Original filename
+        check_extension: Whether to validate the file extension
+
+    Returns:
+        Raw file bytes (not yet parsed; see ``validate_xml_bytes``)
+
+    Raises:
+        ValidationError: If the extension, size or document type is invalid
+            or the file cannot be read
+    """
+    if check_extension:
+        validate_file_extension(filename)
+    validate_file_size(file_path)
+    try:
+        with open(file_path, 'rb') as xml_file:
+            sniff_xml_bytes(xml_file.read(SNIFF_BYTES))
+            xml_file.seek(0)
+            return xml_file.read()
+    except OSError as e:
+        raise ValidationError(f"Error reading file: {e}")
 
 
 def validate_files_count(count: int) -> bool:
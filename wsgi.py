@@ -1,6 +1,8 @@
 """WSGI entry point for production deployment."""
 
-from app import app
+from app import app, start_background_services
+
+start_background_services()
 
 if __name__ == "__main__":
     app.run()
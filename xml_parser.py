@@ -1,9 +1,16 @@
 """XML Parser for DIAN electronic invoices (UBL 2.1 format)."""
 
+import itertools
 import logging
-from typing import Dict, List, Any
+import re
+from collections.abc import MutableMapping
+from xml.parsers import expat
+from typing import Dict, List, Any, Iterator, NamedTuple, Optional, Tuple, Union
 from lxml import etree as ET
 
+from models import Invoice, InvoiceLine
+from utils.metrics import inc, stage_timer
+
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -20,97 +27,581 @@ NAMESPACES = {
     'attached': 'urn:oasis:names:specification:ubl:schema:xsd:AttachedDocument-2'
 }
 
+# Version of the extraction rules. Bump it whenever a change here alters
+# the extracted values, so cached parse results are invalidated.
+PARSER_VERSION = '2'
+
 
 class ParseError(Exception):
     """Custom exception for XML parsing errors."""
     pass
 
 
-def extract_embedded_invoice(xml_path: str) -> ET._Element:
-    """Extract the embedded Invoice XML from AttachedDocument wrapper.
+# A CDATA section opening right after the Description start tag, and the
+# closing tag that must follow the section for the slice to be the payload
+_CDATA_OPEN = re.compile(rb'\s*<!\[CDATA\[\s*')
+_CLOSING_TAG = re.compile(rb'\s*</')
+
+# Characters of the payload compared with the element text before slicing
+CDATA_CHECK_CHARS = 64
+
+# Bytes that do not add a character to the parsed text: UTF-8 continuation
+# bytes, and the \r of a \r\n line break (normalized to \n by the parser)
+_NON_CHARACTER_BYTES = re.compile(rb'[\x80-\xbf]+|\r(?=\n)')
+
+
+def _find_description(root: ET._Element) -> Optional[ET._Element]:
+    """Return the AttachedDocument element that carries the invoice payload."""
+    # Look for the CDATA content in cac:Attachment/cac:ExternalReference/cbc:Description
+    return root.find('.//cac:ExternalReference/cbc:Description', NAMESPACES)
+
+
+def _line_offset(data: bytes, line: int) -> int:
+    """Return the byte offset where a 1-based line starts, or -1."""
+    offset = 0
+    for _ in range(line - 1):
+        offset = data.find(b'\n', offset) + 1
+        if offset == 0:
+            return -1
+    return offset
 
-    DIAN invoices may come wrapped in an AttachedDocument with the actual
-    invoice embedded in a CDATA section within cac:Attachment.
+
+def _find_start_tag(data: bytes, element: ET._Element, offset: int, skip: int = 0) -> int:
+    """Return the offset of a start tag of ``element`` at or after ``offset``, or -1.
+
+    The first ``skip`` matching start tags are passed over.
+    """
+    local_name = ET.QName(element).localname
+    qname = f"{element.prefix}:{local_name}" if element.prefix else local_name
+    start_tag = b'<' + qname.encode('ascii')
+    start = data.find(start_tag, offset)
+    while start >= 0:
+        # Skip longer names sharing the prefix (e.g. DescriptionCode)
+        if data[start + len(start_tag):start + len(start_tag) + 1] in (b'>', b'/', b' ', b'\t', b'\r', b'\n'):
+            if skip == 0:
+                return start
+            skip -= 1
+        start = data.find(start_tag, start + 1)
+    return -1
+
+
+def _same_line_index(element: ET._Element) -> int:
+    """Return how many elements with the same tag start earlier on the element's line."""
+    index = 0
+    for other in element.getroottree().iter(element.tag):
+        if other is element:
+            break
+        if other.sourceline == element.sourceline:
+            index += 1
+    return index
+
+
+def _text_length(data: Any, start: int, end: int) -> int:
+    """Return the length of the parsed text of ``data[start:end]`` without copying it.
+
+    Only uses the buffer protocol, so ``data`` may be bytes or an mmap.
+    """
+    skipped = sum(match.end() - match.start() for match in _NON_CHARACTER_BYTES.finditer(data, start, end))
+    return end - start - skipped
+
+
+def _cdata_payload_view(data: bytes, description: ET._Element) -> Optional[memoryview]:
+    """Locate the CDATA payload of ``description`` in the raw document bytes.
+
+    The search starts at the enclosing ExternalReference start tag, so a
+    Description earlier on the same line (e.g. in a minified document) is
+    not taken for it, and the located text is checked against the element
+    text (length and first characters) before it is used.
+
+    Returns a memoryview over ``data`` (no copy), or None when the payload
+    cannot be sliced safely (not UTF-8, not a single CDATA section, not
+    matching the element text, ...), in which case the caller falls back
+    to the element text.
+    """
+    encoding = (description.getroottree().docinfo.encoding or 'UTF-8').upper()
+    reference = description.getparent()
+    if encoding not in ('UTF-8', 'UTF8') or reference is None or not reference.sourceline:
+        return None
+
+    offset = _line_offset(data, reference.sourceline)
+    if offset < 0:
+        return None
+    start = _find_start_tag(data, reference, offset, _same_line_index(reference))
+    if start < 0:
+        return None
+    start = _find_start_tag(data, description, start)
+    if start < 0:
+        return None
+
+    content_start = data.find(b'>', start) + 1
+    match = _CDATA_OPEN.match(data, content_start)
+    if match is None:
+        return None
+    end = data.find(b']]>', match.end())
+    closing = _CLOSING_TAG.match(data, end + 3) if end >= 0 else None
+    if closing is None:
+        return None
+
+    # The element text is the content between the tags without the CDATA
+    # markers (12 characters), with line breaks normalized to \n; the
+    # prefix compared stops at the first line break for the same reason
+    text = description.text or ''
+    content_end = closing.end() - 2
+    length = _text_length(data, content_start, content_end) - 12
+    prefix = text.lstrip()[:CDATA_CHECK_CHARS].partition('\n')[0].encode('utf-8')
+    if length != len(text) or data[match.end():match.end() + len(prefix)] != prefix:
+        return None
+
+    return memoryview(data)[match.end():end]
+
+
+def unwrap_invoice(root: ET._Element, source: str = 'document', data: Optional[bytes] = None) -> Tuple[ET._Element, int]:
+    """Locate the Invoice element in a parsed document, reporting copies.
+
+    When the raw bytes the document was parsed from are given, the CDATA
+    payload of an AttachedDocument is handed to the parser as a memoryview
+    slice of that buffer, so no intermediate str/bytes copy is made.
+    Otherwise (or when the payload cannot be sliced) it goes through the
+    element text, which costs a str copy, a stripped copy and an encoded
+    copy.
 
     Args:
-        xml_path: Path to the XML file
+        root: Root element of the parsed XML document
+        source: Name of the document, used in error messages
+        data: Raw bytes ``root`` was parsed from, if available
 
     Returns:
-        The Invoice root element
+        Tuple of (Invoice root element, payload bytes copied before parsing)
 
     Raises:
-        ParseError: If XML cannot be parsed or invoice not found
+        ParseError: If the embedded XML cannot be parsed or invoice not found
     """
-    try:
-        # Parse the outer XML
-        tree = ET.parse(xml_path)
-        root = tree.getroot()
+    with stage_timer('unwrap'):
+        invoice_root, bytes_copied = _unwrap_invoice(root, source, data)
+    inc('fac2csv_payload_bytes_copied_total', bytes_copied)
+    return invoice_root, bytes_copied
+
 
+def _unwrap_invoice(root: ET._Element, source: str, data: Optional[bytes]) -> Tuple[ET._Element, int]:
+    """Implementation of ``unwrap_invoice``."""
+    bytes_copied = 0
+    try:
         # Check if this is already an Invoice document
         if root.tag.endswith('Invoice'):
-            return root
+            return root, bytes_copied
 
         # Try to extract embedded invoice from AttachedDocument
         if root.tag.endswith('AttachedDocument'):
-            # Look for the CDATA content in cac:Attachment/cac:ExternalReference/cbc:Description
-            description_elem = root.find('.//cac:ExternalReference/cbc:Description', NAMESPACES)
-
-            if description_elem is not None and description_elem.text:
+            description_elem = _find_description(root)
+            payload = None
+
+            if description_elem is not None and data is not None:
+                payload = _cdata_payload_view(data, description_elem)
+
+            if payload is not None:
+                try:
+                    embedded_root = ET.fromstring(payload)
+                except (TypeError, ValueError):
+                    # lxml without buffer support
+                    embedded_root = ET.fromstring(bytes(payload))
+                    bytes_copied += len(payload)
+            elif description_elem is not None and description_elem.text:
                 # Parse the embedded XML
-                embedded_xml = description_elem.text.strip()
-                embedded_root = ET.fromstring(embedded_xml.encode('utf-8'))
+                embedded_text = description_elem.text
+                embedded_xml = embedded_text.strip()
+                encoded = embedded_xml.encode('utf-8')
+                bytes_copied += len(embedded_text) + len(encoded)
+                if embedded_xml is not embedded_text:
+                    bytes_copied += len(embedded_xml)
+                embedded_root = ET.fromstring(encoded)
+            else:
+                embedded_root = None
 
-                if embedded_root.tag.endswith('Invoice'):
-                    return embedded_root
+            if embedded_root is not None and embedded_root.tag.endswith('Invoice'):
+                logger.debug(f"Unwrapped invoice from {source}, {bytes_copied} payload bytes copied")
+                return embedded_root, bytes_copied
 
         # If we get here, we couldn't find an invoice
-        raise ParseError(f"Could not find Invoice element in {xml_path}")
+        raise ParseError(f"Could not find Invoice element in {source}")
 
+    except ParseError:
+        raise
     except ET.XMLSyntaxError as e:
-        raise ParseError(f"XML syntax error in {xml_path}: {e}")
+        raise ParseError(f"XML syntax error in {source}: {e}")
     except Exception as e:
-        raise ParseError(f"Error extracting invoice from {xml_path}: {e}")
+        raise ParseError(f"Error extracting invoice from {source}: {e}")
+
 
+def find_invoice_element(root: ET._Element, source: str = 'document', data: Optional[bytes] = None) -> ET._Element:
+    """Locate the Invoice element in an already parsed document.
 
-def safe_find_text(element: ET._Element, xpath: str, namespaces: Dict[str, str], default: str = '') -> str:
-    """Safely extract text from an XML element.
+    Accepts either a bare Invoice root or an AttachedDocument wrapper whose
+    cac:Attachment carries the invoice in a CDATA section.
 
     Args:
-        element: The XML element to search in
-        xpath: XPath expression
-        namespaces: Namespace dictionary
-        default: Default value if element not found
+        root: Root element of the parsed XML document
+        source: Name of the document, used in error messages
+        data: Raw bytes ``root`` was parsed from, if available (enables
+            parsing the embedded invoice without copying it)
 
     Returns:
-        Element text or default value
+        The Invoice root element
+
+    Raises:
+        ParseError: If the embedded XML cannot be parsed or invoice not found
     """
-    try:
-        found = element.find(xpath, namespaces)
-        return found.text.strip() if found is not None and found.text else default
-    except Exception as e:
-        logger.warning(f"Error finding element '{xpath}': {e}")
-        return default
+    return unwrap_invoice(root, source, data)[0]
 
 
-def safe_find_attribute(element: ET._Element, xpath: str, attr: str, namespaces: Dict[str, str], default: str = '') -> str:
-    """Safely extract an attribute from an XML element.
+def extract_embedded_invoice(xml_path: str) -> ET._Element:
+    """Extract the embedded Invoice XML from AttachedDocument wrapper.
+
+    DIAN invoices may come wrapped in an AttachedDocument with the actual
+    invoice embedded in a CDATA section within cac:Attachment.
 
     Args:
-        element: The XML element to search in
-        xpath: XPath expression
-        attr: Attribute name
-        namespaces: Namespace dictionary
-        default: Default value if element/attribute not found
+        xml_path: Path to the XML file
 
     Returns:
-        Attribute value or default value
+        The Invoice root element
+
+    Raises:
+        ParseError: If XML cannot be parsed or invoice not found
     """
     try:
-        found = element.find(xpath, namespaces)
-        return found.get(attr, default) if found is not None else default
+        # Read once and parse the outer XML from the buffer, so the embedded
+        # invoice can be parsed from a slice of it
+        with open(xml_path, 'rb') as xml_file:
+            data = xml_file.read()
+        root = ET.fromstring(data, base_url=xml_path)
+    except ET.XMLSyntaxError as e:
+        raise ParseError(f"XML syntax error in {xml_path}: {e}")
     except Exception as e:
-        logger.warning(f"Error finding attribute '{attr}' in '{xpath}': {e}")
-        return default
+        raise ParseError(f"Error extracting invoice from {xml_path}: {e}")
+
+    return find_invoice_element(root, xml_path, data)
+
+
+class FieldSpec(NamedTuple):
+    """Declarative mapping of an output field to one or more XML paths.
+
+    ``paths`` are anchored paths ('a/b', 'a[b="x"]') relative to the section
+    element, tried in order until one yields a non-empty value. Only when
+    all of them miss are the ``fallbacks`` tried; these may use './/' to
+    search the whole subtree. A trailing '/@name' reads an attribute
+    instead of the element text.
+    """
+    name: str
+    paths: Tuple[str, ...]
+    fallbacks: Tuple[str, ...] = ()
+
+
+class SectionSpec(NamedTuple):
+    """A group of fields evaluated against a common scope element.
+
+    ``scope`` selects the first matching element below the invoice (None
+    means the invoice root itself), with ``scope_fallback`` searched only
+    when it misses; when both are absent every field takes the ``missing``
+    value.
+    """
+    scope: Optional[str]
+    fields: Tuple[FieldSpec, ...]
+    missing: str = ''
+    scope_fallback: Optional[str] = None
+
+
+# Field mapping tables. Adding a field to the output is a change here only.
+# Anchored paths follow the UBL 2.1 / DIAN layout; the './/' fallbacks keep
+# documents with a non-standard layout working and are counted when used.
+# Optional elements (due date, billing period, postal zone, discounts) have
+# no fallback, since a miss there is the common case and would cost a scan
+# of the whole document on most invoices.
+GENERAL_SECTION = SectionSpec(None, (
+    FieldSpec('numero_factura', ('cbc:ID',), ('.//cbc:ID',)),
+    # Prefix from CorporateRegistrationScheme
+    FieldSpec(
+        'prefijo',
+        ('cac:AccountingSupplierParty/cac:Party/cac:PartyLegalEntity/cac:CorporateRegistrationScheme/cbc:ID',),
+        ('.//cac:AccountingSupplierParty//cac:CorporateRegistrationScheme/cbc:ID',)
+    ),
+    # CUFE: schemeName attribute, or the UUID value when it is missing
+    FieldSpec('cufe', ('cbc:UUID/@schemeName', 'cbc:UUID'), ('.//cbc:UUID/@schemeName', './/cbc:UUID')),
+    FieldSpec('fecha_emision', ('cbc:IssueDate',), ('.//cbc:IssueDate',)),
+    FieldSpec('hora_emision', ('cbc:IssueTime',), ('.//cbc:IssueTime',)),
+    FieldSpec('fecha_vencimiento', ('cbc:DueDate',)),
+    # Billing period (if exists)
+    FieldSpec('periodo_inicio', ('cac:InvoicePeriod/cbc:StartDate',)),
+    FieldSpec('periodo_fin', ('cac:InvoicePeriod/cbc:EndDate',)),
+))
+
+CUSTOMER_SECTION = SectionSpec(
+    'cac:AccountingCustomerParty/cac:Party',
+    (
+        FieldSpec(
+            'cliente_nombre',
+            ('cac:PartyTaxScheme/cbc:RegistrationName', 'cac:PartyName/cbc:Name'),
+            ('.//cac:PartyTaxScheme/cbc:RegistrationName', './/cac:PartyName/cbc:Name')
+        ),
+        FieldSpec(
+            'cliente_nit',
+            ('cac:PartyTaxScheme/cbc:CompanyID', 'cac:PartyIdentification/cbc:ID'),
+            ('.//cac:PartyTaxScheme/cbc:CompanyID', './/cac:PartyIdentification/cbc:ID')
+        ),
+        FieldSpec(
+            'cliente_direccion',
+            ('cac:PhysicalLocation/cac:Address/cac:AddressLine/cbc:Line',),
+            ('.//cac:PhysicalLocation/cac:Address//cac:AddressLine/cbc:Line',)
+        ),
+        FieldSpec('cliente_codigo_postal', ('cac:PhysicalLocation/cac:Address/cbc:PostalZone',)),
+        FieldSpec(
+            'cliente_municipio',
+            ('cac:PhysicalLocation/cac:Address/cbc:CityName',),
+            ('.//cac:PhysicalLocation/cac:Address//cbc:CityName',)
+        ),
+    ),
+    scope_fallback='.//cac:AccountingCustomerParty/cac:Party'
+)
+
+SUPPLIER_SECTION = SectionSpec(
+    'cac:AccountingSupplierParty/cac:Party',
+    (
+        FieldSpec(
+            'emisor_nombre',
+            ('cac:PartyTaxScheme/cbc:RegistrationName', 'cac:PartyName/cbc:Name'),
+            ('.//cac:PartyTaxScheme/cbc:RegistrationName', './/cac:PartyName/cbc:Name')
+        ),
+        FieldSpec(
+            'emisor_nit',
+            ('cac:PartyTaxScheme/cbc:CompanyID', 'cac:PartyIdentification/cbc:ID'),
+            ('.//cac:PartyTaxScheme/cbc:CompanyID', './/cac:PartyIdentification/cbc:ID')
+        ),
+        FieldSpec(
+            'emisor_direccion',
+            ('cac:PhysicalLocation/cac:Address/cac:AddressLine/cbc:Line',),
+            ('.//cac:PhysicalLocation/cac:Address//cac:AddressLine/cbc:Line',)
+        ),
+    ),
+    scope_fallback='.//cac:AccountingSupplierParty/cac:Party'
+)
+
+MONETARY_SECTION = SectionSpec(
+    'cac:LegalMonetaryTotal',
+    (
+        FieldSpec('subtotal', ('cbc:TaxExclusiveAmount',), ('.//cbc:TaxExclusiveAmount',)),
+        FieldSpec('descuentos_totales', ('cbc:AllowanceTotalAmount',)),
+        FieldSpec('total_pagar', ('cbc:PayableAmount',), ('.//cbc:PayableAmount',)),
+    ),
+    missing='0.00',
+    scope_fallback='.//cac:LegalMonetaryTotal'
+)
+
+# IVA is the invoice-level tax subtotal whose scheme ID is '01'. There is no
+# fallback: a whole-tree search would pick up line-level IVA subtotals.
+IVA_SECTION = SectionSpec(
+    'cac:TaxTotal/cac:TaxSubtotal[normalize-space(cac:TaxCategory/cac:TaxScheme/cbc:ID)="01"]',
+    (
+        FieldSpec('iva_porcentaje', ('cac:TaxCategory/cbc:Percent',), ('.//cac:TaxCategory/cbc:Percent',)),
+        FieldSpec('iva_monto', ('cbc:TaxAmount',), ('.//cbc:TaxAmount',)),
+    ),
+    missing='0.00'
+)
+
+INVOICE_LINES_PATH = 'cac:InvoiceLine'
+INVOICE_LINES_FALLBACK = './/cac:InvoiceLine'
+
+# Line fields are anchored to the InvoiceLine so nested item IDs are not picked up
+LINE_SECTION = SectionSpec(None, (
+    FieldSpec('linea_numero', ('cbc:ID',), ('.//cbc:ID',)),
+    FieldSpec('linea_descripcion', ('cac:Item/cbc:Description',), ('.//cac:Item/cbc:Description',)),
+    FieldSpec('linea_cantidad', ('cbc:InvoicedQuantity',), ('.//cbc:InvoicedQuantity',)),
+    FieldSpec('linea_precio_unitario', ('cac:Price/cbc:PriceAmount',), ('.//cac:Price/cbc:PriceAmount',)),
+    FieldSpec('linea_total', ('cbc:LineExtensionAmount',), ('.//cbc:LineExtensionAmount',)),
+))
+
+# Discount percentage (if exists in AllowanceCharge)
+LINE_DISCOUNT_SECTION = SectionSpec(
+    'cac:AllowanceCharge[cbc:ChargeIndicator="false"]',
+    (
+        FieldSpec(
+            'linea_descuento_porcentaje',
+            ('cbc:MultiplierFactorNumeric',),
+            ('.//cbc:MultiplierFactorNumeric',)
+        ),
+    ),
+    missing='0.00'
+)
+
+# The document's CUFE (cbc:UUID value), used to identify an invoice. Not an
+# output column: the 'cufe' column holds the scheme name.
+DOCUMENT_KEY_SECTION = SectionSpec(None, (
+    FieldSpec('uuid', ('cbc:UUID',), ('.//cbc:UUID',)),
+))
+
+def _count_fallback(name: str) -> None:
+    """Record that an anchored path missed and its fallback search ran.
+
+    Counted in ``fac2csv_parse_fallbacks_total`` by field name; section
+    scopes are reported as ``<first field>:scope`` and the line list as
+    ``lineas``.
+    """
+    inc('fac2csv_parse_fallbacks_total', field=name)
+
+
+class _CompiledSection(NamedTuple):
+    """A SectionSpec with every path compiled to an XPath object."""
+    name: str
+    scope: Optional[ET.XPath]
+    scope_fallback: Optional[ET.XPath]
+    fields: Tuple[Tuple[str, tuple, tuple], ...]
+    missing: str
+
+
+def _split_steps(path: str) -> List[str]:
+    """Split a path on '/' outside predicates; '//' yields an empty step."""
+    steps = []
+    depth = 0
+    current = ''
+    for char in path:
+        if char == '[':
+            depth += 1
+        elif char == ']':
+            depth -= 1
+        if char == '/' and depth == 0:
+            steps.append(current)
+            current = ''
+        else:
+            current += char
+    steps.append(current)
+    return steps
+
+
+def _to_xpath(path: str, first_only: bool = True) -> str:
+    """Translate a table path into an XPath expression.
+
+    './/a/b//c' is rewritten as 'descendant::c[ancestor::b[parent::a]][1]':
+    the last step is searched for and the leading ones, right to left, are
+    checked as predicates on its ancestors. It selects the same first match
+    in document order but lets libxml2 stop the descendant scan at the
+    first hit instead of collecting every match of the path.
+    """
+    if not path.startswith('.//'):
+        return path
+
+    steps = _split_steps(path[3:])
+    elements = [step for step in steps if step]
+    # Axis linking each element to the next one: 'a/b' -> parent, 'a//b' -> ancestor
+    axes = []
+    for index, step in enumerate(steps[1:], start=1):
+        if step:
+            axes.append('ancestor' if steps[index - 1] == '' else 'parent')
+
+    # Nest the leading steps as predicates, leftmost innermost
+    predicate = ''
+    for element, axis in zip(elements[:-1], axes):
+        predicate = f"[{axis}::{element}{predicate}]"
+    expression = f"descendant::{elements[-1]}{predicate}"
+    return f"{expression}[1]" if first_only else expression
+
+
+def _compile_path(path: str, first_only: bool = True) -> Tuple[ET.XPath, Optional[str]]:
+    """Compile a table path, splitting off a trailing '/@attribute'."""
+    attribute = None
+    head, sep, tail = path.rpartition('/@')
+    if sep:
+        path, attribute = head, tail
+    return ET.XPath(_to_xpath(path, first_only), namespaces=NAMESPACES), attribute
+
+
+def compile_section(spec: SectionSpec) -> _CompiledSection:
+    """Compile a SectionSpec into XPath objects.
+
+    Args:
+        spec: Section mapping table
+
+    Returns:
+        Compiled section, to be evaluated with ``extract_section``
+    """
+    scope = _compile_path(spec.scope)[0] if spec.scope else None
+    scope_fallback = _compile_path(spec.scope_fallback)[0] if spec.scope_fallback else None
+    fields = tuple(
+        (
+            field.name,
+            tuple(_compile_path(path) for path in field.paths),
+            tuple(_compile_path(path) for path in field.fallbacks)
+        )
+        for field in spec.fields
+    )
+    name = f"{spec.fields[0].name}:scope" if spec.fields else 'scope'
+    return _CompiledSection(name, scope, scope_fallback, fields, spec.missing)
+
+
+def _first_value(context: ET._Element, finders: tuple) -> str:
+    """Return the first non-empty value produced by a list of finders."""
+    for xpath, attribute in finders:
+        found = xpath(context)
+        if found:
+            element = found[0]
+            if attribute:
+                value = element.get(attribute, '')
+            else:
+                value = element.text.strip() if element.text else ''
+            if value:
+                return value
+    return ''
+
+
+def extract_section(
+    context: ET._Element,
+    section: _CompiledSection,
+    target: Optional[MutableMapping] = None
+) -> MutableMapping:
+    """Evaluate a compiled section against an element.
+
+    Anchored paths are evaluated first; fallback searches only run (and are
+    counted) when they miss.
+
+    Args:
+        context: Element the section paths are relative to
+        section: Compiled section from ``compile_section``
+        target: Mapping (dict or record) the fields are stored in; a new
+            dict when omitted
+
+    Returns:
+        ``target`` with one entry per field in the section
+    """
+    data = {} if target is None else target
+
+    if section.scope is not None:
+        found = section.scope(context)
+        if not found and section.scope_fallback is not None:
+            _count_fallback(section.name)
+            found = section.scope_fallback(context)
+        if not found:
+            for name, _, _ in section.fields:
+                data[name] = section.missing
+            return data
+        context = found[0]
+
+    for name, finders, fallbacks in section.fields:
+        value = _first_value(context, finders)
+        if not value and fallbacks:
+            _count_fallback(name)
+            value = _first_value(context, fallbacks)
+        data[name] = value
+    return data
+
+
+# Compiled once at import and shared by every invoice
+_GENERAL = compile_section(GENERAL_SECTION)
+_CUSTOMER = compile_section(CUSTOMER_SECTION)
+_SUPPLIER = compile_section(SUPPLIER_SECTION)
+_MONETARY = compile_section(MONETARY_SECTION)
+_IVA = compile_section(IVA_SECTION)
+_LINE = compile_section(LINE_SECTION)
+_LINE_DISCOUNT = compile_section(LINE_DISCOUNT_SECTION)
+_DOCUMENT_KEY = compile_section(DOCUMENT_KEY_SECTION)
+_INVOICE_LINES = _compile_path(INVOICE_LINES_PATH, first_only=False)[0]
+_INVOICE_LINES_FALLBACK = _compile_path(INVOICE_LINES_FALLBACK, first_only=False)[0]
 
 
 def parse_invoice_general(invoice_root: ET._Element) -> Dict[str, Any]:
@@ -125,41 +616,12 @@ def parse_invoice_general(invoice_root: ET._Element) -> Dict[str, Any]:
     data = {}
 
     try:
-        # Basic invoice info
-        data['numero_factura'] = safe_find_text(invoice_root, './/cbc:ID', NAMESPACES)
-
-        # Extract prefix from CorporateRegistrationScheme
-        data['prefijo'] = safe_find_text(
-            invoice_root,
-            './/cac:AccountingSupplierParty//cac:CorporateRegistrationScheme/cbc:ID',
-            NAMESPACES
-        )
-
-        # CUFE
-        data['cufe'] = safe_find_attribute(invoice_root, './/cbc:UUID', 'schemeName', NAMESPACES)
-        if not data['cufe']:  # If schemeName not found, get the UUID value
-            data['cufe'] = safe_find_text(invoice_root, './/cbc:UUID', NAMESPACES)
+        data = extract_section(invoice_root, _GENERAL)
 
-        # Dates and times
-        data['fecha_emision'] = safe_find_text(invoice_root, './/cbc:IssueDate', NAMESPACES)
-        issue_time = safe_find_text(invoice_root, './/cbc:IssueTime', NAMESPACES)
         # Extract just the time portion (HH:MM:SS)
+        issue_time = data['hora_emision']
         data['hora_emision'] = issue_time.split('-')[0].split('+')[0] if issue_time else ''
 
-        data['fecha_vencimiento'] = safe_find_text(invoice_root, './/cbc:DueDate', NAMESPACES)
-
-        # Billing period (if exists)
-        data['periodo_inicio'] = safe_find_text(
-            invoice_root,
-            './/cac:InvoicePeriod/cbc:StartDate',
-            NAMESPACES
-        )
-        data['periodo_fin'] = safe_find_text(
-            invoice_root,
-            './/cac:InvoicePeriod/cbc:EndDate',
-            NAMESPACES
-        )
-
     except Exception as e:
         logger.error(f"Error parsing general invoice info: {e}")
 
@@ -178,44 +640,7 @@ def parse_invoice_customer(invoice_root: ET._Element) -> Dict[str, Any]:
     data = {}
 
     try:
-        customer = invoice_root.find('.//cac:AccountingCustomerParty/cac:Party', NAMESPACES)
-
-        if customer is not None:
-            # Customer name
-            data['cliente_nombre'] = safe_find_text(
-                customer,
-                './/cac:PartyTaxScheme/cbc:RegistrationName',
-                NAMESPACES
-            )
-            if not data['cliente_nombre']:
-                data['cliente_nombre'] = safe_find_text(customer, './/cac:PartyName/cbc:Name', NAMESPACES)
-
-            # Customer NIT/ID
-            data['cliente_nit'] = safe_find_text(
-                customer,
-                './/cac:PartyTaxScheme/cbc:CompanyID',
-                NAMESPACES
-            )
-            if not data['cliente_nit']:
-                data['cliente_nit'] = safe_find_text(customer, './/cac:PartyIdentification/cbc:ID', NAMESPACES)
-
-            # Customer address
-            address = customer.find('.//cac:PhysicalLocation/cac:Address', NAMESPACES)
-            if address is not None:
-                data['cliente_direccion'] = safe_find_text(address, './/cac:AddressLine/cbc:Line', NAMESPACES)
-                data['cliente_codigo_postal'] = safe_find_text(address, './/cbc:PostalZone', NAMESPACES)
-                data['cliente_municipio'] = safe_find_text(address, './/cbc:CityName', NAMESPACES)
-            else:
-                data['cliente_direccion'] = ''
-                data['cliente_codigo_postal'] = ''
-                data['cliente_municipio'] = ''
-        else:
-            data['cliente_nombre'] = ''
-            data['cliente_nit'] = ''
-            data['cliente_direccion'] = ''
-            data['cliente_codigo_postal'] = ''
-            data['cliente_municipio'] = ''
-
+        data = extract_section(invoice_root, _CUSTOMER)
     except Exception as e:
         logger.error(f"Error parsing customer info: {e}")
 
@@ -234,38 +659,7 @@ def parse_invoice_supplier(invoice_root: ET._Element) -> Dict[str, Any]:
     data = {}
 
     try:
-        supplier = invoice_root.find('.//cac:AccountingSupplierParty/cac:Party', NAMESPACES)
-
-        if supplier is not None:
-            # Supplier name
-            data['emisor_nombre'] = safe_find_text(
-                supplier,
-                './/cac:PartyTaxScheme/cbc:RegistrationName',
-                NAMESPACES
-            )
-            if not data['emisor_nombre']:
-                data['emisor_nombre'] = safe_find_text(supplier, './/cac:PartyName/cbc:Name', NAMESPACES)
-
-            # Supplier NIT
-            data['emisor_nit'] = safe_find_text(
-                supplier,
-                './/cac:PartyTaxScheme/cbc:CompanyID',
-                NAMESPACES
-            )
-            if not data['emisor_nit']:
-                data['emisor_nit'] = safe_find_text(supplier, './/cac:PartyIdentification/cbc:ID', NAMESPACES)
-
-            # Supplier address
-            address = supplier.find('.//cac:PhysicalLocation/cac:Address', NAMESPACES)
-            if address is not None:
-                data['emisor_direccion'] = safe_find_text(address, './/cac:AddressLine/cbc:Line', NAMESPACES)
-            else:
-                data['emisor_direccion'] = ''
-        else:
-            data['emisor_nombre'] = ''
-            data['emisor_nit'] = ''
-            data['emisor_direccion'] = ''
-
+        data = extract_section(invoice_root, _SUPPLIER)
     except Exception as e:
         logger.error(f"Error parsing supplier info: {e}")
 
@@ -285,33 +679,10 @@ def parse_invoice_amounts(invoice_root: ET._Element) -> Dict[str, Any]:
 
     try:
         # Total amounts from LegalMonetaryTotal
-        monetary = invoice_root.find('.//cac:LegalMonetaryTotal', NAMESPACES)
-
-        if monetary is not None:
-            data['subtotal'] = safe_find_text(monetary, './/cbc:TaxExclusiveAmount', NAMESPACES)
-            data['descuentos_totales'] = safe_find_text(monetary, './/cbc:AllowanceTotalAmount', NAMESPACES)
-            data['total_pagar'] = safe_find_text(monetary, './/cbc:PayableAmount', NAMESPACES)
-        else:
-            data['subtotal'] = '0.00'
-            data['descuentos_totales'] = '0.00'
-            data['total_pagar'] = '0.00'
+        data = extract_section(invoice_root, _MONETARY)
 
         # IVA information from TaxTotal
-        iva_found = False
-        tax_totals = invoice_root.findall('.//cac:TaxTotal/cac:TaxSubtotal', NAMESPACES)
-
-        for tax_subtotal in tax_totals:
-            tax_id = safe_find_text(tax_subtotal, './/cac:TaxScheme/cbc:ID', NAMESPACES)
-
-            if tax_id == '01':  # IVA
-                data['iva_porcentaje'] = safe_find_text(tax_subtotal, './/cac:TaxCategory/cbc:Percent', NAMESPACES)
-                data['iva_monto'] = safe_find_text(tax_subtotal, './/cbc:TaxAmount', NAMESPACES)
-                iva_found = True
-                break
-
-        if not iva_found:
-            data['iva_porcentaje'] = '0.00'
-            data['iva_monto'] = '0.00'
+        data.update(extract_section(invoice_root, _IVA))
 
         # Consumption taxes (voice and data) - usually not present, defaulting to 0
         data['imp_consumo_voz'] = '0.00'
@@ -323,58 +694,305 @@ def parse_invoice_amounts(invoice_root: ET._Element) -> Dict[str, Any]:
     return data
 
 
-def parse_invoice_lines(invoice_root: ET._Element) -> List[Dict[str, Any]]:
+def parse_invoice_cufe(invoice_root: ET._Element) -> str:
+    """Extract the CUFE (the cbc:UUID value) that identifies an invoice.
+
+    Args:
+        invoice_root: Invoice XML root element
+
+    Returns:
+        CUFE string, empty if the invoice has none
+    """
+    try:
+        return extract_section(invoice_root, _DOCUMENT_KEY)['uuid']
+    except Exception as e:
+        logger.error(f"Error parsing CUFE: {e}")
+        return ''
+
+
+def parse_invoice_line(line: ET._Element) -> InvoiceLine:
+    """Extract the fields of a single cac:InvoiceLine element.
+
+    Args:
+        line: InvoiceLine XML element
+
+    Returns:
+        InvoiceLine record with the line item fields
+    """
+    line_data = InvoiceLine()
+    extract_section(line, _LINE, line_data)
+    extract_section(line, _LINE_DISCOUNT, line_data)
+    return line_data
+
+
+def parse_invoice_lines(invoice_root: ET._Element) -> List[InvoiceLine]:
     """Extract invoice line items.
 
     Args:
         invoice_root: Invoice XML root element
 
     Returns:
-        List of dictionaries with line item fields
+        List of InvoiceLine records
     """
     lines = []
 
     try:
-        invoice_lines = invoice_root.findall('.//cac:InvoiceLine', NAMESPACES)
+        invoice_lines = _INVOICE_LINES(invoice_root)
+        if not invoice_lines:
+            _count_fallback('lineas')
+            invoice_lines = _INVOICE_LINES_FALLBACK(invoice_root)
 
         for line in invoice_lines:
-            line_data = {}
+            lines.append(parse_invoice_line(line))
 
-            line_data['linea_numero'] = safe_find_text(line, './/cbc:ID', NAMESPACES)
-            line_data['linea_descripcion'] = safe_find_text(line, './/cac:Item/cbc:Description', NAMESPACES)
-            line_data['linea_cantidad'] = safe_find_text(line, './/cbc:InvoicedQuantity', NAMESPACES)
+    except Exception as e:
+        logger.error(f"Error parsing invoice lines: {e}")
 
-            # Unit price
-            price_amount = safe_find_text(line, './/cac:Price/cbc:PriceAmount', NAMESPACES)
-            line_data['linea_precio_unitario'] = price_amount
+    return lines
 
-            # Line total
-            line_data['linea_total'] = safe_find_text(line, './/cbc:LineExtensionAmount', NAMESPACES)
 
-            # Discount percentage (if exists in AllowanceCharge)
-            discount_elem = line.find('.//cac:AllowanceCharge[cbc:ChargeIndicator="false"]', NAMESPACES)
-            if discount_elem is not None:
-                discount_pct = safe_find_text(discount_elem, './/cbc:MultiplierFactorNumeric', NAMESPACES)
-                line_data['linea_descuento_porcentaje'] = discount_pct
-            else:
-                line_data['linea_descuento_porcentaje'] = '0.00'
+def parse_invoice_header(invoice_root: ET._Element) -> Invoice:
+    """Extract every invoice-level field (everything except line items).
 
-            lines.append(line_data)
+    Args:
+        invoice_root: Invoice XML root element
 
-    except Exception as e:
-        logger.error(f"Error parsing invoice lines: {e}")
+    Returns:
+        Invoice record with general, customer, supplier and amount fields
+        and no line items
+    """
+    # Parse all sections
+    data = Invoice()
+    data.update(parse_invoice_general(invoice_root))
+    data.update(parse_invoice_customer(invoice_root))
+    data.update(parse_invoice_supplier(invoice_root))
+    data.update(parse_invoice_amounts(invoice_root))
+    return data
 
-    return lines
+
+def parse_invoice_element(invoice_root: ET._Element) -> Invoice:
+    """Extract all required fields from an Invoice element.
+
+    Args:
+        invoice_root: Invoice XML root element (already unwrapped)
+
+    Returns:
+        Invoice record containing all invoice data including line items
+    """
+    with stage_timer('parse'):
+        data = parse_invoice_header(invoice_root)
+
+        # Parse line items separately
+        data['lineas'] = parse_invoice_lines(invoice_root)
+
+    inc('fac2csv_invoices_total')
+    inc('fac2csv_lines_total', len(data['lineas']))
+    return data
+
+
+INVOICE_LINE_TAG = f"{{{NAMESPACES['cac']}}}InvoiceLine"
+# Expat reports namespaced tags as 'uri}local'
+EXTERNAL_REFERENCE_TAG = f"{NAMESPACES['cac']}}}ExternalReference"
+DESCRIPTION_TAG = f"{NAMESPACES['cbc']}}}Description"
+
+# Bytes read from the source per parser feed in streaming mode
+STREAM_CHUNK_SIZE = 64 * 1024
+
+
+class _EmbeddedInvoiceHandler:
+    """Expat handlers that capture the AttachedDocument payload in pieces.
+
+    Only the first cac:ExternalReference/cbc:Description is captured (the
+    second one, when present, holds the DIAN ApplicationResponse). Expat
+    reports CDATA content as it arrives, whereas libxml2 buffers a whole
+    CDATA section, so the payload is never held in memory as a whole.
+    """
+
+    def __init__(self):
+        self.pending = []
+        self.started = False
+        self.done = False
+        self._stack = []
+
+    def start(self, tag, attrib):
+        self._stack.append(tag)
+
+    def end(self, tag):
+        if self._capturing():
+            self.done = True
+        self._stack.pop()
+
+    def data(self, text):
+        if not self._capturing():
+            return
+        if not self.started:
+            # The XML declaration must be the first thing the inner parser sees
+            text = text.lstrip()
+            if not text:
+                return
+            self.started = True
+        self.pending.append(text)
+
+    def _capturing(self):
+        return (
+            not self.done
+            and len(self._stack) >= 2
+            and self._stack[-1] == DESCRIPTION_TAG
+            and self._stack[-2] == EXTERNAL_REFERENCE_TAG
+        )
 
 
-def parse_single_invoice(xml_path: str) -> Dict[str, Any]:
+def _iter_chunks(fileobj: Any) -> Iterator[bytes]:
+    """Read a binary file object in STREAM_CHUNK_SIZE pieces."""
+    while True:
+        chunk = fileobj.read(STREAM_CHUNK_SIZE)
+        if not chunk:
+            return
+        yield chunk
+
+
+def _sniff_root_tag(head: bytes) -> Optional[str]:
+    """Return the root tag found in the first bytes of a document."""
+    parser = ET.XMLPullParser(events=('start',))
+    parser.feed(head)
+    for _, elem in parser.read_events():
+        return elem.tag
+    return None
+
+
+def _stream_invoice_chunks(chunks: Iterator[bytes]) -> Iterator[Union[Invoice, InvoiceLine]]:
+    """Pull-parse an Invoice document, yielding the header and then each line."""
+    # Only InvoiceLine events reach Python; everything else is built by libxml2
+    parser = ET.XMLPullParser(events=('start', 'end'), tag=INVOICE_LINE_TAG, huge_tree=True)
+    header_sent = False
+    root = None
+
+    for chunk in chunks:
+        parser.feed(chunk)
+        for event, elem in parser.read_events():
+            if root is None:
+                root = elem.getroottree().getroot()
+            if elem.getparent() is not root:
+                # Nested InvoiceLine elements belong to their parent line
+                continue
+
+            if event == 'start':
+                if not header_sent:
+                    # Every invoice-level element precedes the first line in UBL 2.1
+                    yield parse_invoice_header(root)
+                    header_sent = True
+                continue
+
+            yield parse_invoice_line(elem)
+
+            # Free the processed line and everything before it
+            elem.clear()
+            while elem.getprevious() is not None:
+                del root[0]
+
+    root = parser.close()
+    if not header_sent:
+        if not root.tag.endswith('Invoice'):
+            raise ParseError("Could not find Invoice element")
+        # Invoice without lines
+        yield parse_invoice_header(root)
+
+
+def _embedded_invoice_chunks(chunks: Iterator[bytes]) -> Iterator[bytes]:
+    """Turn the chunks of an AttachedDocument into chunks of its payload."""
+    handler = _EmbeddedInvoiceHandler()
+    parser = expat.ParserCreate(namespace_separator='}')
+    parser.StartElementHandler = handler.start
+    parser.EndElementHandler = handler.end
+    parser.CharacterDataHandler = handler.data
+
+    try:
+        for chunk in chunks:
+            parser.Parse(chunk, False)
+            if handler.pending:
+                payload = ''.join(handler.pending).encode('utf-8')
+                handler.pending.clear()
+                yield payload
+            if handler.done:
+                # The rest of the wrapper is not needed
+                return
+
+        parser.Parse(b'', True)
+    except expat.ExpatError as e:
+        raise ParseError(f"XML syntax error in AttachedDocument: {e}")
+
+    if not handler.started:
+        raise ParseError("Could not find Invoice element")
+
+
+def stream_invoice(xml_source: Union[str, Any]) -> Iterator[Union[Invoice, InvoiceLine]]:
+    """Stream a DIAN invoice with memory that stays flat in the line count.
+
+    The document is fed to a pull parser in STREAM_CHUNK_SIZE pieces and
+    only one ``cac:InvoiceLine`` is materialized at a time: processed lines
+    (and the header elements before them) are cleared as soon as they have
+    been extracted. For an AttachedDocument the CDATA payload is forwarded
+    piece by piece from the wrapper parser to the invoice parser, so the
+    embedded invoice is never held in memory as a whole either.
+
+    Args:
+        xml_source: Path to the XML file or a binary file-like object
+
+    Yields:
+        First an Invoice with the invoice-level fields (as returned by
+        ``parse_invoice_header``), then one InvoiceLine per line item (as
+        returned by ``parse_invoice_line``)
+
+    Raises:
+        ParseError: If the XML cannot be parsed or no invoice is found
+    """
+    if isinstance(xml_source, str):
+        name = xml_source
+        fileobj = open(xml_source, 'rb')
+    else:
+        name = getattr(xml_source, 'name', 'stream')
+        fileobj = xml_source
+
+    try:
+        chunks = _iter_chunks(fileobj)
+        head = b''
+        root_tag = None
+        # Read until the root start tag has been seen
+        for chunk in chunks:
+            head += chunk
+            root_tag = _sniff_root_tag(head)
+            if root_tag is not None:
+                break
+
+        if root_tag is None:
+            raise ParseError("Could not find Invoice element")
+
+        source_chunks = itertools.chain([head], chunks)
+        if root_tag.endswith('AttachedDocument'):
+            source_chunks = _embedded_invoice_chunks(source_chunks)
+
+        yield from _stream_invoice_chunks(source_chunks)
+
+    except ParseError as e:
+        raise ParseError(f"{e} in {name}")
+    except ET.XMLSyntaxError as e:
+        raise ParseError(f"XML syntax error in {name}: {e}")
+    except Exception as e:
+        raise ParseError(f"Error streaming invoice from {name}: {e}")
+    finally:
+        if fileobj is not xml_source:
+            fileobj.close()
+
+
+def parse_single_invoice(xml_path: str) -> Invoice:
     """Parse a single DIAN XML invoice and extract all required fields.
 
     Args:
         xml_path: Path to the XML invoice file
 
     Returns:
-        Dictionary containing all invoice data including line items
+        Invoice record containing all invoice data including line items
+        (supports the same read access as a dictionary)
 
     Raises:
         ParseError: If the invoice cannot be parsed
@@ -383,15 +1001,7 @@ def parse_single_invoice(xml_path: str) -> Dict[str, Any]:
         # Extract the actual Invoice element (may be embedded)
         invoice_root = extract_embedded_invoice(xml_path)
 
-        # Parse all sections
-        data = {}
-        data.update(parse_invoice_general(invoice_root))
-        data.update(parse_invoice_customer(invoice_root))
-        data.update(parse_invoice_supplier(invoice_root))
-        data.update(parse_invoice_amounts(invoice_root))
-
-        # Parse line items separately
-        data['lineas'] = parse_invoice_lines(invoice_root)
+        data = parse_invoice_element(invoice_root)
 
         logger.info(f"Successfully parsed invoice: {data.get('numero_factura', 'unknown')}")
         return data